@@ -596,7 +596,8 @@ disp('Opening Animation')
 switch lower(executable)
     case 'python'
         script_name = strcat(script_name, ".py");
-        command = strcat('python', " ", script_name, " ", filename, " &");
+        % --server hands the file to a running "python make_animation.py serve" if there is one, which opens faster
+        command = strcat('python', " ", script_name, " ", filename, " --server &");
     case 'dir_exe'
         script_name = strcat("make_animation\", script_name, ".exe");
         command = strcat(script_name, " ", filename, " &");
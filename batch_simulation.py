@@ -0,0 +1,199 @@
+import sys
+import time
+
+import numpy as np
+
+import buoy_simulation
+import equilibrium
+import waves
+
+
+# Integrates many buoy configurations at once, e.g. the grid points of a C_damper/K sweep for one sea state. Every
+# member shares the wave input and a fixed-step time grid, so one RK4 step advances the whole batch with a handful of
+# NumPy operations on arrays of members, instead of one ode45 call (and its Python overhead) per configuration.
+
+
+def batch_variables(T=7.8, Hs=2.4, r_buoy=7.5, L_buoy=10, shape_buoy='sphere', added_mass_ratio=0.5, m1=None,
+                    mass_ratio=1, tube_L_max=14, tube_r_max=7, C_wave=3e5, C_damper=3e6, K=0, rho=1025, g=9.81):
+    # Array version of buoy_simulation.base_variables. Device arguments may be arrays and are broadcast together and
+    # flattened to one member per element, e.g. C_damper=c[:, None], K=k[None, :] for a 2-D grid; 'grid_shape' holds
+    # the broadcast shape to reshape results with. T and Hs describe the shared wave, so they stay scalars
+    if np.ndim(T) or np.ndim(Hs):
+        raise ValueError('T and Hs are shared by the whole batch, run one batch per sea state')
+
+    m1 = 9.057e5 * (1 + np.asarray(added_mass_ratio, dtype=float)) if m1 is None else m1
+    names = ['r_buoy', 'L_buoy', 'shape_buoy', 'm1', 'mass_ratio', 'tube_L_max', 'tube_r_max', 'C_wave', 'C_damper', 'K', 'rho', 'g']
+    arrays = np.broadcast_arrays(r_buoy, L_buoy, shape_buoy, m1, mass_ratio, tube_L_max, tube_r_max, C_wave, C_damper, K, rho, g)
+    grid_shape = arrays[0].shape
+    v = {name: np.array(array).ravel() for name, array in zip(names, arrays)}
+    for name in names:
+        if name != 'shape_buoy':
+            v[name] = v[name].astype(float)
+
+    invalid = ~np.isin(v['shape_buoy'], ['sphere', 'cylinder'])
+    if invalid.any():
+        raise ValueError("shape_buoy must be one of: 'sphere', 'cylinder'")
+
+    m2 = v['m1'] * v['mass_ratio']
+    F = 1 / T
+
+    return {'T': T, 'F': F, 'omega': 2 * np.pi * F, 'Hs': Hs, 'rho': v['rho'], 'g': v['g'],
+            'r_buoy': v['r_buoy'], 'm1': v['m1'], 'm2': m2, 'C_wave': v['C_wave'], 'C_damper': v['C_damper'], 'K': v['K'],
+            'L_max': v['tube_L_max'], 'r_max': v['tube_r_max'],
+            'L_buoy': v['L_buoy'], 'shape_buoy': v['shape_buoy'],
+            'tube_length': v['tube_L_max'], 'tube_radius': np.sqrt(m2 / (v['rho'] * np.pi * v['tube_L_max'])),
+            'buoy_equilibrium': equilibrium.equilibria(v['shape_buoy'], v['r_buoy'], v['m1'], v['rho']),
+            'grid_shape': grid_shape}
+
+
+def select(batch, members):
+    # Subset of a batch, e.g. one chunk of members
+    return {name: value[members] if isinstance(value, np.ndarray) else value for name, value in batch.items()}
+
+
+def member_count(batch):
+    return len(batch['m1'])
+
+
+def make_batch_model(batch):
+    # Vectorised right-hand side of buoy_simulation.make_model for a (4, N) state. Clipping the submersion to
+    # [0, full depth] covers the out-of-water and fully submerged branches without masks, and the per-member shape
+    # mask picks the sphere or cylinder volume
+    r = batch['r_buoy']
+    m1 = batch['m1']
+    m2 = batch['m2']
+    C_wave = batch['C_wave']
+    C_damper = batch['C_damper']
+    K = batch['K']
+    is_sphere = batch['shape_buoy'] == 'sphere'
+    full_depth = np.where(is_sphere, 2 * r, batch['L_buoy'])
+    area = np.pi * r ** 2
+    rho_g = batch['rho'] * batch['g']
+    g = batch['g']
+
+    # Work arrays reused between calls
+    submersion = np.empty_like(r)
+    volume = np.empty_like(r)
+    pto = np.empty_like(r)
+
+    def model(y, wave, wave_p, out):
+        y1, y1_p, y2, y2_p = y
+
+        np.subtract(y1, wave, out=submersion)
+        np.clip(submersion, 0, full_depth, out=submersion)
+        if is_sphere.all():
+            np.multiply(np.pi / 3 * submersion ** 2, 3 * r - submersion, out=volume)
+        elif not is_sphere.any():
+            np.multiply(area, submersion, out=volume)
+        else:
+            volume[:] = np.where(is_sphere, np.pi / 3 * submersion ** 2 * (3 * r - submersion), area * submersion)
+
+        np.multiply(C_damper, y2_p - y1_p, out=pto)
+        np.add(pto, K * (y2 - y1), out=pto)
+
+        out[0] = y1_p
+        out[1] = g - (rho_g * volume - pto + C_wave * (y1_p - wave_p)) / m1
+        out[2] = y2_p
+        np.divide(pto, m2, out=out[3])
+        np.negative(out[3], out=out[3])
+        return out
+
+    return model
+
+
+def time_grid(t_range, dt, output_every=1):
+    # Shared grid: steps of at most dt covering t_range exactly, and the times that are kept in the output
+    steps = int(np.ceil((t_range[1] - t_range[0]) / dt - 1e-9))
+    t = np.linspace(t_range[0], t_range[1], steps + 1)
+    return t, t[::output_every] if steps % output_every == 0 else np.append(t[::output_every], t[-1])
+
+
+def integrate(batch, metadata, t_range=None, dt=0.02, output_every=5, dtype=np.float64):
+    # Classic RK4 on the shared grid. Returns the output times and the motion as (members, times, 4), [y1, y1', y2, y2']
+    t_range = metadata['t_range'] if t_range is None else t_range
+    t, t_out = time_grid(t_range, dt, output_every)
+    count = member_count(batch)
+    model = make_batch_model(batch)
+
+    # The wave is the same for every member, so it is evaluated once per stage time for the whole batch
+    forcing = waves.metadata_forcing(metadata, t_range)
+    wave, wave_p = forcing.evaluate(t)
+    wave_half, wave_p_half = forcing.evaluate(t[:-1] + np.diff(t) / 2)
+
+    y = np.zeros((4, count))
+    y[0] = batch['buoy_equilibrium']
+    y[2] = batch['buoy_equilibrium']  # sim starts at equilibrium
+    k1, k2, k3, k4, stage = (np.empty_like(y) for _ in range(5))
+
+    motion = np.empty((count, len(t_out), 4), dtype=dtype)
+    motion[:, 0, :] = y.T
+    out_index = 1
+
+    for i in range(len(t) - 1):
+        h = t[i + 1] - t[i]
+        model(y, wave[i], wave_p[i], k1)
+        np.multiply(k1, h / 2, out=stage)
+        stage += y
+        model(stage, wave_half[i], wave_p_half[i], k2)
+        np.multiply(k2, h / 2, out=stage)
+        stage += y
+        model(stage, wave_half[i], wave_p_half[i], k3)
+        np.multiply(k3, h, out=stage)
+        stage += y
+        model(stage, wave[i + 1], wave_p[i + 1], k4)
+
+        k2 += k3
+        k2 *= 2
+        k1 += k2
+        k1 += k4
+        k1 *= h / 6
+        y += k1
+
+        if (i + 1) % output_every == 0 or i + 1 == len(t) - 1:
+            motion[:, out_index, :] = y.T
+            out_index += 1
+
+    return t_out, motion
+
+
+def iter_batch(batch, metadata, chunk_size=4096, **options):
+    # Integrates the batch chunk_size members at a time, yielding (member indices, times, motion) so results can be
+    # reduced and dropped chunk by chunk, keeping memory to one chunk's trajectories
+    count = member_count(batch)
+    for start in range(0, count, chunk_size):
+        members = np.arange(start, min(start + chunk_size, count))
+        t, motion = integrate(select(batch, members), metadata, **options)
+        yield members, t, motion
+
+
+def run_batch(batch, metadata, chunk_size=None, **options):
+    # Whole batch at once, or chunk by chunk into one output array when chunk_size is given
+    if chunk_size is None:
+        return integrate(batch, metadata, **options)
+
+    motion = None
+    for members, t, chunk in iter_batch(batch, metadata, chunk_size, **options):
+        if motion is None:
+            motion = np.empty((member_count(batch),) + chunk.shape[1:], dtype=chunk.dtype)
+        motion[members] = chunk
+    return t, motion
+
+
+if __name__ == '__main__':
+    # Compares a few members against single ode45 runs and reports the throughput of a PTO sweep
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    base = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(base['T'], base['Hs'])
+
+    side = int(np.sqrt(count))
+    batch = batch_variables(C_damper=np.logspace(5, 7, side)[:, None], K=np.linspace(0, 2e6, side)[None, :])
+    start = time.perf_counter()
+    t, motion = run_batch(batch, metadata, chunk_size=4096, dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    print('{:d} members in {:.2f} s ({:.0f} runs per second)'.format(member_count(batch), elapsed, member_count(batch) / elapsed))
+
+    for i in [0, member_count(batch) // 2, member_count(batch) - 1]:
+        single = dict(base, C_damper=batch['C_damper'][i], K=batch['K'][i])
+        single = buoy_simulation.run_simulation(single, metadata, rtol=1e-8, atol=1e-10)['data']
+        error = np.abs(np.interp(t, single['time'], single['motion'][:, 0]) - motion[i, :, 0]).max()
+        print('C_damper {:.3g}, K {:.3g}: largest buoy difference from ode45 {:.3g} m'.format(batch['C_damper'][i], batch['K'][i], error))
@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import buoy_simulation
+import data_source
+import processing
+
+
+# Benchmarks of the animator and the simulation pipeline, run headless on synthetic runs of any length:
+#   load      time to open a .mat (and the same run as .traj) and read the first window of samples
+#   memory    peak memory allocated opening a file and building SimData and the playback window on it
+#   playback  frames per second and per-frame latency of the playback loop, rendering at the file's speed
+#   resize    time per resize_window
+#   solver    ode45 runs and process_data post-processing per second on the default 20 period run
+# Results are written as JSON, one flat {metric: value} dictionary, and can be compared against an earlier results
+# file to catch regressions.
+
+BENCHMARKS = ['load', 'memory', 'playback', 'resize', 'solver']
+# Metrics ending in these are better when higher, everything else (times, bytes) when lower
+HIGHER_IS_BETTER = ('fps', 'per_second')
+
+
+def synthetic_run(samples, seed=0):
+    # Animation file contents for a run of the default buoy with the given number of samples, unevenly spaced as
+    # ode45 output is
+    simulation = buoy_simulation.base_variables()
+    rng = np.random.default_rng(seed)
+    time_steps = rng.uniform(0.01, 0.09, samples - 1)
+    t = np.concatenate(([0], np.cumsum(time_steps)))
+    omega = simulation['omega']
+    series = {'time': t,
+              'buoy_motion': 2.0 * np.sin(omega * t),
+              'piston_motion': 1.6 * np.sin(omega * t - 0.4),
+              'wave_motion': simulation['Hs'] * np.sin(omega * t + 0.2)}
+    return dict(buoy_simulation.animation_parameters(simulation), **series), simulation
+
+
+def write_runs(directory, sizes):
+    # {samples: {'mat': filename, 'traj': filename}}
+    files = {}
+    for samples in sizes:
+        animation_data, simulation = synthetic_run(samples)
+        mat = os.path.join(directory, 'run_{:d}.mat'.format(samples))
+        buoy_simulation.save_animation_file(mat, animation_data, simulation)
+        files[samples] = {'mat': mat, 'traj': data_source.convert(mat)}
+    return files
+
+
+def median_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def bench_load(files, repeats=3):
+    results = {}
+    for samples, names in files.items():
+        for kind, filename in names.items():
+            def load():
+                source = data_source.open_source(filename)
+                source.window(0, min(4096, len(source)))
+                source.close()
+            results['load/{:s}/{:d}/seconds'.format(kind, samples)] = median_time(load, repeats)
+    return results
+
+
+def bench_memory(files):
+    import make_animation as animation
+
+    animation.import_modules()
+    results = {}
+    for samples, names in files.items():
+        for kind, filename in names.items():
+            tracemalloc.start()
+            source = data_source.open_source(filename)
+            sim_data = animation.SimData(source)
+            animation.Playback(sim_data.source).positions(source.start_time)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            source.close()
+            results['memory/{:s}/{:d}/peak_bytes'.format(kind, samples)] = peak
+    return results
+
+
+def start_animator(filename, size=(1280, 720)):
+    # Headless animator with its components built for a file, as make_animation.main sets it up
+    import make_animation as animation
+
+    animation.initialise(filename, headless=True)
+    animation.settings.screen_width, animation.settings.screen_height = size
+    animation.build_components()
+    return animation
+
+
+def bench_playback(files, frames=600):
+    # Frames are rendered back to back at the times a 60 fps window would show at the file's speed, wrapping at the
+    # end of the run, so the cost of each frame is measured without the frame rate limit
+    results = {}
+    for samples, names in files.items():
+        animation = start_animator(names['mat'])
+        run_data = animation.run_data
+        playback = run_data.playback
+        times = playback.start_time + np.arange(frames) * run_data.speed / animation.settings.fps
+        times = playback.start_time + np.mod(times - playback.start_time, playback.end_time - playback.start_time)
+
+        latencies = np.empty(frames)
+        for i, t in enumerate(times.tolist()):
+            start = time.perf_counter()
+            animation.pygame.event.pump()
+            run_data.now_time = t
+            run_data.current_pos.update_base(*playback.positions(t))
+            run_data.current_pos.update_scaled()
+            animation.update_screen()
+            latencies[i] = time.perf_counter() - start
+
+        prefix = 'playback/{:d}/'.format(samples)
+        results[prefix + 'fps'] = frames / float(latencies.sum())
+        for percentile in [50, 90, 99]:
+            results[prefix + 'p{:d}_seconds'.format(percentile)] = float(np.percentile(latencies, percentile))
+        results[prefix + 'max_seconds'] = float(latencies.max())
+        animation.pygame.display.quit()
+        animation.sim_data.source.close()
+    return results
+
+
+def bench_resize(files, count=20):
+    # The window is resized between two sizes, as dragging its corner would
+    samples = min(files)
+    animation = start_animator(files[samples]['mat'])
+    sizes = [(1280, 720), (960, 640)]
+
+    times = np.empty(count)
+    for i in range(count):
+        animation.run_data.screen = animation.pygame.display.set_mode(sizes[i % 2], animation.pygame.RESIZABLE)
+        start = time.perf_counter()
+        animation.resize_window()
+        times[i] = time.perf_counter() - start
+
+    animation.pygame.display.quit()
+    animation.sim_data.source.close()
+    return {'resize/median_seconds': float(np.median(times)), 'resize/max_seconds': float(times.max())}
+
+
+def bench_solver(min_time=2.0):
+    # Each stage is repeated for at least min_time
+    simulation = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(simulation['T'], simulation['Hs'])
+    solved = buoy_simulation.run_simulation(simulation, metadata)
+
+    results = {}
+    for name, function in [('solver/ode45_runs_per_second', lambda: buoy_simulation.run_simulation(simulation, metadata)),
+                           ('solver/process_data_runs_per_second', lambda: processing.process_data(solved, metadata))]:
+        runs = 0
+        start = time.perf_counter()
+        while runs == 0 or time.perf_counter() - start < min_time:
+            function()
+            runs += 1
+        results[name] = runs / (time.perf_counter() - start)
+    return results
+
+
+def environment():
+    import pygame
+    import scipy
+
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'scipy': scipy.__version__, 'pygame': pygame.version.ver}
+
+
+def run_benchmarks(sizes, benchmarks=BENCHMARKS, frames=600):
+    directory = tempfile.mkdtemp(prefix='ips_benchmark_')
+    try:
+        files = write_runs(directory, sizes) if set(benchmarks) - {'solver'} else {}
+        results = {}
+        for name in benchmarks:
+            start = time.perf_counter()
+            if name == 'load':
+                results.update(bench_load(files))
+            elif name == 'memory':
+                results.update(bench_memory(files))
+            elif name == 'playback':
+                results.update(bench_playback(files, frames))
+            elif name == 'resize':
+                results.update(bench_resize(files))
+            elif name == 'solver':
+                results.update(bench_solver())
+            print('{:s}: {:.1f} s'.format(name, time.perf_counter() - start))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    # (metric, baseline, current, relative change) for every metric more than tolerance worse than the baseline
+    regressions = []
+    for metric, current in results.items():
+        previous = baseline.get(metric)
+        if previous is None or previous == 0:
+            continue
+        change = (current - previous) / abs(previous)
+        worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+        if worse > tolerance:
+            regressions.append((metric, previous, current, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the animator and the simulation pipeline, headless')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6],
+                        help='samples in the synthetic runs (default: 1e3 1e4 1e5 1e6)')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--frames', type=int, default=600, help='frames rendered per playback benchmark (default: 600)')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change counted as a regression (default: 0.2)')
+    arguments = parser.parse_args()
+
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    results = run_benchmarks([int(size) for size in arguments.sizes], arguments.only, arguments.frames)
+
+    for metric, value in results.items():
+        print('{:<40s} {:.6g}'.format(metric, value))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=1)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, arguments.tolerance)
+        for metric, previous, current, change in regressions:
+            print('Regression in {:s}: {:.6g} -> {:.6g} ({:+.0%})'.format(metric, previous, current, change))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {:s}'.format(arguments.baseline))
+
+
+if __name__ == '__main__':
+    main()
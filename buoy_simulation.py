@@ -0,0 +1,515 @@
+import math
+import sys
+
+import numpy as np
+
+import equilibrium
+import waves
+
+
+# Python port of the simulation part of IPS_buoy_simulation.m. The parameter dictionaries use the same names as the
+# MATLAB structs (base_variables, metadata), so files written here can be opened by make_animation.py as before.
+
+
+def base_variables(T=7.8, Hs=2.4, r_buoy=7.5, L_buoy=10, shape_buoy='sphere', added_mass_ratio=0.5, m1=None,
+                   mass_ratio=1, tube_L_max=14, tube_r_max=7, C_wave=3e5, C_damper=3e6, K=0, rho=1025, g=9.81):
+    # Same inputs and derived values as the "Input Variables" section of the MATLAB script
+    F = 1 / T
+    m1 = 9.057e5 * (1 + added_mass_ratio) if m1 is None else m1
+    m2 = m1 * mass_ratio
+
+    if shape_buoy == 'sphere':
+        buoy_equilibrium = sphere_equilibrium(r_buoy, m1, rho)
+    elif shape_buoy == 'cylinder':
+        buoy_equilibrium = cylinder_equilibrium(r_buoy, m1, rho)
+    else:
+        raise ValueError("shape_buoy must be one of: 'sphere', 'cylinder'")
+
+    return {'T': T, 'F': F, 'omega': 2 * math.pi * F, 'Hs': Hs, 'rho': rho, 'g': g,
+            'r_buoy': r_buoy, 'm1': m1, 'm2': m2, 'C_wave': C_wave, 'C_damper': C_damper, 'K': K,
+            'L_max': tube_L_max, 'r_max': tube_r_max,
+            'L_buoy': L_buoy, 'shape_buoy': shape_buoy,
+            'tube_length': tube_L_max, 'tube_radius': math.sqrt(m2 / (rho * math.pi * tube_L_max)),
+            'buoy_equilibrium': buoy_equilibrium}
+
+
+def wave_metadata(T, Hs, t_range=None, n=1000):
+    # Regular wave sampled the same way as the MATLAB script, simulating 20 periods by default
+    t_range = (0, T * 20) if t_range is None else t_range
+    xt = np.linspace(t_range[0], t_range[1], n)
+    x = Hs * np.sin(2 * np.pi * xt / T)
+    x_p = np.concatenate(([0], np.diff(x)))
+    return {'t_range': t_range, 'xt': xt, 'x': x, 'x_p': x_p}
+
+
+def sphere_volume(r, h):
+    if h >= r * 2:
+        return (4 / 3) * math.pi * r ** 3
+    r_bottom_squared = h * ((2 * r) - h)
+    return (math.pi / 6) * h * ((3 * r_bottom_squared) + (h ** 2))
+
+
+def cylinder_volume(r, h, L_buoy):
+    if h >= L_buoy:
+        return L_buoy * math.pi * r ** 2
+    return h * math.pi * r ** 2
+
+
+def sphere_equilibrium(r, m, rho):
+    # Depth of the spherical cap displacing the buoy's mass, in closed form (see equilibrium.py) rather than the fmincon
+    # call of the MATLAB version
+    return equilibrium.sphere_equilibrium(r, m, rho)
+
+
+def cylinder_equilibrium(r, m, rho):
+    return m / (rho * math.pi * r ** 2)
+
+
+def make_model(ode_vars, forcing=None):
+    # Right-hand side of the two-body model, [y1, y1', y2, y2'] -> derivatives. Parameters are bound once here rather
+    # than unpacked from a struct on every call, and only Python floats are used inside. The wave comes from forcing (a
+    # waves.py forcing) or, by default, from the sampled xt, x and x_p as in the MATLAB model
+    g = float(ode_vars['g'])
+    rho = float(ode_vars['rho'])
+    r_buoy = float(ode_vars['r_buoy'])
+    L_buoy = float(ode_vars['L_buoy'])
+    m1 = float(ode_vars['m1'])
+    m2 = float(ode_vars['m2'])
+    C_wave = float(ode_vars['C_wave'])
+    C_damper = float(ode_vars['C_damper'])
+    K = float(ode_vars['K'])
+
+    if ode_vars['shape_buoy'] == 'sphere':
+        full_depth = 2 * r_buoy
+        full_volume = (4 / 3) * math.pi * r_buoy ** 3
+        area = 0.0
+    elif ode_vars['shape_buoy'] == 'cylinder':
+        full_depth = L_buoy
+        full_volume = L_buoy * math.pi * r_buoy ** 2
+        area = math.pi * r_buoy ** 2
+    else:
+        raise ValueError("shape_buoy must be one of: 'sphere', 'cylinder'")
+    is_sphere = ode_vars['shape_buoy'] == 'sphere'
+    rho_g = rho * g
+    m1_g = m1 * g
+
+    if forcing is None:
+        forcing = waves.SampledWave(ode_vars['xt'], ode_vars['x'], ode_vars['x_p'])
+    wave = forcing.scalar_function()
+
+    def model(t, y):
+        y1, y1_p, y2, y2_p = y
+        x, x_p = wave(t)
+        y1_submersion = y1 - x
+
+        if y1_submersion < 0:  # If buoy exits water, there's no buoyancy force
+            volume = 0.0
+        elif y1_submersion >= full_depth:
+            volume = full_volume
+        elif is_sphere:
+            volume = (math.pi / 6) * y1_submersion * (3 * y1_submersion * (2 * r_buoy - y1_submersion) + y1_submersion ** 2)
+        else:
+            volume = y1_submersion * area
+
+        pto = C_damper * (y2_p - y1_p) + K * (y2 - y1)
+        return (y1_p,
+                (m1_g - rho_g * volume + pto - C_wave * (y1_p - x_p)) / m1,
+                y2_p,
+                -pto / m2)
+
+    return model
+
+
+# Events of the model, in the order make_events returns them: the buoy's submersion crossing zero (leaving or
+# re-entering the water) and its full depth, where the buoyancy branches of model() switch, and the relative stroke
+# reaching half the tube length. The model has no end-stop force, so the tube end is logged but isn't a discontinuity
+MODEL_EVENTS = ['water', 'submerged', 'tube_end']
+EVENT_COUNTS = ['water_exit', 'water_entry', 'submerged', 'tube_end']
+
+
+def make_events(ode_vars, forcing=None):
+    # (g, restart) for ode45's events, using the same wave as make_model
+    full_depth = 2 * float(ode_vars['r_buoy']) if ode_vars['shape_buoy'] == 'sphere' else float(ode_vars['L_buoy'])
+    half_tube = float(ode_vars['tube_length']) / 2
+    if forcing is None:
+        forcing = waves.SampledWave(ode_vars['xt'], ode_vars['x'], ode_vars['x_p'])
+    wave = forcing.scalar_function()
+
+    def events(t, y):
+        submersion = y[0] - wave(t)[0]
+        return [submersion, submersion - full_depth, abs(y[2] - y[0]) - half_tube]
+
+    return events, [True, True, False]
+
+
+def event_counts(events):
+    # Number of times the buoy left the water, re-entered it (slams), went fully under and the piston reached a tube
+    # end, from the events of run_simulation(..., events=True)
+    kind = events['kind']
+    rising = events['rising']
+    return {'water_exit': int(np.sum((kind == 0) & ~rising)), 'water_entry': int(np.sum((kind == 0) & rising)),
+            'submerged': int(np.sum((kind == 1) & rising)), 'tube_end': int(np.sum((kind == 2) & rising))}
+
+
+# Dormand-Prince 5(4) coefficients, as used by ode45
+A21 = 1 / 5
+A31, A32 = 3 / 40, 9 / 40
+A41, A42, A43 = 44 / 45, -56 / 15, 32 / 9
+A51, A52, A53, A54 = 19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729
+A61, A62, A63, A64, A65 = 9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656
+A71, A73, A74, A75, A76 = 35 / 384, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84
+C2, C3, C4, C5 = 1 / 5, 3 / 10, 4 / 5, 8 / 9
+E1, E3, E4, E5, E6, E7 = 71 / 57600, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40
+# ode45's continuous extension (ntrp45), used for the refined output points. Rows are the stages (stage 2 is all 0)
+BI = [[1, -183 / 64, 37 / 12, -145 / 128],
+      [0, 1500 / 371, -1000 / 159, 1000 / 371],
+      [0, -125 / 32, 125 / 12, -375 / 64],
+      [0, 9477 / 3392, -729 / 106, 25515 / 6784],
+      [0, -11 / 7, 11 / 3, -55 / 28],
+      [0, 3 / 2, -4, 5 / 2]]
+
+
+def interpolate(t, h, y, stages, s):
+    # ode45's continuous extension of a step from (t, y) with stages k1, k3..k7, at fraction s of the step
+    b1, b3, b4, b5, b6, b7 = (bi[0] * s + bi[1] * s ** 2 + bi[2] * s ** 3 + bi[3] * s ** 4 for bi in BI)
+    return t + s * h, tuple(a + h * (b1 * b + b3 * d + b4 * e + b5 * f + b6 * g + b7 * k)
+                            for a, b, d, e, f, g, k in zip(y, *stages))
+
+
+def locate_event(g, index, g0, g1, t, h, y, stages):
+    # Fraction of a step at which event index of g changes sign between g0 (at its start) and g1 (at its end), found
+    # on the continuous extension by the Illinois method to ode45's tolerance of 128 eps in time, with the time and
+    # state there
+    s0, s1 = 0.0, 1.0
+    side = 0
+    tolerance = 128 * sys.float_info.epsilon * max(abs(t), abs(t + h)) / abs(h)
+    while s1 - s0 > tolerance:
+        s = min(max(s1 - g1 * (s1 - s0) / (g1 - g0), s0 + tolerance / 2), s1 - tolerance / 2)
+        g_s = g(*interpolate(t, h, y, stages, s))[index]
+        if g_s == 0:
+            s0 = s1 = s
+            break
+        if (g_s > 0) == (g1 > 0):
+            s1, g1 = s, g_s
+            if side == 1:
+                g0 /= 2
+            side = 1
+        else:
+            s0, g0 = s, g_s
+            if side == -1:
+                g1 /= 2
+            side = -1
+    return (s1,) + interpolate(t, h, y, stages, s1)
+
+
+def changed_sign(a, b):
+    return (a < 0 < b) or (b < 0 < a) or (a != 0 and b == 0)
+
+
+def ode45(fun, t_range, y0, rtol=1e-3, atol=1e-6, refine=4, max_step=None, events=None):
+    # Adaptive Dormand-Prince integrator following MATLAB's ode45: same error norm, step size control, initial step
+    # and Refine output, so results line up with the MATLAB runs. fun(t, y) takes and returns sequences of floats.
+    # The stages are written out in full, as loops over the tableau cost more than the model itself.
+    # events is (g, restart), g(t, y) returning a sequence of floats that each change sign at an event and restart
+    # flags per event. Events are found on the continuous extension of each step, like ode45's Events option, and
+    # returned as (t, y, te, ye, ie) with ie the index of the event. Events with restart set mark a discontinuity in
+    # fun: a step that would straddle one is cut short to end on it and the integration starts again from there with
+    # fun evaluated afresh, so the step size isn't driven down by failed steps across the discontinuity
+    t0, tfinal = float(t_range[0]), float(t_range[-1])
+    y = tuple(float(v) for v in y0)
+    threshold = atol / rtol
+    max_step = 0.1 * abs(tfinal - t0) if max_step is None else max_step
+    power = 1 / 5
+
+    def initial_step(t, y, k1):
+        absh = min(max_step, tfinal - t)
+        rh = max(abs(f) / max(abs(v), threshold) for f, v in zip(k1, y)) / (0.8 * rtol ** power)
+        return 1 / rh if absh * rh > 1 else absh
+
+    k1 = tuple(fun(t0, y))
+    absh = initial_step(t0, y, k1)
+
+    t = t0
+    t_out = [t0]
+    y_out = [y]
+    refine_coeffs = []
+    for i in range(1, refine):
+        s = i / refine
+        refine_coeffs.append((s, [bi[0] * s + bi[1] * s ** 2 + bi[2] * s ** 3 + bi[3] * s ** 4 for bi in BI]))
+    if events:
+        g, restarts = events
+        g_values = list(g(t0, y))
+    te, ye, ie = [], [], []
+    approached = False  # the last step was aimed at a restart event and stopped just short of it
+
+    while t < tfinal:
+        hmin = 16 * np.spacing(t)
+        absh = min(max_step, max(hmin, absh))
+        h = absh
+        done = False
+        if 1.1 * absh >= tfinal - t:
+            h = tfinal - t
+            absh = h
+            done = True
+
+        no_failed = True
+        aimed = None  # the event the step was shortened to end on
+        while True:
+            k2 = fun(t + C2 * h, [a + h * (A21 * b) for a, b in zip(y, k1)])
+            k3 = fun(t + C3 * h, [a + h * (A31 * b + A32 * c) for a, b, c in zip(y, k1, k2)])
+            k4 = fun(t + C4 * h, [a + h * (A41 * b + A42 * c + A43 * d) for a, b, c, d in zip(y, k1, k2, k3)])
+            k5 = fun(t + C5 * h, [a + h * (A51 * b + A52 * c + A53 * d + A54 * e)
+                                  for a, b, c, d, e in zip(y, k1, k2, k3, k4)])
+            k6 = fun(t + h, [a + h * (A61 * b + A62 * c + A63 * d + A64 * e + A65 * f)
+                             for a, b, c, d, e, f in zip(y, k1, k2, k3, k4, k5)])
+            t_new = tfinal if done else t + h
+            h = t_new - t
+            # The seventh stage is evaluated at the 5th order solution (first same as last)
+            y_new = tuple(a + h * (A71 * b + A73 * d + A74 * e + A75 * f + A76 * g)
+                          for a, b, d, e, f, g in zip(y, k1, k3, k4, k5, k6))
+            k7 = fun(t_new, y_new)
+
+            err = absh * max(abs(E1 * b + E3 * d + E4 * e + E5 * f + E6 * g + E7 * k) / max(abs(a), abs(a_new), threshold)
+                             for a, a_new, b, d, e, f, g, k in zip(y, y_new, k1, k3, k4, k5, k6, k7))
+
+            restart = None
+            if events:
+                stages = (k1, k3, k4, k5, k6, k7)
+                g_new = list(g(t_new, y_new))
+                for i, (is_restart, a, b) in enumerate(zip(restarts, g_values, g_new)):
+                    if is_restart and changed_sign(a, b):
+                        crossing = locate_event(g, i, a, b, t, h, y, stages)
+                        if restart is None or crossing[0] < restart[1][0]:
+                            restart = (i, crossing)
+                if restart is not None and aimed is None and not approached and restart[1][0] * absh > hmin:
+                    # Retried as a step ending on the discontinuity, which doesn't count as a failure
+                    unaimed = absh
+                    absh = restart[1][0] * absh
+                    h = absh
+                    done = False
+                    aimed = restart[0]
+                    continue
+
+            if err <= rtol:
+                break
+
+            if absh <= hmin:
+                raise RuntimeError('ode45 failed at t={:g}, step size below minimum'.format(t))
+            if no_failed:
+                no_failed = False
+                absh = max(hmin, absh * max(0.1, 0.8 * (rtol / err) ** power))
+            else:
+                absh = max(hmin, 0.5 * absh)
+            h = absh
+            done = False
+            aimed = None
+
+        fell_short = False
+        if events:
+            # A restart event found inside the step ends it there. A step aimed at one that stopped short of it (the
+            # crossing was estimated on a step straddling the discontinuity) is an ordinary step, and the next step
+            # starts just before the crossing, so it is cut at the crossing rather than aimed again
+            if restart is not None:
+                event_index, (end, t_end, y_end) = restart
+            else:
+                event_index, end = None, 1.0
+            fell_short = restart is None and aimed is not None
+            approached = fell_short
+
+            found = []
+            for i, (is_restart, a, b) in enumerate(zip(restarts, g_values, g_new)):
+                if not is_restart and changed_sign(a, b):
+                    crossing = locate_event(g, i, a, b, t, h, y, stages)
+                    if crossing[0] <= end:
+                        found.append(crossing[1:] + (i,))
+            if event_index is not None:
+                found.append((t_end, y_end, event_index))
+            for t_event, y_event, i in sorted(found, key=lambda item: item[0]):
+                te.append(t_event)
+                ye.append(y_event)
+                ie.append(i)
+
+            if event_index is not None:
+                for s, _ in refine_coeffs:
+                    t_refined, y_refined = interpolate(t, h, y, stages, s * end)
+                    t_out.append(t_refined)
+                    y_out.append(y_refined)
+                t_out.append(t_end)
+                y_out.append(y_end)
+
+                # The state is on the discontinuity, so the event is put on the side it was heading to
+                side = g_new[event_index]
+                t = t_end
+                y = y_end
+                # Carries on with the step size from before the event, which the error control cuts if the new regime
+                # needs it, rather than the cautious initial step
+                k1 = tuple(fun(t, y))
+                absh = unaimed if aimed is not None else absh
+                g_values = list(g(t, y))
+                g_values[event_index] = math.copysign(1e-300, side)
+                continue
+            g_values = g_new
+
+        for s, (b1, b3, b4, b5, b6, b7) in refine_coeffs:
+            t_out.append(t + s * h)
+            y_out.append(tuple(a + h * (b1 * b + b3 * d + b4 * e + b5 * f + b6 * g + b7 * k)
+                               for a, b, d, e, f, g, k in zip(y, k1, k3, k4, k5, k6, k7)))
+        t_out.append(t_new)
+        y_out.append(y_new)
+
+        if no_failed:
+            temp = 1.25 * (err / rtol) ** power
+            absh = absh / temp if temp > 0.2 else 5 * absh
+        if fell_short:
+            absh = unaimed
+
+        t = t_new
+        y = y_new
+        k1 = k7
+
+    if events is None:
+        return np.array(t_out), np.array(y_out)
+    return np.array(t_out), np.array(y_out), np.array(te), np.array(ye).reshape(-1, len(y0)), np.array(ie, dtype=int)
+
+
+def run_simulation(simulation, metadata, t_range=None, rtol=1e-3, atol=1e-6, events=False):
+    # Integrates the model from equilibrium, returning a copy of simulation with data.motion ([y1, y1', y2, y2'] per
+    # row) and data.time added, as in the MATLAB function of the same name. With events, the integrator restarts at
+    # the buoyancy discontinuities (see make_events) rather than stepping across them, and data.events holds the time,
+    # kind (index into MODEL_EVENTS) and direction (rising: entering the water, going under, reaching a tube end) of
+    # every event. The MATLAB runs were made without, so that is the default
+    t_range = metadata['t_range'] if t_range is None else t_range
+    forcing = waves.metadata_forcing(metadata, t_range)
+    model = make_model(simulation, forcing)
+
+    IC = [simulation['buoy_equilibrium'], 0, simulation['buoy_equilibrium'], 0]  # sim starts at equilibrium
+    simulation = dict(simulation)
+    if not events:
+        t, y = ode45(model, t_range, IC, rtol=rtol, atol=atol)
+        simulation['data'] = {'motion': y, 'time': t}
+        return simulation
+
+    t, y, te, ye, ie = ode45(model, t_range, IC, rtol=rtol, atol=atol, events=make_events(simulation, forcing))
+    # Directions from the rate of change of each event function where it happened
+    wave = forcing.scalar_function()
+    wave_velocity = np.array([wave(t_event)[1] for t_event in te.tolist()])
+    slopes = np.where(ie == 2, np.sign(ye[:, 2] - ye[:, 0]) * (ye[:, 3] - ye[:, 1]), ye[:, 1] - wave_velocity) if len(te) else np.zeros(0)
+    simulation['data'] = {'motion': y, 'time': t, 'events': {'time': te, 'kind': ie, 'rising': slopes > 0}}
+    return simulation
+
+
+def stream_simulation(simulation, metadata, feed, t_range=None, segment=60, rtol=1e-3, atol=1e-6):
+    # Integrates segment seconds at a time, each continuing from the last state of the one before, and sends every
+    # piece to a data_source.LiveFeed as it is computed, so the run can be watched while it is still going
+    t_range = metadata['t_range'] if t_range is None else t_range
+    model = make_model(simulation, waves.metadata_forcing(metadata, t_range))
+    buoy_equilibrium = simulation['buoy_equilibrium']
+
+    y0 = [buoy_equilibrium, 0, buoy_equilibrium, 0]  # sim starts at equilibrium
+    start = t_range[0]
+    while start < t_range[1]:
+        stop = min(start + segment, t_range[1])
+        t, y = ode45(model, (start, stop), y0, rtol=rtol, atol=atol)
+        first = 0 if start == t_range[0] else 1  # a segment starts with the last sample of the one before
+        feed.send(t[first:], y[first:, 0] - buoy_equilibrium, y[first:, 2] - buoy_equilibrium,
+                  np.interp(t[first:], metadata['xt'], metadata['x']))
+        y0 = y[-1]
+        start = stop
+
+
+def animation_parameters(simulation):
+    # The fields of get_animation_data that describe the device rather than its motion
+    return {'buoy_equilibrium': simulation['buoy_equilibrium'],
+            'buoy_shape': simulation['shape_buoy'],
+            'buoy_radius': simulation['r_buoy'],
+            'buoy_length': simulation['L_buoy'],
+            'tube_length': simulation['tube_length'],
+            'tube_radius': simulation['tube_radius']}
+
+
+def get_animation_data(simulation, metadata):
+    # Same fields as get_animation_data in the MATLAB script, which is what make_animation.py reads
+    data = simulation['data']
+    return dict(animation_parameters(simulation),
+                buoy_motion=data['motion'][:, 0] - simulation['buoy_equilibrium'],
+                piston_motion=data['motion'][:, 2] - simulation['buoy_equilibrium'],
+                wave_motion=np.interp(data['time'], metadata['xt'], metadata['x']),
+                time=data['time'])
+
+
+def save_animation_file(filename, simulation, simulation_data, speed=5, scale=1):
+    # Equivalent of the save in animate_IPS_buoy, so make_animation.py can be run without MATLAB
+    from scipy.io import savemat
+
+    simulation_data = {key: value for key, value in simulation_data.items() if key != 'data'}
+    savemat(filename, {'simulation': simulation, 'simulation_data': simulation_data, 'speed': speed, 'scale': scale})
+
+
+def check_against(filename='demo_file.mat'):
+    # Reruns the simulation stored in a file written by the MATLAB script and returns the largest difference in the
+    # buoy and piston motion. The MATLAB script builds its metadata struct with x_p = x (the wave elevation is passed
+    # as the wave velocity), which is what its files were produced with, so that is reproduced here
+    from scipy.io import loadmat
+
+    data = loadmat(filename, chars_as_strings=1)
+    stored = data['simulation'][0, 0]
+    parameters = data['simulation_data'][0, 0]
+    simulation = {name: parameters[name].item() if parameters[name].dtype.kind != 'U' else str(parameters[name][0])
+                  for name in parameters.dtype.names}
+
+    metadata = wave_metadata(simulation['T'], simulation['Hs'])
+    metadata['x_p'] = metadata['x']
+    animation = get_animation_data(run_simulation(simulation, metadata), metadata)
+
+    time = stored['time'][0]
+    return (np.max(np.abs(np.interp(time, animation['time'], animation['buoy_motion']) - stored['buoy_motion'][0])),
+            np.max(np.abs(np.interp(time, animation['time'], animation['piston_motion']) - stored['piston_motion'][0])))
+
+
+def compare_events(periods=40, rtol=1e-3):
+    # Times runs that break the buoyancy model's smoothness (a sphere going under, and a cylinder that also leaves the
+    # water) with and without events, and prints the largest buoy error of each against an events run at rtol 1e-10
+    import time
+
+    for shape, Hs in [('sphere', 6.0), ('cylinder', 5.0)]:
+        simulation = base_variables(shape_buoy=shape, Hs=Hs)
+        metadata = waves.forcing_metadata(waves.RegularWave(Hs, simulation['T']), (0, periods * simulation['T']))
+        reference = run_simulation(simulation, metadata, rtol=1e-10, atol=1e-12, events=True)['data']
+        for events in [False, True]:
+            start = time.perf_counter()
+            data = run_simulation(simulation, metadata, rtol=rtol, atol=rtol * 1e-3, events=events)['data']
+            elapsed = time.perf_counter() - start
+            error = np.max(np.abs(np.interp(reference['time'], data['time'], data['motion'][:, 0]) - reference['motion'][:, 0]))
+            print('{:s} Hs {:g}, {:s} events: {:.1f} ms, buoy error {:.3g} m'.format(
+                shape, Hs, 'with' if events else 'without', elapsed * 1000, error))
+        print('  events:', event_counts(reference['events']))
+
+
+def live_demo(duration):
+    # Streams a run of the default buoy to an animator started with "make_animation.py --live"
+    import data_source
+
+    simulation = base_variables()
+    # Wave sampled as densely as the default 20 period run
+    metadata = wave_metadata(simulation['T'], simulation['Hs'], (0, duration), n=int(duration / simulation['T'] * 50))
+
+    feed = data_source.LiveFeed(animation_parameters(simulation), simulation)
+    try:
+        stream_simulation(simulation, metadata, feed)
+    except ConnectionError:
+        print('The animator was closed')
+    finally:
+        feed.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--live']:
+        live_demo(float(sys.argv[2]) if len(sys.argv) > 2 else 3600)
+        sys.exit()
+    if sys.argv[1:2] == ['--events']:
+        compare_events()
+        sys.exit()
+
+    file = sys.argv[1] if len(sys.argv) > 1 else 'demo_file.mat'
+    buoy_error, piston_error = check_against(file)
+    print('Largest difference from {:s}: buoy {:.4g} m, piston {:.4g} m'.format(file, buoy_error, piston_error))
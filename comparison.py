@@ -0,0 +1,341 @@
+import os
+import math
+
+import numpy as np
+import pygame
+
+import make_animation
+from data_source import open_source
+
+
+# Several runs side by side or overlaid ("make_animation.py a.mat b.mat ..."), on one clock with one time cursor
+
+LABEL_FIELDS = ['C_damper', 'K']
+OVERLAY_COLOURS = [(219, 181, 12), (214, 39, 40), (31, 119, 180), (44, 160, 44), (148, 103, 189), (140, 86, 75),
+                   (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207)]
+GRID_COLOUR = (180, 180, 180)
+
+
+class Device:
+    # Dimensions of one run's device, as make_animation.SimData holds them
+    def __init__(self, filename, source):
+        parameters = source.parameters
+        self.name = os.path.basename(filename)
+        self.source = source
+        self.equilibrium = float(parameters['buoy_equilibrium'])
+        self.radius = float(parameters['buoy_radius'])
+        self.length = float(parameters['buoy_length'])
+        self.shape = str(parameters['buoy_shape'])
+        self.tube_radius = float(parameters['tube_radius'])
+        self.tube_length = float(parameters['tube_length'])
+
+        data = source.simulation_data
+        self.label = ', '.join('{:s} {:g}'.format(name, float(data[name])) for name in LABEL_FIELDS if name in data)
+        # Room left for the motion when fitting the device in its cell, the buoy moves about as much as the waves
+        self.headroom = 1.5 * float(data.get('Hs', 0))
+
+    def height_above_water(self):
+        # Height of the top of the buoy above the water line at equilibrium
+        return (2 * self.radius if self.shape == 'sphere' else self.length) - self.equilibrium
+
+
+class BatchPlayback(make_animation.PlaybackClock):
+    # make_animation's playback clock over several sources, looping over the longest run. The samples of every source between window_start and
+    # window_start + window_span are held as (devices, width) arrays, each row padded with its last sample. Each row's
+    # times are shifted by row * stride so the flattened times are sorted, and one searchsorted finds the interval of
+    # every device at once
+    def __init__(self, sources, window_span):
+        super().__init__(min(source.start_time for source in sources), max(source.end_time for source in sources))
+        self.sources = sources
+        self.window_span = window_span
+        self.window_start = None
+        self.flat_t = None
+        self.flat_motion = None
+        self.key_offsets = None
+        self.row_first = None
+        self.width = None
+
+    def load_window(self, sim_time):
+        start = sim_time
+        stop = sim_time + self.window_span
+        rows = []
+        for source in self.sources:
+            first = source.search(start)
+            rows.append(source.window(first, min(source.search(stop) + 2, len(source))))
+
+        count = len(rows)
+        width = max(len(row[0]) for row in rows)
+        times = np.empty((count, width))
+        motion = np.empty((3, count, width))
+        for k, (t, buoy, piston, wave) in enumerate(rows):
+            times[k, :len(t)] = t - start
+            times[k, len(t):] = t[-1] - start
+            for m, series in enumerate([buoy, piston, wave]):
+                motion[m, k, :len(t)] = series
+                motion[m, k, len(t):] = series[-1]
+
+        low = times.min()
+        stride = times.max() - low + 1.0
+        offsets = np.arange(count) * stride - low
+        self.flat_t = (times + offsets[:, None]).ravel()
+        self.flat_motion = motion.reshape(3, -1)
+        self.key_offsets = offsets
+        self.row_first = np.arange(count) * width
+        self.width = width
+        self.window_start = start
+
+    def positions(self, sim_time):
+        # (3, devices) buoy, piston and wave. Devices whose run has ended (or not started) hold their last (or first)
+        # sample
+        if self.window_start is None or not self.window_start <= sim_time < self.window_start + self.window_span:
+            self.load_window(sim_time)
+        keys = sim_time - self.window_start + self.key_offsets
+        j = np.clip(np.searchsorted(self.flat_t, keys, side='right') - 1, self.row_first, self.row_first + self.width - 2)
+        t0 = self.flat_t[j]
+        dt = self.flat_t[j + 1] - t0
+        fraction = np.clip(np.divide(keys - t0, dt, out=np.zeros_like(dt), where=dt > 0), 0, 1)
+        return self.flat_motion[:, j] + (self.flat_motion[:, j + 1] - self.flat_motion[:, j]) * fraction
+
+
+class ComparisonView:
+    # Layout and drawing. build() is run on every resize or scale change and does all the per-device drawing; draw()
+    # only moves the sprites and the sea
+    def __init__(self, devices, layout='grid', timeline_height=28):
+        self.devices = devices
+        self.layout = layout
+        self.timeline_height = timeline_height
+        self.colours = make_animation.Colours()
+        self.zoom = 1.0
+        self.size = None
+        self.cells = None
+        self.scale = None
+        self.sky = None
+        self.sea = None
+        self.sprites = None
+        self.water_datum = None
+        self.buoy_top = None
+        self.piston_top = None
+        self.sprite_x = None
+        self.surface_lines = None
+        self.font = pygame.font.SysFont('Avenir', 16)
+        self.timeline = None
+
+    def layout_cells(self, size):
+        width, height = size
+        height -= self.timeline_height
+        if self.layout == 'overlay':
+            return [pygame.Rect(0, 0, width, height)] * len(self.devices)
+        columns = int(math.ceil(math.sqrt(len(self.devices))))
+        rows = int(math.ceil(len(self.devices) / columns))
+        cell_width = width // columns
+        cell_height = height // rows
+        return [pygame.Rect((k % columns) * cell_width, (k // columns) * cell_height, cell_width, cell_height)
+                for k in range(len(self.devices))]
+
+    def fit_scale(self):
+        # Pixels per metre shared by all the devices, the largest that fits each in its cell, as the datums of
+        # make_animation (water at 1/4 and piston equilibrium at 2/3 of the height) leave room for it
+        cell = self.cells[0]
+        scales = []
+        for device in self.devices:
+            scales.append(min(0.64 * cell.height / (device.tube_length + 2 * device.headroom),
+                              0.23 * cell.height / max(device.height_above_water() + device.headroom, 1e-6),
+                              0.9 * cell.width / (2 * max(device.radius, device.tube_radius * 1.1))))
+        return 0.9 * min(scales) * self.zoom
+
+    def build(self, size):
+        self.size = size
+        self.cells = self.layout_cells(size)
+        self.scale = self.fit_scale()
+        scale = self.scale
+        colours = self.colours
+
+        self.sky = pygame.Surface(size).convert()
+        self.sky.fill(colours.background)
+        self.sea = pygame.Surface(size).convert()
+        self.sea.fill(colours.seablue)
+
+        self.sprites = []
+        self.water_datum = np.empty(len(self.devices))
+        self.buoy_top = np.empty(len(self.devices))
+        self.piston_top = np.empty(len(self.devices))
+        self.sprite_x = []
+        self.surface_lines = []
+
+        for k, (device, cell) in enumerate(zip(self.devices, self.cells)):
+            water_datum = cell.top + cell.height * 0.25
+            piston_datum = cell.top + cell.height * 0.66
+            centre = cell.centerx
+            overlay = self.layout == 'overlay'
+            colour = OVERLAY_COLOURS[k % len(OVERLAY_COLOURS)] if overlay else colours.buoyyellow
+            piston_colour = colour if overlay else colours.green
+            alpha = 160 if overlay and len(self.devices) > 1 else 255
+
+            if not overlay or k == 0:
+                for layer in [self.sky, self.sea]:
+                    pygame.draw.line(layer, (0, 0, 0), (cell.left, water_datum), (cell.right, water_datum), 1)
+                    pygame.draw.line(layer, colours.equilibrium, (cell.left, piston_datum), (cell.right, piston_datum), 2)
+                    if not overlay:
+                        pygame.draw.rect(layer, GRID_COLOUR, cell, 1)
+            label = device.name + (': ' + device.label if device.label else '')
+            text = self.font.render(label, True, colour if overlay else (0, 0, 0))
+            text_position = (cell.left + 6, cell.top + 4 + (text.get_height() * k if overlay else 0))
+            self.sky.blit(text, text_position)
+
+            # Buoy and tube, at equilibrium
+            radius = device.radius * scale
+            tube_thickness = max(1, int(device.tube_radius * scale * 0.2))
+            tube_x = device.tube_radius * scale + tube_thickness / 2
+            tube_rect = pygame.Rect(0, 0, 2 * tube_x + tube_thickness, device.tube_length * scale)
+            tube_rect.center = (centre, piston_datum)
+            if device.shape == 'sphere':
+                floater_rect = pygame.Rect(0, 0, 2 * radius, 2 * radius)
+                floater_rect.center = (centre, water_datum - radius + device.equilibrium * scale)
+                piston_offset = radius
+            else:
+                floater_rect = pygame.Rect(0, 0, 2 * radius, device.length * scale)
+                floater_rect.center = (centre, water_datum - device.length * scale / 2 + device.equilibrium * scale)
+                piston_offset = device.length * scale / 2
+            bounds = floater_rect.union(tube_rect).inflate(4, 4)
+
+            buoy = pygame.Surface(bounds.size, pygame.SRCALPHA)
+            buoy_colour = colour + (alpha,)
+            if device.shape == 'sphere':
+                pygame.draw.circle(buoy, buoy_colour, floater_rect.move(-bounds.left, -bounds.top).center, radius)
+            else:
+                pygame.draw.rect(buoy, buoy_colour, floater_rect.move(-bounds.left, -bounds.top))
+            for side in [-tube_x, tube_x]:
+                x = centre + side - bounds.left
+                pygame.draw.line(buoy, buoy_colour, (x, tube_rect.top - bounds.top), (x, tube_rect.bottom - bounds.top), tube_thickness)
+
+            # Piston, at equilibrium
+            piston_length = piston_datum - water_datum - device.equilibrium * scale + piston_offset
+            plunger_thickness = max(1, round(device.tube_radius * scale * 0.3))
+            shaft_thickness = max(1, round(device.tube_radius * scale * 0.15))
+            plunger_half = device.tube_radius * scale * 0.95
+            piston_rect = pygame.Rect(0, 0, 2 * plunger_half + 2, piston_length + plunger_thickness + 2)
+            piston_rect.bottomleft = (centre - plunger_half - 1, piston_datum + plunger_thickness / 2 + 1)
+            piston = pygame.Surface(piston_rect.size, pygame.SRCALPHA)
+            plunger_y = piston_datum - piston_rect.top
+            pygame.draw.line(piston, piston_colour + (alpha,), (1, plunger_y), (piston_rect.width - 1, plunger_y), plunger_thickness)
+            pygame.draw.line(piston, piston_colour + (alpha,), (piston_rect.width / 2, plunger_y - piston_length),
+                             (piston_rect.width / 2, plunger_y), shaft_thickness)
+
+            self.sprites.append((buoy, piston))
+            self.sprite_x.append((bounds.left, piston_rect.left))
+            self.water_datum[k] = water_datum
+            self.buoy_top[k] = bounds.top
+            self.piston_top[k] = piston_rect.top
+            if overlay:
+                line = pygame.Surface((cell.width, 2), pygame.SRCALPHA)
+                line.fill(colour + (255,))
+                self.surface_lines.append(line)
+
+        # Time cursor along the bottom
+        self.timeline = pygame.Rect(10, size[1] - self.timeline_height + 10, size[0] - 140, 8)
+        pygame.draw.rect(self.sky, GRID_COLOUR, self.timeline)
+
+    def draw(self, screen, positions, sim_time, start_time, end_time):
+        buoy, piston, wave = positions * self.scale
+        sea_top = (self.water_datum + wave).astype(int).tolist()
+        buoy_y = (self.buoy_top + buoy).tolist()
+        piston_y = (self.piston_top + piston).tolist()
+
+        screen.blit(self.sky, (0, 0))
+        if self.layout == 'overlay':
+            # The sea of the first device is filled in, every device's surface is drawn as a line in its colour
+            cell = self.cells[0]
+            screen.blit(self.sea, (cell.left, sea_top[0]), pygame.Rect(cell.left, sea_top[0], cell.width, cell.bottom - sea_top[0]))
+            blits = [(line, (cell.left, y - 1)) for line, y in zip(self.surface_lines, sea_top)]
+        else:
+            blits = [(self.sea, (cell.left, y), pygame.Rect(cell.left, y, cell.width, cell.bottom - y))
+                     for cell, y in zip(self.cells, sea_top)]
+        blits += [(sprites[0], (x[0], y)) for sprites, x, y in zip(self.sprites, self.sprite_x, buoy_y)]
+        blits += [(sprites[1], (x[1], y)) for sprites, x, y in zip(self.sprites, self.sprite_x, piston_y)]
+        screen.blits(blits, doreturn=False)
+
+        fraction = (sim_time - start_time) / (end_time - start_time) if end_time > start_time else 0
+        cursor = pygame.Rect(0, 0, 4, self.timeline.height + 8)
+        cursor.center = (self.timeline.left + fraction * self.timeline.width, self.timeline.centery)
+        screen.fill((0, 0, 0), cursor)
+        text = self.font.render('{:.2f}/{:.2f}'.format(sim_time, end_time), True, (0, 0, 0))
+        screen.blit(text, (self.timeline.right + 10, self.timeline.centery - text.get_height() / 2))
+
+    def timeline_time(self, position, start_time, end_time):
+        # Time under a click on the time cursor's bar, or None if it missed
+        if not self.timeline.inflate(0, 16).collidepoint(position):
+            return None
+        return start_time + (position[0] - self.timeline.left) / self.timeline.width * (end_time - start_time)
+
+
+def compare(filenames, layout='grid', size=(1280, 720), fps=60):
+    # Opens a comparison window. Space plays and pauses, Home goes back to the start, up and down change the speed in
+    # the animator's steps, + and - the scale, and clicking the bar at the bottom moves the time cursor
+    pygame.display.init()
+    pygame.font.init()
+
+    sources = [open_source(filename) for filename in filenames]
+    devices = [Device(filename, source) for filename, source in zip(filenames, sources)]
+    for device in devices:
+        print('{:s}: {:s} buoy, radius {:g}{:s}'.format(device.name, device.shape, device.radius,
+                                                       ', ' + device.label if device.label else ''))
+
+    speed = float(sources[0].speed)
+    playback = BatchPlayback(sources, window_span=max(speed * 20, 10.0))
+    screen = pygame.display.set_mode(size, pygame.RESIZABLE)
+    pygame.display.set_caption('Buoy Comparison')
+    view = ComparisonView(devices, layout)
+    view.build(screen.get_size())
+
+    clock = pygame.time.Clock()
+    running = True
+    playing = False
+    redraw = True
+    try:
+        while running:
+            # As in make_animation.main, nothing changes while paused until an event arrives
+            events = pygame.event.get() if playing or redraw else [pygame.event.wait()] + pygame.event.get()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.WINDOWRESIZED:
+                    screen = pygame.display.set_mode((max(event.x, 200), max(event.y, 150)), pygame.RESIZABLE)
+                    view.build(screen.get_size())
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    target = view.timeline_time(event.pos, playback.start_time, playback.end_time)
+                    if target is not None:
+                        playback.seek(target)
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        playing = not playing
+                    elif event.key == pygame.K_HOME:
+                        playback.seek(playback.start_time)
+                    elif event.key == pygame.K_UP:
+                        speed = make_animation.faster(speed)
+                    elif event.key == pygame.K_DOWN:
+                        speed = make_animation.slower(speed)
+                    elif event.key in [pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS]:
+                        view.zoom *= 1.25
+                        view.build(screen.get_size())
+                    elif event.key in [pygame.K_MINUS, pygame.K_KP_MINUS]:
+                        view.zoom /= 1.25
+                        view.build(screen.get_size())
+            redraw = redraw or bool(events)
+
+            if playing:
+                playback.advance(speed)
+                redraw = True
+            else:
+                playback.hold()
+
+            if redraw:
+                view.draw(screen, playback.positions(playback.sim_time), playback.sim_time, playback.start_time, playback.end_time)
+                pygame.display.update()
+                redraw = False
+
+            if playing:
+                clock.tick(fps)
+    finally:
+        pygame.display.quit()
+        for source in sources:
+            source.close()
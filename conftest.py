@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Makes the modules at the top of the repository importable from tests/, however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,430 @@
+import os
+import json
+import time
+import bisect
+import socket
+import struct
+import threading
+
+import numpy as np
+
+
+# Access to the animation data of a .mat file. Sources expose the four series (time, buoy, piston and wave motion)
+# as sequences that can be indexed and sliced without reading the whole file, so playback can pull just the window of
+# samples it is about to show. Files saved with MATLAB's -v7.3 are HDF5 and are read lazily (memory mapped where the
+# data is stored contiguously); older .mat files can only be read whole by scipy and are held as arrays. Trajectory
+# files (.traj, written by write_trajectory) are the animator's own format and open as memory maps without any parsing.
+# Live feeds (LiveSource) are samples streamed over a local socket while the simulation is still running.
+
+SERIES_NAMES = ['time', 'buoy_motion', 'piston_motion', 'wave_motion']
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+# Trajectory file layout: the signature and the length of a JSON header (little-endian uint64), the header, then the
+# arrays it lists, each starting on an ARRAY_ALIGNMENT boundary
+TRAJECTORY_SIGNATURE = b'IPSTRAJ\x00'
+TRAJECTORY_VERSION = 1
+ARRAY_ALIGNMENT = 64
+
+# Live feed protocol: a line of JSON with the parameters, simulation_data, speed and scale of the run, then chunks of
+# samples, each a little-endian uint64 sample count followed by that many (time, buoy, piston, wave) rows of
+# little-endian float64. A count of 0 ends the feed
+LIVE_PORT = 50638
+CHUNK_HEADER = struct.Struct('<Q')
+
+
+class DataSource:
+    streaming = False  # True for sources that grow while they are played and drop the samples already shown
+
+    def __init__(self, series, parameters, simulation_data, speed, scale):
+        self.series = series
+        self.parameters = parameters
+        self.simulation_data = simulation_data
+        self.speed = speed
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.series['time'])
+
+    @property
+    def start_time(self):
+        return float(self.series['time'][0])
+
+    @property
+    def end_time(self):
+        return float(self.series['time'][len(self) - 1])
+
+    def search(self, sim_time):
+        # Index of the last sample at or before sim_time, kept so that there is always a next sample to interpolate to
+        time = self.series['time']
+        if isinstance(time, np.ndarray):
+            i = int(np.searchsorted(time, sim_time, side='right')) - 1
+        else:
+            i = bisect.bisect_right(time, sim_time) - 1
+        return min(max(i, 0), len(self) - 2)
+
+    def window(self, start, stop):
+        # (time, buoy, piston, wave) for samples [start, stop)
+        return tuple(np.asarray(self.series[name][start:stop], dtype=float) for name in SERIES_NAMES)
+
+    def release(self, index):
+        # Playback has moved past the samples before index. Only streaming sources make use of it
+        pass
+
+    def close(self):
+        pass
+
+
+class LazySeries:
+    # One series of an HDF5 dataset, read a block at a time. Single samples (e.g. during a binary search) come from a
+    # cached block, slices are read straight from the file
+    def __init__(self, dataset, block_size=65536):
+        self.dataset = dataset
+        self.length = dataset.size
+        self.column = dataset.shape[0] == 1 and len(dataset.shape) == 2
+        self.block_size = block_size
+        self.block = (0, None)  # (start, samples), replaced as a whole so threads can share the series
+
+    def __len__(self):
+        return self.length
+
+    def read(self, start, stop):
+        if self.column:
+            return self.dataset[0, start:stop]
+        return self.dataset[start:stop].reshape(-1)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            return self.read(start, stop)[::step]
+
+        if key < 0:
+            key += self.length
+        start, block = self.block
+        if block is None or not start <= key < start + len(block):
+            start = key - key % self.block_size
+            block = self.read(start, min(start + self.block_size, self.length))
+            self.block = (start, block)
+        return block[key - start]
+
+
+class HDF5Source(DataSource):
+    # MATLAB -v7.3 files. Contiguous uncompressed datasets are memory mapped, chunked or compressed ones are read
+    # through h5py a block at a time. Needs h5py
+    def __init__(self, filename):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('h5py is needed to read -v7.3 .mat files, or save the file with -v7')
+
+        self.file = h5py.File(filename, 'r')
+        simulation = self.file['simulation']
+        series = {name: self.open_series(filename, simulation[name]) for name in SERIES_NAMES}
+        parameters = {name: self.read_value(simulation[name]) for name in simulation if name not in SERIES_NAMES}
+        simulation_data = {name: self.read_value(node) for name, node in self.file['simulation_data'].items()}
+
+        super().__init__(series, parameters, simulation_data,
+                         self.read_value(self.file['speed']), self.read_value(self.file['scale']))
+
+    @staticmethod
+    def open_series(filename, dataset):
+        offset = dataset.id.get_offset()
+        if offset is not None and dataset.chunks is None and dataset.compression is None:
+            return np.memmap(filename, dtype=dataset.dtype, mode='r', offset=offset, shape=(dataset.size,))
+        return LazySeries(dataset)
+
+    @staticmethod
+    def read_value(node):
+        value = node[()]
+        if node.attrs.get('MATLAB_class') == b'char':
+            return ''.join(chr(c) for c in np.asarray(value).ravel())
+        return np.asarray(value).ravel()[0].item()
+
+    def close(self):
+        self.file.close()
+
+
+class TrajectorySource(DataSource):
+    # Trajectory files. Every array is memory mapped, so opening only reads the header. Arrays other than the four
+    # series (e.g. decimation levels) are kept in arrays, and the header in header
+    def __init__(self, filename):
+        self.header, self.arrays = read_arrays(filename)
+        series = {name: self.arrays[name] for name in SERIES_NAMES}
+        super().__init__(series, self.header['parameters'], self.header['simulation_data'], self.header['speed'],
+                         self.header['scale'])
+
+
+class LiveSource(DataSource):
+    # Samples arriving over a socket, kept in a fixed-size buffer. Indices count every sample received, the buffer
+    # holds [base, count). A receiver thread appends the chunks as they arrive and, once the buffer is full of samples
+    # that haven't been played, stops reading the socket until playback releases some, which in turn blocks the
+    # producer's sends. Memory stays at the buffer size however long the feed runs
+    streaming = True
+
+    def __init__(self, connection, capacity=1 << 16):
+        self.connection = connection
+        self.stream = connection.makefile('rb')
+        header = json.loads(self.stream.readline().decode('utf-8'))
+
+        self.buffer = np.empty((4, capacity))
+        self.base = 0
+        self.count = 0
+        self.released = 0
+        self.finished = False
+        self.condition = threading.Condition()
+
+        super().__init__(None, header['parameters'], header['simulation_data'], header['speed'], header['scale'])
+
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+        # Playback needs two samples to interpolate between
+        with self.condition:
+            self.condition.wait_for(lambda: self.count >= 2 or self.finished)
+            if self.count < 2:
+                raise ValueError('The live feed ended before sending two samples')
+
+    def receive(self):
+        try:
+            while True:
+                size = CHUNK_HEADER.unpack(self.read_exactly(CHUNK_HEADER.size))[0]
+                if size == 0:
+                    break
+                samples = np.frombuffer(self.read_exactly(size * 32), dtype='<f8').reshape(size, 4).T
+                for start in range(0, size, self.buffer.shape[1] // 2):
+                    self.append(samples[:, start:start + self.buffer.shape[1] // 2])
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def read_exactly(self, size):
+        data = self.stream.read(size)
+        if len(data) < size:
+            raise ValueError('The live feed closed mid-chunk')
+        return data
+
+    def append(self, samples):
+        with self.condition:
+            # Waits for playback to release enough samples, dropping them from the front of the buffer
+            while self.count - max(self.base, self.released) + samples.shape[1] > self.buffer.shape[1]:
+                self.condition.wait()
+            if self.count - self.base + samples.shape[1] > self.buffer.shape[1]:
+                kept = self.count - self.released
+                self.buffer[:, :kept] = self.buffer[:, self.released - self.base:self.count - self.base]
+                self.base = self.released
+            self.buffer[:, self.count - self.base:self.count - self.base + samples.shape[1]] = samples
+            self.count += samples.shape[1]
+            self.condition.notify_all()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def start_time(self):
+        with self.condition:
+            return float(self.buffer[0, 0])
+
+    @property
+    def end_time(self):
+        with self.condition:
+            return float(self.buffer[0, self.count - self.base - 1])
+
+    def search(self, sim_time):
+        with self.condition:
+            i = int(np.searchsorted(self.buffer[0, :self.count - self.base], sim_time, side='right')) - 1
+            return min(max(i, 0), self.count - self.base - 2) + self.base
+
+    def window(self, start, stop):
+        # Copies, as the buffer is shifted when samples are dropped
+        with self.condition:
+            start = max(start, self.base)
+            stop = min(max(stop, start), self.count)
+            return tuple(self.buffer[:, start - self.base:stop - self.base].copy())
+
+    def release(self, index):
+        with self.condition:
+            self.released = min(max(self.released, index), self.count)
+            self.condition.notify_all()
+
+    def close(self):
+        self.connection.close()
+
+
+class LiveFeed:
+    # Producer end of a live feed, connecting to an animator started with --live. send blocks while the animator's
+    # buffer is full, so a solver can't run arbitrarily far ahead of the playback
+    def __init__(self, parameters, simulation_data, speed=5, scale=1, port=LIVE_PORT, timeout=30):
+        # Retries until the animator is listening, as the two are usually started together
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                self.connection = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+                break
+            except ConnectionRefusedError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.2)
+        self.connection.settimeout(None)
+
+        header = {'parameters': parameters, 'simulation_data': simulation_data, 'speed': speed, 'scale': scale}
+        # NumPy scalars are written as plain numbers
+        self.connection.sendall((json.dumps(header, default=lambda value: value.item()) + '\n').encode('utf-8'))
+
+    def send(self, time, buoy_motion, piston_motion, wave_motion):
+        samples = np.column_stack((time, buoy_motion, piston_motion, wave_motion)).astype('<f8')
+        self.connection.sendall(CHUNK_HEADER.pack(len(samples)) + samples.tobytes())
+
+    def close(self):
+        try:
+            self.connection.sendall(CHUNK_HEADER.pack(0))
+        except OSError:
+            pass  # the animator has already gone
+        self.connection.close()
+
+
+def open_live(port=LIVE_PORT, capacity=1 << 16):
+    # Waits for a producer to connect and returns its feed as a data source
+    with socket.create_server(('127.0.0.1', port)) as listener:
+        connection, _ = listener.accept()
+    return LiveSource(connection, capacity)
+
+
+def aligned(offset):
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def read_arrays(filename):
+    # Header dictionary and {name: memory map} of every array in a file written by write_arrays
+    with open(filename, 'rb') as file:
+        signature, header_size = struct.unpack('<8sQ', file.read(16))
+        if signature != TRAJECTORY_SIGNATURE:
+            raise ValueError('{:s} is not a trajectory file'.format(filename))
+        header = json.loads(file.read(header_size).decode('utf-8'))
+
+    if header['version'] > TRAJECTORY_VERSION:
+        raise ValueError('{:s} was written by a newer version (format {:d})'.format(filename, header['version']))
+
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        shape = tuple(layout['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=layout['dtype'])  # empty arrays can't be mapped
+        else:
+            arrays[name] = np.memmap(filename, dtype=layout['dtype'], mode='r', offset=layout['offset'], shape=shape)
+    return header, arrays
+
+
+def write_arrays(filename, header, arrays, dtypes=None, chunk_size=1 << 20):
+    # Writes named arrays in the trajectory layout, with header (which must be JSON serialisable) describing them.
+    # Arrays can be anything sliceable along their first axis, e.g. the lazy series of a data source, and are copied
+    # chunk_size rows at a time as dtypes[name] (default: their own dtype). The file only replaces filename once it is
+    # complete
+    dtypes = dtypes or {}
+    layouts = {}
+    for name, array in arrays.items():
+        shape = list(array.shape) if hasattr(array, 'shape') else [len(array)]
+        dtype = np.dtype(dtypes[name] if name in dtypes else array.dtype)
+        layouts[name] = {'dtype': dtype.str, 'shape': shape}
+    header = dict(header, version=TRAJECTORY_VERSION, arrays=layouts)
+
+    # The offsets are part of the header, so they are laid out again until the header fits in front of the first array
+    first = 0
+    while True:
+        offset = first
+        for layout in layouts.values():
+            layout['offset'] = offset
+            offset = aligned(offset + int(np.prod(layout['shape'])) * np.dtype(layout['dtype']).itemsize)
+        encoded = json.dumps(header).encode('utf-8')
+        if 16 + len(encoded) <= first:
+            break
+        first = aligned(16 + len(encoded))
+
+    part = filename + '.part'
+    with open(part, 'wb') as file:
+        file.write(struct.pack('<8sQ', TRAJECTORY_SIGNATURE, len(encoded)))
+        file.write(encoded)
+        for name, layout in layouts.items():
+            file.write(b'\0' * (layout['offset'] - file.tell()))
+            for start in range(0, layout['shape'][0] if layout['shape'] else 1, chunk_size):
+                values = np.asarray(arrays[name][start:start + chunk_size] if layout['shape'] else arrays[name],
+                                    dtype=layout['dtype'])
+                file.write(values.tobytes())
+    os.replace(part, filename)
+
+
+def write_trajectory(filename, source, dtype=np.float64, arrays=None, header=None):
+    # Writes a data source as a trajectory file. The motion series are stored as dtype (float32 halves the file), time
+    # is always float64 so that long runs keep their resolution. arrays adds any other named arrays to the file, and
+    # header any other entries to its header
+    dtypes = {name: np.float64 if name == 'time' else dtype for name in SERIES_NAMES}
+    header = dict(header or {}, simulation_data=source.simulation_data, parameters=source.parameters,
+                  speed=source.speed, scale=source.scale)
+    write_arrays(filename, header, dict(source.series, **(arrays or {})), dtypes)
+
+
+def struct_value(value):
+    # Plain Python value of a loadmat struct field (scalars come as 1x1 arrays, strings as 1-element arrays)
+    value = np.asarray(value)
+    if value.dtype.kind == 'U':
+        return str(value.ravel()[0])
+    return value.ravel()[0].item()
+
+
+def open_mat(filename):
+    from scipy.io import loadmat
+
+    data = loadmat(filename, chars_as_strings=1)
+    simulation = data['simulation'][0, 0]
+    simulation_data = data['simulation_data'][0, 0]
+
+    # Only the four series are kept from the loaded file, as 1-D views
+    series = {name: simulation[name].ravel() for name in SERIES_NAMES}
+    parameters = {name: struct_value(simulation[name]) for name in simulation.dtype.names if name not in SERIES_NAMES}
+    simulation_data = {name: struct_value(simulation_data[name]) for name in simulation_data.dtype.names}
+
+    return DataSource(series, parameters, simulation_data, struct_value(data['speed']), struct_value(data['scale']))
+
+
+def is_trajectory(filename):
+    with open(filename, 'rb') as file:
+        return file.read(len(TRAJECTORY_SIGNATURE)) == TRAJECTORY_SIGNATURE
+
+
+def is_hdf5(filename):
+    # -v7.3 .mat files start with a 512 byte MATLAB header followed by the HDF5 signature
+    with open(filename, 'rb') as file:
+        for offset in [0, 512]:
+            file.seek(offset)
+            if file.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE:
+                return True
+    return False
+
+
+def open_source(filename):
+    if is_trajectory(filename):
+        return TrajectorySource(filename)
+    if is_hdf5(filename):
+        return HDF5Source(filename)
+    return open_mat(filename)
+
+
+def convert(filename, output=None, dtype=np.float64, pyramid=False):
+    # Writes a .mat file (or any file open_source reads) as a trajectory file, by default next to it as .traj. pyramid
+    # stores its decimation levels in the file as well, so they are never built or cached when it is opened
+    output = os.path.splitext(filename)[0] + '.traj' if output is None else output
+    source = open_source(filename)
+    try:
+        arrays = header = None
+        if pyramid:
+            from decimation import build_pyramid, level_arrays, read_series
+
+            # Built from the motion rounded as it is stored, so the levels match the file's own samples
+            levels = build_pyramid(source, read=lambda source, start, stop: read_series(source, start, stop, dtype))
+            arrays = level_arrays(levels)
+            header = {'pyramid': {'factor': levels.factor, 'level_count': len(levels.levels)}}
+        write_trajectory(output, source, dtype, arrays, header)
+    finally:
+        source.close()
+    return output
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import data_source
+
+
+# Min/max decimation pyramid of a run's buoy, piston, wave and relative stroke (piston - buoy) series. Level k holds the
+# minimum and maximum of every block of FACTOR**k samples, so a plot or a stats query over any time range is answered
+# from the coarsest level that still resolves it, in time proportional to the number of points asked for rather than
+# to the length of the run. The pyramid is built once and cached next to the input file, or stored in a .traj file
+# by "make_animation.py convert --pyramid".
+
+PYRAMID_SERIES = ['buoy', 'piston', 'wave', 'relative']
+FACTOR = 8
+
+
+def cache_name(filename):
+    return filename + '.pyramid'
+
+
+def file_signature(filename):
+    # Size and modification time of the input, so a cache made from an older version of the file is rebuilt
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_series(source, start, stop, dtype=np.float64):
+    # Times and (4, n) values of samples [start, stop), the rows in PYRAMID_SERIES order. dtype rounds the motion as a
+    # trajectory file of that dtype would store it, so the relative stroke is the one read back from the file
+    t, buoy, piston, wave = source.window(start, stop)
+    if dtype != np.float64:
+        buoy, piston, wave = (values.astype(dtype).astype(float) for values in (buoy, piston, wave))
+    return t, np.vstack((buoy, piston, wave, piston - buoy))
+
+
+def reduce_blocks(low, high, factor):
+    # Min and max over blocks of factor columns, the last block may be partial
+    blocks = -(-low.shape[1] // factor)
+    pad = blocks * factor - low.shape[1]
+    if pad:
+        # Repeating the last column doesn't change the min or max of the partial block
+        low = np.pad(low, ((0, 0), (0, pad)), mode='edge')
+        high = np.pad(high, ((0, 0), (0, pad)), mode='edge')
+    return low.reshape(len(low), blocks, factor).min(axis=2), high.reshape(len(high), blocks, factor).max(axis=2)
+
+
+class Pyramid:
+    # levels[k - 1] is (block start times, (rows, blocks) minimum, (rows, blocks) maximum) for blocks of factor**k
+    # samples. Level 0 is the data source itself, read as (times, (rows, n) values) by read: the PYRAMID_SERIES by
+    # default, or any other series of the samples (rolling_stats uses the power and stroke)
+    def __init__(self, source, levels, factor=FACTOR, read=read_series):
+        self.source = source
+        self.levels = levels
+        self.factor = factor
+        self.read = read
+
+    def sample_range(self, t0, t1):
+        # Indices [start, stop) of the samples with t0 <= time <= t1
+        time = self.source.series['time']
+        start = self.source.search(t0)
+        if time[start] < t0:
+            start += 1
+        stop = len(self.source) if t1 >= self.source.end_time else self.source.search(t1) + 1
+        return start, max(stop, start)
+
+    def level_data(self, level, start, stop):
+        # (times, minimum, maximum) of blocks [start, stop) of a level
+        if level == 0:
+            t, values = self.read(self.source, start, stop)
+            return t, values, values
+        t, low, high = self.levels[level - 1]
+        return np.asarray(t[start:stop]), np.asarray(low[:, start:stop]), np.asarray(high[:, start:stop])
+
+    def query(self, t0, t1, n):
+        # n points covering [t0, t1]: the start time of n equal bins and the (4, n) minimum and maximum in each. Ranges
+        # holding n samples or fewer return the samples themselves (minimum == maximum). A bin's extremes come from whole
+        # blocks, so they may include up to one block either side of it, which is less than a bin
+        start = self.source.search(t0)
+        stop = min(self.source.search(t1) + 2, len(self.source))
+        if stop - start <= n:
+            return self.level_data(0, start, stop)
+
+        # Coarsest level with at least n blocks in the range, so each bin is made from a few blocks at most
+        level = min(int(np.log((stop - start) / n) / np.log(self.factor)), len(self.levels))
+        block = self.factor ** level
+        t, low, high = self.level_data(level, start // block, -(-stop // block))
+
+        edges = np.linspace(t0, t1, n + 1)
+        first = np.clip(np.searchsorted(t, edges, side='right') - 1, 0, len(t) - 1)
+        # Each bin runs from the block holding its start to the block holding its end, inclusive
+        low_bins = np.minimum(np.minimum.reduceat(low[:, :first[-1] + 1], first[:-1], axis=1), low[:, first[1:]])
+        high_bins = np.maximum(np.maximum.reduceat(high[:, :first[-1] + 1], first[:-1], axis=1), high[:, first[1:]])
+        return edges[:-1], low_bins, high_bins
+
+    def extremes(self, t0, t1):
+        # Exact (rows,) minimum and maximum of the samples in [t0, t1]
+        return self.sample_extremes(*self.sample_range(t0, t1))
+
+    def sample_extremes(self, start, stop):
+        # Exact (rows,) minimum and maximum of samples [start, stop). The range is split into whole blocks of the
+        # highest levels that fit, with the ragged ends taken from finer levels, so at most 2 * factor blocks are read
+        # per level
+        if start >= stop:
+            return np.full(len(self.levels[0][1]), np.nan), np.full(len(self.levels[0][1]), np.nan)
+
+        lows = []
+        highs = []
+        level = 0
+        while start < stop:
+            if level == len(self.levels) or stop - start < 2 * self.factor:
+                ends = [(start, stop)]
+                start = stop
+            else:
+                # Partial blocks of the next level at either end are read here, the whole ones in the next level up
+                inner_start = -(-start // self.factor) * self.factor
+                inner_stop = max(stop // self.factor * self.factor, inner_start)
+                ends = [(start, inner_start), (inner_stop, stop)]
+                start, stop = inner_start // self.factor, inner_stop // self.factor
+            for a, b in ends:
+                if a < b:
+                    _, low, high = self.level_data(level, a, b)
+                    lows.append(low.min(axis=1))
+                    highs.append(high.max(axis=1))
+            level += 1
+
+        return np.min(lows, axis=0), np.max(highs, axis=0)
+
+
+def build_pyramid(source, factor=FACTOR, chunk_size=FACTOR ** 6, read=read_series):
+    # The first level is reduced from the samples a chunk at a time, so lazily loaded runs are never read whole; the
+    # levels above it are reduced from the one below until a single block is left
+    times = []
+    lows = []
+    highs = []
+    for start in range(0, len(source), chunk_size):
+        t, values = read(source, start, min(start + chunk_size, len(source)))
+        low, high = reduce_blocks(values, values, factor)
+        times.append(t[::factor])
+        lows.append(low)
+        highs.append(high)
+
+    levels = [(np.concatenate(times), np.hstack(lows), np.hstack(highs))]
+    while len(levels[-1][0]) > 1:
+        t, low, high = levels[-1]
+        levels.append((t[::factor],) + reduce_blocks(low, high, factor))
+    return Pyramid(source, levels, factor, read)
+
+
+def level_arrays(pyramid):
+    # The levels as named arrays, for write_arrays
+    arrays = {}
+    for k, (t, low, high) in enumerate(pyramid.levels, 1):
+        arrays['level_{:d}_time'.format(k)] = t
+        arrays['level_{:d}_min'.format(k)] = low
+        arrays['level_{:d}_max'.format(k)] = high
+    return arrays
+
+
+def stored_levels(arrays, level_count):
+    return [(arrays['level_{:d}_time'.format(k)], arrays['level_{:d}_min'.format(k)], arrays['level_{:d}_max'.format(k)])
+            for k in range(1, level_count + 1)]
+
+
+def save_pyramid(filename, pyramid, signature):
+    header = {'kind': 'pyramid', 'factor': pyramid.factor, 'level_count': len(pyramid.levels), 'source': signature}
+    data_source.write_arrays(filename, header, level_arrays(pyramid))
+
+
+def load_pyramid(filename, source, signature, factor):
+    # The cached pyramid, memory mapped, or None if there isn't a usable one
+    try:
+        header, arrays = data_source.read_arrays(filename)
+    except (OSError, ValueError, KeyError):
+        return None
+    if header.get('kind') != 'pyramid' or header.get('source') != signature or header.get('factor') != factor:
+        return None
+    return Pyramid(source, stored_levels(arrays, header['level_count']), factor)
+
+
+def trajectory_pyramid(source, factor):
+    # The pyramid stored in a trajectory file by "convert --pyramid", memory mapped, or None if it hasn't one
+    if not isinstance(source, data_source.TrajectorySource) or 'pyramid' not in source.header:
+        return None
+    stored = source.header['pyramid']
+    if stored['factor'] != factor:
+        return None
+    return Pyramid(source, stored_levels(source.arrays, stored['level_count']), factor)
+
+
+def open_pyramid(filename, source=None, factor=FACTOR):
+    # Pyramid of a data file, from the file itself if it was converted with one, otherwise from its cache if it is up
+    # to date, otherwise built and cached. If the cache can't be written (e.g. a read-only directory) the pyramid is
+    # only kept in memory
+    source = data_source.open_source(filename) if source is None else source
+    pyramid = trajectory_pyramid(source, factor)
+    if pyramid is not None:
+        return pyramid
+
+    signature = file_signature(filename)
+    cache = cache_name(filename)
+
+    pyramid = load_pyramid(cache, source, signature, factor) if os.path.isfile(cache) else None
+    if pyramid is None:
+        pyramid = build_pyramid(source, factor)
+        try:
+            save_pyramid(cache, pyramid, signature)
+        except OSError:
+            pass
+    return pyramid
+
+
+if __name__ == '__main__':
+    # Builds (or loads) the pyramid of a file and times an overview of the whole run and a query of its last tenth
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'demo_file.mat'
+    source = data_source.open_source(filename)
+
+    start = time.perf_counter()
+    pyramid = open_pyramid(filename, source)
+    print('{:d} samples, {:d} levels, opened in {:.3f} s'.format(len(source), len(pyramid.levels), time.perf_counter() - start))
+
+    for t0, t1 in [(source.start_time, source.end_time), (source.end_time * 0.9, source.end_time)]:
+        start = time.perf_counter()
+        t, low, high = pyramid.query(t0, t1, 1000)
+        elapsed = time.perf_counter() - start
+        print('[{:g}, {:g}] as {:d} points in {:.2f} ms, relative stroke {:.3f} to {:.3f}'.format(
+            t0, t1, len(t), elapsed * 1000, low[3].min(), high[3].max()))
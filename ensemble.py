@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import buoy_simulation
+import processing
+import sweep
+import waves
+
+
+# Power matrix of a device over a scatter diagram of irregular sea states. Every (Hs, Tp) bin is simulated with
+# random-phase JONSWAP realisations until the confidence interval of its mean power is tight enough, rather than for a
+# fixed count. Realisation k of a bin is always made from the same seed, and results are taken in realisation order
+# however the workers finish, so a run is reproducible and stops at the same count every time.
+
+
+class RunningStats:
+    # Welford's running mean and variance of a vector of stats. Failed integrations (all NaN) aren't folded in, since
+    # they would make the mean NaN from then on, and are counted in failures instead
+    def __init__(self, size):
+        self.count = 0
+        self.failures = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def add(self, values):
+        if np.all(np.isnan(values)):
+            self.failures += 1
+            return
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full_like(self.m2, np.nan)
+
+    def half_width(self, confidence=0.95):
+        # Half width of the Student t confidence interval of the mean
+        from scipy.stats import t
+
+        if self.count < 2:
+            return np.full_like(self.mean, np.inf)
+        return t.ppf((1 + confidence) / 2, self.count - 1) * np.sqrt(self.variance / self.count)
+
+
+def realisation_seed(seed, bin_index, realisation):
+    # Independent, reproducible random state for one realisation of one bin
+    return np.random.SeedSequence(seed, spawn_key=(int(bin_index[0]), int(bin_index[1]), int(realisation)))
+
+
+def run_realisation(device, Hs, Tp, seed, duration, components, gamma):
+    # Runs in a worker: one realisation of a sea state, returning the power.total stats in STAT_NAMES order
+    simulation = buoy_simulation.base_variables(T=Tp, Hs=Hs, **device)
+    sea = waves.jonswap(Hs, Tp, gamma, components, seed=seed)
+    metadata = waves.forcing_metadata(sea, (0, duration))
+    try:
+        motion = buoy_simulation.run_simulation(simulation, metadata)['data']['motion']
+    except RuntimeError:
+        return np.full(len(processing.STAT_NAMES), np.nan)
+
+    # Only the total power is needed, the last of the stacked series
+    power = processing.stack_series(motion, simulation['C_damper'], simulation['K'])[-1]
+    stats = processing.batch_stats(power)
+    return np.array([float(stats[name]) for name in processing.STAT_NAMES])
+
+
+class Bin:
+    # Progress of one scatter diagram bin. Results are buffered until every earlier realisation has arrived. A bin is
+    # failed when it is done without a single realisation that integrated
+    def __init__(self, index, Hs, Tp):
+        self.index = index
+        self.Hs = Hs
+        self.Tp = Tp
+        self.stats = RunningStats(len(processing.STAT_NAMES))
+        self.submitted = 0
+        self.received = 0
+        self.waiting = {}
+        self.done = False
+
+    @property
+    def failed(self):
+        return self.done and self.stats.count == 0
+
+
+def run_ensemble(Hs_values, Tp_values, device=None, seed=0, duration=600, components=200, gamma=3.3,
+                 stat='mean', rel_tol=0.05, abs_tol=0.0, confidence=0.95, min_realisations=5, max_realisations=100,
+                 workers=None):
+    # Simulates every (Hs, Tp) bin until the confidence interval of the mean of power.total[stat] is within rel_tol of
+    # it (or abs_tol), with at least min_realisations and at most max_realisations. device holds base_variables
+    # arguments other than T and Hs. Returns the power matrix, i.e. the mean of every power.total stat per bin, with
+    # the count of realisations that failed to integrate per bin (NaN power where all of them did)
+    device = device or {}
+    workers = workers or os.cpu_count() or 1
+    Hs_values = sweep.expand_values(Hs_values)
+    Tp_values = sweep.expand_values(Tp_values)
+    stat_index = processing.STAT_NAMES.index(stat)
+    bins = [Bin((i, j), Hs, Tp) for i, Hs in enumerate(Hs_values) for j, Tp in enumerate(Tp_values)]
+
+    def converged(item):
+        # Failed realisations use up the max_realisations budget, so a bin that keeps failing still stops
+        stats = item.stats
+        if item.received >= max_realisations:
+            return True
+        if stats.count < min_realisations:
+            return False
+        half_width = stats.half_width(confidence)[stat_index]
+        return half_width <= max(rel_tol * abs(stats.mean[stat_index]), abs_tol)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        slots = 2 * workers
+        pending = {}
+        while True:
+            # Keeps the pool busy with the next realisations of the unfinished bins, in turn
+            open_bins = [item for item in bins if not item.done and item.submitted < max_realisations]
+            while len(pending) < slots and open_bins:
+                item = min(open_bins, key=lambda b: b.submitted)
+                seed_sequence = realisation_seed(seed, item.index, item.submitted)
+                future = executor.submit(run_realisation, device, item.Hs, item.Tp, seed_sequence, duration, components, gamma)
+                pending[future] = (item, item.submitted)
+                item.submitted += 1
+                open_bins = [b for b in open_bins if b.submitted < max_realisations]
+
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item, realisation = pending.pop(future)
+                if item.done:
+                    continue  # started before the bin converged
+                item.waiting[realisation] = future.result()
+                while item.received in item.waiting and not item.done:
+                    item.stats.add(item.waiting.pop(item.received))
+                    item.received += 1
+                    if converged(item):
+                        item.done = True
+                        if item.failed:
+                            print('Hs {:g}, Tp {:g}: all {:d} realisations failed ({:.0f} s)'.format(
+                                item.Hs, item.Tp, item.stats.failures, time.perf_counter() - start))
+                        else:
+                            print('Hs {:g}, Tp {:g}: {:d} realisations ({:d} failed), mean power {:.4g} +/- {:.2g} ({:.0f} s)'.format(
+                                item.Hs, item.Tp, item.stats.count, item.stats.failures, item.stats.mean[stat_index],
+                                item.stats.half_width(confidence)[stat_index], time.perf_counter() - start))
+
+    shape = (len(Hs_values), len(Tp_values))
+    out = {'Hs': np.array(Hs_values, dtype=float), 'Tp': np.array(Tp_values, dtype=float),
+           'count': np.array([item.stats.count for item in bins]).reshape(shape),
+           'failures': np.array([item.stats.failures for item in bins]).reshape(shape),
+           'failed': np.array([item.failed for item in bins]).reshape(shape)}
+    for k, name in enumerate(processing.STAT_NAMES):
+        out['power_' + name] = np.array([np.nan if item.failed else item.stats.mean[k] for item in bins]).reshape(shape)
+        out['power_' + name + '_half_width'] = np.array([item.stats.half_width(confidence)[k] for item in bins]).reshape(shape)
+    return out
+
+
+def annual_energy(result, occurrence, stat='mean'):
+    # Energy per year (J) from the power matrix and the fraction of the year spent in each bin
+    return np.nansum(result['power_' + stat] * np.asarray(occurrence)) * 365.25 * 24 * 3600
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Power matrix of the buoy over a scatter diagram of irregular seas')
+    parser.add_argument('spec', help='JSON file with "Hs" and "Tp" values (lists, or linspace/logspace as in sweep.py), '
+                                     'and optionally "device" (base_variables arguments), "occurrence" (fraction of '
+                                     'the year per bin) and any run_ensemble option')
+    parser.add_argument('output', help='.npz file for the power matrix')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    arguments = parser.parse_args()
+
+    with open(arguments.spec) as file:
+        spec = json.load(file)
+    occurrence = spec.pop('occurrence', None)
+
+    result = run_ensemble(spec.pop('Hs'), spec.pop('Tp'), workers=arguments.workers, **spec)
+    np.savez(arguments.output, **result)
+    print('Power matrix written to {:s}'.format(arguments.output))
+    if occurrence is not None:
+        print('Annual energy: {:.4g} MWh'.format(annual_energy(result, occurrence, spec.get('stat', 'mean')) / 3.6e9))
+
+
+if __name__ == '__main__':
+    main()
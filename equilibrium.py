@@ -0,0 +1,86 @@
+import math
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+
+
+# Equilibrium submersion of the buoy: the depth at which the displaced water weighs as much as the buoy. For a sphere
+# this is the depth h of a spherical cap of volume m / rho, the root in [0, 2r] of the cubic pi/3 h^2 (3r - h) = m / rho,
+# which has a closed form. Everything here works on whole arrays of configurations, e.g. the members of a sweep.
+
+
+def sphere_equilibria(r, m, rho):
+    # With u = h / r and f the fraction of the sphere submerged, the cubic is u^3 - 3u^2 + 4f = 0, and with u = 1 + w
+    # the depressed cubic w^3 - 3w + 4f - 2 = 0, whose root in [-1, 1] is 2 cos(arccos(1 - 2f) / 3 - 2 pi / 3). One
+    # Newton step on the volume restores the precision arccos loses near the top and bottom of the sphere
+    r, m, rho = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(m, dtype=float), np.asarray(rho, dtype=float))
+    volume = m / rho
+    fraction = np.clip(volume / ((4 / 3) * np.pi * r ** 3), 0, 1)
+    h = r * (1 + 2 * np.cos(np.arccos(1 - 2 * fraction) / 3 - 2 * np.pi / 3))
+
+    slope = np.pi * h * (2 * r - h)
+    step = np.divide(np.pi / 3 * h ** 2 * (3 * r - h) - volume, slope, out=np.zeros_like(h), where=slope > 0)
+    h = np.clip(h - np.where(fraction < 1, step, 0), 0, 2 * r)
+    return h if h.ndim else float(h)
+
+
+def cylinder_equilibria(r, m, rho):
+    # Same expression as buoy_simulation.cylinder_equilibrium, so the results are identical
+    return m / (rho * math.pi * np.asarray(r, dtype=float) ** 2)
+
+
+@lru_cache(maxsize=4096)
+def sphere_equilibrium(r, m, rho):
+    # Single configuration, remembered so that repeated setups (e.g. the same buoy at every point of a PTO sweep) are
+    # solved once
+    return sphere_equilibria(r, m, rho)
+
+
+def equilibria(shape_buoy, r, m, rho):
+    # Equilibrium depth per configuration. Cylinders are closed form; spheres are solved once per distinct (r, m, rho)
+    shape_buoy, r, m, rho = np.broadcast_arrays(shape_buoy, np.asarray(r, dtype=float), np.asarray(m, dtype=float),
+                                                np.asarray(rho, dtype=float))
+    out = cylinder_equilibria(r, m, rho)
+    is_sphere = shape_buoy == 'sphere'
+    if is_sphere.any():
+        keys, inverse = np.unique(np.stack((r[is_sphere], m[is_sphere], rho[is_sphere]), axis=1), axis=0, return_inverse=True)
+        out[is_sphere] = sphere_equilibria(keys[:, 0], keys[:, 1], keys[:, 2])[inverse.ravel()]
+    return out
+
+
+def bisection_equilibrium(r, m, rho):
+    # The bisection buoy_simulation used before this module, kept as a reference
+    target = m / rho
+    low, high = 0.0, 2.0 * r
+    if target >= (4 / 3) * math.pi * r ** 3:
+        return high
+    for _ in range(200):
+        h = (low + high) / 2
+        if ((math.pi * h ** 2) / 3) * ((3 * r) - h) < target:
+            low = h
+        else:
+            high = h
+        if high - low <= 4 * sys.float_info.epsilon * r:
+            break
+    return (low + high) / 2
+
+
+if __name__ == '__main__':
+    # Compares the closed form against bisection over a grid of radii and masses, and times both
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    r = rng.uniform(1, 15, count)
+    m = rng.uniform(0, 1.05, count) * (4 / 3) * np.pi * r ** 3 * 1025
+
+    start = time.perf_counter()
+    closed = sphere_equilibria(r, m, 1025)
+    closed_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bisected = np.array([bisection_equilibrium(a, b, 1025) for a, b in zip(r, m)])
+    bisection_time = time.perf_counter() - start
+
+    print('{:d} spheres: closed form {:.4f} s, bisection {:.2f} s, largest difference {:.3g} m'.format(
+        count, closed_time, bisection_time, np.max(np.abs(closed - bisected))))
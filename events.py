@@ -0,0 +1,93 @@
+import sys
+import time
+
+import numpy as np
+
+import data_source
+
+
+# Index of the moments of a run worth jumping to: tube-end strikes, where the relative stroke (piston - buoy) is more
+# than half the tube length, and out-of-water moments, where the buoy's submersion (equilibrium + buoy - wave, as the
+# model computes it) is below zero. Events are found in one vectorised pass over the run, a chunk at a time so lazily
+# loaded runs are never read whole, and are looked up by binary search.
+
+EVENT_KINDS = ['tube end strike', 'out of water']
+
+
+class EventIndex:
+    # Events as [start, end) intervals: end is the first sample after the event. starts, ends and kinds are sorted by
+    # start across all kinds, for next/previous jumps
+    def __init__(self, starts, ends, kinds):
+        order = np.argsort(starts, kind='stable')
+        self.starts = np.asarray(starts, dtype=float)[order]
+        self.ends = np.asarray(ends, dtype=float)[order]
+        self.kinds = np.asarray(kinds, dtype=int)[order]
+        self.by_kind = [(self.starts[self.kinds == kind], self.ends[self.kinds == kind]) for kind in range(len(EVENT_KINDS))]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def next_event(self, sim_time):
+        # Index of the first event starting after sim_time, or None
+        i = int(np.searchsorted(self.starts, sim_time, side='right'))
+        return i if i < len(self) else None
+
+    def previous_event(self, sim_time):
+        # Index of the last event starting before sim_time, or None
+        i = int(np.searchsorted(self.starts, sim_time, side='left')) - 1
+        return i if i >= 0 else None
+
+    def kinds_at(self, sim_time):
+        # Names of the events under way at sim_time. Events of one kind don't overlap, so only the last event of each
+        # kind starting at or before sim_time can contain it
+        names = []
+        for name, (starts, ends) in zip(EVENT_KINDS, self.by_kind):
+            i = int(np.searchsorted(starts, sim_time, side='right')) - 1
+            if i >= 0 and ends[i] > sim_time:
+                names.append(name)
+        return names
+
+    def times_of(self, kind):
+        return self.by_kind[kind][0]
+
+
+def find_events(source, tube_length, equilibrium, chunk_size=1 << 20):
+    # EventIndex of a data source. An event still under way at a chunk boundary is carried into the next chunk
+    starts = [[] for _ in EVENT_KINDS]
+    ends = [[] for _ in EVENT_KINDS]
+    state = np.zeros(len(EVENT_KINDS), dtype=bool)
+    last_time = None
+
+    for start in range(0, len(source), chunk_size):
+        t, buoy, piston, wave = source.window(start, min(start + chunk_size, len(source)))
+        conditions = [np.abs(piston - buoy) > tube_length / 2, equilibrium + buoy - wave < 0]
+        for kind, inside in enumerate(conditions):
+            changes = np.flatnonzero(np.diff(np.concatenate(([state[kind]], inside)).astype(np.int8)))
+            starts[kind].append(t[changes[inside[changes]]])
+            ends[kind].append(t[changes[~inside[changes]]])
+            state[kind] = inside[-1]
+        last_time = t[-1]
+
+    for kind in np.flatnonzero(state):
+        ends[kind].append(np.array([last_time]))
+
+    kinds = np.concatenate([np.full(sum(len(s) for s in starts[kind]), kind) for kind in range(len(EVENT_KINDS))])
+    return EventIndex(np.concatenate([np.concatenate(s) for s in starts]), np.concatenate([np.concatenate(e) for e in ends]), kinds)
+
+
+def source_events(source):
+    # EventIndex of a data file's source, from the device parameters stored with it
+    return find_events(source, float(source.parameters['tube_length']), float(source.parameters['buoy_equilibrium']))
+
+
+if __name__ == '__main__':
+    # Indexes a file and lists how many events of each kind it has
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'demo_file.mat'
+    source = data_source.open_source(filename)
+
+    start = time.perf_counter()
+    index = source_events(source)
+    print('{:d} samples indexed in {:.3f} s'.format(len(source), time.perf_counter() - start))
+    for kind, name in enumerate(EVENT_KINDS):
+        times = index.times_of(kind)
+        print('{:s}: {:d}{:s}'.format(name, len(times), ', first at {:.2f} s'.format(times[0]) if len(times) else ''))
@@ -0,0 +1,167 @@
+import sys
+import time
+
+import numpy as np
+
+import batch_simulation
+import buoy_simulation
+import processing
+import waves
+
+
+# Frequency-domain solution of the two-body model for the linear regime: the buoy stays in the water without being
+# fully submerged and the piston stays inside the tube. There, with buoyancy linearised about equilibrium as a
+# hydrostatic stiffness rho g A (A the waterplane area at the equilibrium depth), the model of buoy_simulation is a
+# linear two-mass system. For a wave component x = Re(X exp(i omega t)) the steady buoy and piston motions about
+# equilibrium, Y1 and Y2, solve
+#   [-m1 w^2 + i w (C_wave + C_damper) + k + K    -(i w C_damper + K)          ] [Y1]   [(k + i w C_wave) X]
+#   [-(i w C_damper + K)                          -m2 w^2 + i w C_damper + K   ] [Y2] = [0                 ]
+# One np.linalg.solve call solves this for every member of a batch (batch_simulation.batch_variables) and every wave
+# component at once. Each member is checked against the assumptions, and only the members that break them need the
+# time-domain solver (see screen).
+
+FLAGS = ['tube_end', 'out_of_water', 'submerged', 'stiffness']
+
+
+def waterplane_area(batch, depth):
+    # Waterplane area at a submersion depth, per member
+    r = batch['r_buoy']
+    depth = np.clip(depth, 0, np.where(batch['shape_buoy'] == 'sphere', 2 * r, batch['L_buoy']))
+    return np.where(batch['shape_buoy'] == 'sphere', np.pi * depth * (2 * r - depth), np.pi * r ** 2)
+
+
+def wave_components(forcing):
+    # (amplitudes, omegas) of a RegularWave or SpectralWave. Phases don't change the mean power or the stroke
+    # statistics of a linear system, so they are dropped
+    if isinstance(forcing, waves.RegularWave):
+        return np.array([forcing.amplitude]), np.array([forcing.omega])
+    if isinstance(forcing, waves.SpectralWave):
+        return forcing.amplitudes, forcing.omegas
+    raise ValueError('Only regular and spectral waves have a frequency-domain solution')
+
+
+def response(batch, omegas):
+    # Complex buoy and piston responses per unit wave amplitude, each (members, components)
+    omega = np.asarray(omegas, dtype=float)[None, :]
+    m1, m2, C_wave, C_damper, K = (batch[name][:, None] for name in ['m1', 'm2', 'C_wave', 'C_damper', 'K'])
+    stiffness = (batch['rho'] * batch['g'] * waterplane_area(batch, batch['buoy_equilibrium']))[:, None]
+
+    coupling = -(1j * omega * C_damper + K)
+    matrix = np.empty(np.broadcast_shapes(m1.shape, omega.shape) + (2, 2), dtype=complex)
+    matrix[..., 0, 0] = -m1 * omega ** 2 + 1j * omega * (C_wave + C_damper) + stiffness + K
+    matrix[..., 0, 1] = coupling
+    matrix[..., 1, 0] = coupling
+    matrix[..., 1, 1] = -m2 * omega ** 2 + 1j * omega * C_damper + K
+    forcing = np.zeros(matrix.shape[:-1] + (1,), dtype=complex)
+    forcing[..., 0, 0] = stiffness + 1j * omega * C_wave
+
+    solved = np.linalg.solve(matrix, forcing)[..., 0]
+    return solved[..., 0], solved[..., 1]
+
+
+def expected_maximum(amplitudes, omegas, duration):
+    # Largest value expected of a linear response with component amplitudes (members, components) over duration: the
+    # amplitude itself for one component, otherwise the Rayleigh estimate sigma sqrt(2 ln N) for N zero up-crossings
+    if amplitudes.shape[-1] == 1:
+        return amplitudes[..., 0]
+    m0 = np.sum(amplitudes ** 2, axis=-1) / 2
+    m2 = np.sum((amplitudes * omegas) ** 2, axis=-1) / 2
+    crossings = duration * np.sqrt(m2 / np.maximum(m0, 1e-300)) / (2 * np.pi)
+    return np.sqrt(m0) * np.sqrt(2 * np.log(np.maximum(crossings, np.e)))
+
+
+def solve(batch, forcing=None, duration=600, stiffness_tolerance=0.25, chunk_size=1 << 18):
+    # Mean absorbed power, stroke and buoy responses of every member of a batch in a regular wave (by default the
+    # batch's Hs and T, as the MATLAB script uses them) or a spectral sea. Results are shaped like batch['grid_shape']:
+    #   power_mean        mean power absorbed by the damper (the spring's averages to zero)
+    #   stroke_amplitude  amplitude of the relative stroke (piston - buoy), or its expected maximum over duration
+    #   heave_amplitude   the same for the buoy's submersion about equilibrium
+    #   tube_end, out_of_water, submerged  the stroke reaches the tube ends, or the submersion leaves [0, full depth]
+    #   stiffness         the waterplane area changes by more than stiffness_tolerance over the submersion range, so
+    #                     the linearised buoyancy is poor (spheres only)
+    #   linear            none of the flags are set, so the result stands for the time-domain solution
+    # Members are solved chunk_size wave components at a time, to bound memory on large sweeps of spectral seas
+    forcing = waves.RegularWave(batch['Hs'], batch['T']) if forcing is None else forcing
+    amplitudes, omegas = wave_components(forcing)
+    count = batch_simulation.member_count(batch)
+    out = {name: np.empty(count) for name in ['power_mean', 'stroke_amplitude', 'heave_amplitude']}
+
+    step = max(1, chunk_size // len(omegas))
+    for start in range(0, count, step):
+        members = slice(start, min(start + step, count))
+        chunk = batch_simulation.select(batch, np.arange(members.start, members.stop))
+        buoy, piston = response(chunk, omegas)
+        stroke = np.abs(piston - buoy) * amplitudes
+        heave = np.abs(buoy - 1) * amplitudes
+        out['power_mean'][members] = np.sum(0.5 * chunk['C_damper'][:, None] * (omegas * stroke) ** 2, axis=-1)
+        out['stroke_amplitude'][members] = expected_maximum(stroke, omegas, duration)
+        out['heave_amplitude'][members] = expected_maximum(heave, omegas, duration)
+
+    equilibrium = batch['buoy_equilibrium']
+    full_depth = np.where(batch['shape_buoy'] == 'sphere', 2 * batch['r_buoy'], batch['L_buoy'])
+    heave = out['heave_amplitude']
+    area = waterplane_area(batch, equilibrium)
+    area_change = np.maximum(np.abs(waterplane_area(batch, equilibrium - heave) - area),
+                             np.abs(waterplane_area(batch, equilibrium + heave) - area)) / area
+
+    out['tube_end'] = out['stroke_amplitude'] > batch['tube_length'] / 2
+    out['out_of_water'] = heave > equilibrium
+    out['submerged'] = heave > full_depth - equilibrium
+    out['stiffness'] = area_change > stiffness_tolerance
+    out['linear'] = ~np.any([out[flag] for flag in FLAGS], axis=0)
+    return {name: value.reshape(batch['grid_shape']) for name, value in out.items()}
+
+
+def screen(batch, forcing=None, t_range=None, settle=0.25, **options):
+    # solve, then rerun only the members that break the linear assumptions with batch_simulation, replacing their
+    # power_mean and stroke_amplitude with time-domain values. These are taken after the first settle fraction of the
+    # run, once the start from rest has died away. t_range defaults to 20 periods of a regular wave, or 600 s of a sea.
+    # Returns the results of solve, with 'time_domain' marking the members that were rerun
+    forcing = waves.RegularWave(batch['Hs'], batch['T']) if forcing is None else forcing
+    if t_range is None:
+        t_range = (0, 20 * forcing.T) if isinstance(forcing, waves.RegularWave) else (0, options.get('duration', 600))
+    result = solve(batch, forcing, **options)
+    result['time_domain'] = ~result['linear']
+
+    rerun = np.flatnonzero(result['time_domain'].ravel())
+    if len(rerun):
+        metadata = waves.forcing_metadata(forcing, t_range)
+        t, motion = batch_simulation.run_batch(batch_simulation.select(batch, rerun), metadata, chunk_size=4096)
+        motion = motion[:, t >= t_range[0] + settle * (t_range[1] - t_range[0])]
+        series = processing.stack_series(motion, batch['C_damper'][rerun], batch['K'][rerun])
+        result['power_mean'].ravel()[rerun] = series[:, -3].mean(axis=-1)
+        result['stroke_amplitude'].ravel()[rerun] = np.abs(series[:, 2]).max(axis=-1)
+    return result
+
+
+if __name__ == '__main__':
+    # Compares a few cylinder buoys (whose buoyancy is exactly linear in range) against ode45 in a regular wave, then
+    # times a PTO sweep
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    base = buoy_simulation.base_variables(shape_buoy='cylinder', Hs=0.5)
+    forcing = waves.RegularWave(base['Hs'], base['T'])
+    periods = 40
+    metadata = waves.forcing_metadata(forcing, (0, periods * base['T']))
+
+    for C_damper, K in [(3e5, 0), (3e6, 0), (3e6, 1e6)]:
+        linear = solve(batch_simulation.batch_variables(T=base['T'], Hs=base['Hs'], shape_buoy='cylinder', C_damper=C_damper, K=K), forcing)
+        simulation = buoy_simulation.run_simulation(dict(base, C_damper=C_damper, K=K), metadata, rtol=1e-8, atol=1e-10)
+        t = simulation['data']['time']
+        steady = t >= (periods - 10) * base['T']
+        series = processing.stack_series(simulation['data']['motion'][steady], C_damper, K)
+        power = np.trapz(series[-3], t[steady]) / (t[steady][-1] - t[steady][0])
+        print('C_damper {:.3g}, K {:.3g}: power {:.4g} W (ode45 {:.4g} W), stroke {:.4g} m (ode45 {:.4g} m)'.format(
+            C_damper, K, float(linear['power_mean']), power, float(linear['stroke_amplitude']), np.abs(series[2]).max()))
+
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, side)[:, None], K=np.linspace(0, 2e6, side)[None, :])
+    start = time.perf_counter()
+    result = solve(batch)
+    elapsed = time.perf_counter() - start
+    print('{:d} members in {:.3f} s, {:d} outside the linear regime'.format(
+        batch_simulation.member_count(batch), elapsed, int(np.sum(~result['linear']))))
+
+    sea = waves.jonswap(2.4, 7.8, components=200, seed=0)
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, 100)[:, None], K=np.linspace(0, 2e6, 100)[None, :])
+    start = time.perf_counter()
+    solve(batch, sea)
+    print('{:d} members in a 200 component sea in {:.3f} s'.format(batch_simulation.member_count(batch), time.perf_counter() - start))
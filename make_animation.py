@@ -1,6 +1,23 @@
 import time
 import sys
 import os
+import argparse
+import shutil
+import subprocess
+import json
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+STARTED = time.time()  # start of the script, for --timing
+SERVER_PORT = 50637
+SERVER_READ_TIMEOUT = 5  # seconds a client has to send its request before it is dropped
+LIVE_PORT = 50638  # as data_source.LIVE_PORT, which isn't imported until the arguments are checked
+TRACE_FILE = 'frame_trace.json'  # where the frame profile is written, unless --profile names a file
+EVENT_COLOURS = [(200, 0, 0), (230, 140, 0)]  # timeline ticks, in events.EVENT_KINDS order
+SHIFT_STEP = 10  # simulation seconds stepped by shift + left/right
+STATS_WINDOW = 30  # simulation seconds covered by the rolling stats panel, unless --stats-panel gives another
 
 
 class CurrentPositions:
@@ -23,6 +40,205 @@ class CurrentPositions:
         self.wave_y = wave_init
 
 
+class PlaybackClock:
+    # Simulation time driven by the wall clock: the elapsed real time multiplied by the playback speed. Runs loop back
+    # to the start, live feeds (streaming) stop at the last sample received. Shared by Playback and
+    # comparison.BatchPlayback
+    streaming = False
+
+    def __init__(self, start_time, end_time):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.sim_time = start_time
+        self.last_tick = None
+
+    def time_at(self, wall_time, speed, wall_start, sim_start):
+        # Simulation time shown at wall_time by a clock that showed sim_start at wall_start and has played on at speed
+        sim_time = sim_start + (wall_time - wall_start) * speed
+        if self.streaming:
+            # A live feed can't be played past the last sample received, or looped back to dropped ones
+            return min(max(sim_time, self.start_time), self.end_time)
+        span = self.end_time - self.start_time
+        if sim_time > self.end_time and span > 0:
+            # Loops back to the start, like the sample-by-sample loop did
+            sim_time = self.start_time + (sim_time - self.start_time) % span
+        return sim_time
+
+    def advance(self, speed):
+        now = time.perf_counter()
+        if self.last_tick is not None:
+            self.sim_time = self.time_at(now, speed, self.last_tick, self.sim_time)
+        self.last_tick = now
+        return self.sim_time
+
+    def sync(self, wall_time, sim_time):
+        # The clock showed sim_time at wall_time, e.g. for a frame made ahead by a FramePrefetcher
+        self.sim_time = sim_time
+        self.last_tick = wall_time
+
+    def hold(self):
+        self.last_tick = None
+
+    def seek(self, sim_time):
+        self.sim_time = min(max(sim_time, self.start_time), self.end_time)
+        self.last_tick = None
+
+
+class Playback(PlaybackClock):
+    # Positions at any simulation time, interpolated between the (adaptively spaced) ode45 samples, so the frame rate
+    # doesn't depend on how densely the solver sampled the run. Only a window of samples around the current time is
+    # read from the data source, so long runs in lazily loaded files are never pulled in whole.
+    def __init__(self, source, window_size=4096):
+        super().__init__(source.start_time, source.end_time)
+        self.source = source
+        self.streaming = source.streaming
+        self.window_size = window_size
+        self.window_start = 0
+        self.t = None
+        self.motion = None
+        self.index = 0
+
+    def load_window(self, start, stop):
+        start = min(start, len(self.source) - 2)
+        stop = min(max(stop, start + 2), len(self.source))
+        t, buoy_motion, piston_motion, wave_motion = self.source.window(start, stop)
+        self.source.release(start)
+        self.window_start = start
+        self.t = t
+        self.motion = np.vstack((buoy_motion, piston_motion, wave_motion))
+        self.index = 0
+
+    def in_window(self, low, high):
+        return self.t is not None and (self.t[0] <= low or self.window_start == 0) and \
+            (high < self.t[-1] or self.window_start + len(self.t) == len(self.source))
+
+    def find_index(self, sim_time):
+        # Playback mostly moves forward by less than one sample, so check the last interval before binary searching
+        if not self.in_window(sim_time, sim_time):
+            start = self.source.search(sim_time)
+            self.load_window(start, start + self.window_size)
+
+        i = self.index
+        if self.t[i] <= sim_time < self.t[i + 1]:
+            return i
+        if i + 2 < len(self.t) and self.t[i + 1] <= sim_time < self.t[i + 2]:
+            self.index = i + 1
+            return self.index
+        self.index = int(min(max(np.searchsorted(self.t, sim_time, side='right') - 1, 0), len(self.t) - 2))
+        return self.index
+
+    def positions(self, sim_time):
+        # Linear interpolation of buoy, piston and wave at once. Accepts a scalar time or an array of ascending times
+        if np.ndim(sim_time) == 0:
+            i = self.find_index(sim_time)
+        else:
+            if not self.in_window(sim_time[0], sim_time[-1]):
+                self.load_window(self.source.search(sim_time[0]), self.source.search(sim_time[-1]) + 2)
+            i = np.clip(np.searchsorted(self.t, sim_time, side='right') - 1, 0, len(self.t) - 2)
+        t0 = self.t[i]
+        dt = self.t[i + 1] - t0
+        fraction = np.clip(np.divide(sim_time - t0, dt, out=np.zeros_like(dt), where=dt > 0), 0, 1)
+        return self.motion[:, i] + (self.motion[:, i + 1] - self.motion[:, i]) * fraction
+
+    def advance(self, speed):
+        if self.streaming:
+            self.start_time = self.source.start_time
+            self.end_time = self.source.end_time
+        return super().advance(speed)
+
+
+class FramePrefetcher:
+    # Makes playback frames on a background thread, due at absolute deadlines, with a new generation on every restart
+    def __init__(self, source, fps, capacity=16):
+        self.playback = Playback(source)  # its own window, separate from the main thread's
+        self.period = 1 / fps
+        self.frames = queue.Queue(capacity)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.generation = 0
+        self.timeline = None  # (generation, wall time, simulation time, speed) of the frames being made
+        self.dropped = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                return
+
+    def restart(self, sim_time, speed):
+        # Frames from now on, starting with one due immediately at sim_time
+        with self.lock:
+            self.generation += 1
+            self.timeline = (self.generation, time.perf_counter(), sim_time, speed)
+        self.drain()
+        self.wake.set()
+
+    def halt(self):
+        with self.lock:
+            self.generation += 1
+            self.timeline = None
+            self.wake.clear()
+        self.drain()
+
+    def close(self):
+        self.running = False
+        self.halt()
+        self.wake.set()
+        self.thread.join(1)
+
+    def produce(self):
+        playback = self.playback
+        while self.running:
+            self.wake.wait()
+            with self.lock:
+                timeline = self.timeline
+            if timeline is None:
+                continue
+
+            generation, wall_start, sim_start, speed = timeline
+            k = 0
+            while self.running and self.generation == generation:
+                # Deadlines already more than a period past are skipped rather than made late
+                k = max(k, int((time.perf_counter() - wall_start) / self.period))
+                deadline = wall_start + k * self.period
+                sim_time = playback.time_at(deadline, speed, wall_start, sim_start)
+                frame = (generation, deadline, sim_time, playback.positions(sim_time))
+                while self.running and self.generation == generation:
+                    try:
+                        self.frames.put(frame, timeout=self.period)
+                        break
+                    except queue.Full:
+                        pass
+                k += 1
+
+    def next_deadline(self):
+        # Wall time the next frame of the current generation is due, or None when halted
+        timeline = self.timeline
+        if timeline is None:
+            return None
+        _, wall_start, _, _ = timeline
+        return wall_start + (int((time.perf_counter() - wall_start) / self.period) + 1) * self.period
+
+    def next_frame(self):
+        # (deadline, simulation time, positions) of the next frame of the current generation that is still due, or
+        # None if none is ready yet. Never waits, so the event loop isn't held up by a slow producer
+        while True:
+            try:
+                generation, deadline, sim_time, positions = self.frames.get_nowait()
+            except queue.Empty:
+                return None
+            if generation != self.generation:
+                continue
+            if deadline < time.perf_counter() - self.period:
+                self.dropped += 1
+                continue
+            return deadline, sim_time, positions
+
+
 class Circle:
     def __init__(self, y, radius, colour=(0, 0, 0), thickness=0):
         self.colour = colour
@@ -41,8 +257,9 @@ class Line:
         self.thickness = thickness
         self.colour = colour
 
-    def display(self):
-        pygame.draw.line(run_data.screen, self.colour, self.start_point, self.end_point, self.thickness)
+    def display(self, surface=None):
+        surface = run_data.screen if surface is None else surface
+        pygame.draw.line(surface, self.colour, self.start_point, self.end_point, self.thickness)
 
 
 class Rectangle:
@@ -55,9 +272,10 @@ class Rectangle:
         self.colour = colour
         self.rect = (self.x - self.width / 2, self.y - self.height / 2, self.width, self.height)
 
-    def display(self):
+    def display(self, surface=None):
+        surface = run_data.screen if surface is None else surface
         self.rect = (self.x - self.width / 2, self.y - self.height / 2, self.width, self.height)
-        pygame.draw.rect(run_data.screen, self.colour, self.rect, 0)
+        pygame.draw.rect(surface, self.colour, self.rect, 0)
 
 
 class Buoy:
@@ -140,8 +358,10 @@ class Button:
         self.hovering = False
         self.mouse_is_down = False
         self.click_counter = run_data.speed / 10
+        self.label = None
 
-    def display(self):
+    def update_state(self):
+        # Called once per frame. Returns the colour so the renderer can tell when the button needs redrawing
         if self.clicking:
             self.shape.colour = self.flash_colour
             self.click_counter -= 1
@@ -153,18 +373,30 @@ class Button:
             self.shape.colour = self.hover_colour
         else:
             self.shape.colour = self.base_colour
+        return self.shape.colour
+
+    def display(self, surface=None):
+        surface = run_data.screen if surface is None else surface
+        if self.label is None:
+            self.render_label()
         self.shape.x = self.x
         self.shape.y = self.y
-        self.shape.display()
-        surf = self.font.render(self.text, True, (0, 0, 0))
-        rect = surf.get_rect(center=(self.x, self.y))
-        run_data.screen.blit(surf, rect)
+        self.shape.display(surface)
+        rect = self.label.get_rect(center=(self.x, self.y))
+        surface.blit(self.label, rect)
+
+    def get_rect(self):
+        return pygame.Rect(self.x - self.rect_size[0] / 2, self.y - self.rect_size[1] / 2, self.rect_size[0], self.rect_size[1])
+
+    def render_label(self):
+        self.label = self.font.render(self.text, True, (0, 0, 0))
 
     def get_font_size(self):
         surf = self.font.render(self.text, False, (0, 0, 0))
         return surf.get_rect().size
 
     def resize_rect(self):
+        self.render_label()
         size = self.get_font_size()
         self.padding = size[0] * 0.1
 
@@ -206,15 +438,418 @@ class Button:
             self.hovering = False
 
 
+class FrameTimer:
+    # Smoothed time spent in update_screen(), shown under the time so the cost of drawing can be seen
+    def __init__(self, smoothing=0.05, label_interval=0.5):
+        self.smoothing = smoothing
+        self.label_interval = label_interval
+        self.average = None
+        self.label = ''
+        self.last_label = 0
+
+    def add(self, frame_time):
+        if self.average is None:
+            self.average = frame_time
+        else:
+            self.average += (frame_time - self.average) * self.smoothing
+
+        now = time.perf_counter()
+        if now - self.last_label > self.label_interval:
+            self.label = 'Frame: {:.2f} ms'.format(self.average * 1000)
+            self.last_label = now
+
+
+class FrameProfile:
+    # Optional per-phase timings of every frame (--profile, or F3 while the window is open). The last `capacity` frames
+    # are kept in arrays allocated when profiling is first switched on, so recording a phase is a couple of array
+    # writes. Phases follow each other through the frame (idle is the wait for an event while nothing is playing),
+    # except text, draw and display, which are parts of render.
+    # The averages are shown in the window and the frames are written as a Chrome trace (open it in chrome://tracing
+    # or https://ui.perfetto.dev) when the window closes
+    PHASES = ['idle', 'events', 'advance', 'render', 'text', 'draw', 'display', 'sleep']
+
+    def __init__(self, trace_file=TRACE_FILE, capacity=1 << 14, label_interval=0.5):
+        self.trace_file = trace_file
+        self.capacity = capacity
+        self.label_interval = label_interval
+        self.columns = {phase: k for k, phase in enumerate(self.PHASES)}
+        self.enabled = False
+        self.frame_starts = None
+        self.starts = None
+        self.durations = None
+        self.sleep_requested = None
+        self.frames = 0
+        self.row = 0
+        self.last_mark = None
+        self.lines = ()
+        self.last_label = 0
+
+    def toggle(self):
+        if self.frame_starts is None:
+            self.frame_starts = np.zeros(self.capacity)
+            self.starts = np.zeros((self.capacity, len(self.PHASES)))
+            self.durations = np.zeros((self.capacity, len(self.PHASES)))
+            self.sleep_requested = np.zeros(self.capacity)
+        self.enabled = not self.enabled
+        self.last_mark = None  # nothing more is recorded until the next frame starts
+        self.lines = ()
+        self.last_label = 0
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.row = self.frames % self.capacity
+        self.frames += 1
+        self.frame_starts[self.row] = now
+        self.durations[self.row] = 0
+        self.sleep_requested[self.row] = 0
+        self.last_mark = now
+
+    def add(self, phase, start):
+        # Adds the time since start to a phase of the current frame
+        if self.last_mark is None:
+            return
+        now = time.perf_counter()
+        column = self.columns[phase]
+        if self.durations[self.row, column] == 0:
+            self.starts[self.row, column] = start
+        self.durations[self.row, column] += now - start
+        return now
+
+    def mark(self, phase, sleep_requested=0):
+        # Ends a phase that started at the previous mark
+        if self.last_mark is not None:
+            self.last_mark = self.add(phase, self.last_mark)
+            self.sleep_requested[self.row] += sleep_requested
+
+    def recent_rows(self, count):
+        count = min(self.frames, self.capacity, count)
+        return np.arange(self.frames - count, self.frames) % self.capacity
+
+    def overlay(self):
+        # Lines of text for the window, averaged over the last couple of seconds of complete frames
+        if not self.enabled or self.frames < 3:
+            return ()
+        now = time.perf_counter()
+        if now - self.last_label > self.label_interval:
+            self.last_label = now
+            rows = self.recent_rows(120)
+            periods = np.diff(self.frame_starts[rows])
+            rows = rows[:-1]  # the current frame isn't finished
+            ms = dict(zip(self.PHASES, self.durations[rows].mean(axis=0) * 1000))
+            drift = (self.durations[rows, self.columns['sleep']] - self.sleep_requested[rows]).mean() * 1000
+            self.lines = ('FPS: {:.1f}, frame {:.2f} ms, worst {:.2f} ms'.format(1 / periods.mean(), periods.mean() * 1000, periods.max() * 1000),
+                          'Events {events:.2f}, advance {advance:.2f}, render {render:.2f} ms'.format(**ms),
+                          'Text {text:.2f}, draw {draw:.2f}, display {display:.2f} ms'.format(**ms),
+                          'Sleep {:.2f} ms, overslept {:+.2f} ms, idle {:.2f} ms'.format(ms['sleep'], drift, ms['idle']))
+        return self.lines
+
+    def write_trace(self):
+        # Every recorded phase as a complete ("X") event, in microseconds from the first frame kept
+        rows = self.recent_rows(self.capacity)
+        origin = self.frame_starts[rows[0]]
+        events = []
+        for row in rows.tolist():
+            ends = self.starts[row] + self.durations[row]
+            recorded = self.durations[row] > 0
+            frame_end = ends[recorded].max() if recorded.any() else self.frame_starts[row]
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': (self.frame_starts[row] - origin) * 1e6,
+                           'dur': (frame_end - self.frame_starts[row]) * 1e6})
+            for column in np.flatnonzero(recorded).tolist():
+                event = {'name': self.PHASES[column], 'ph': 'X', 'pid': 1, 'tid': 1,
+                         'ts': (self.starts[row, column] - origin) * 1e6, 'dur': self.durations[row, column] * 1e6}
+                if self.PHASES[column] == 'sleep':
+                    event['args'] = {'requested_ms': self.sleep_requested[row] * 1000}
+                events.append(event)
+
+        with open(self.trace_file, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        print('Trace of {:d} frames written to {:s}'.format(len(rows), self.trace_file))
+
+
+class StatsPanel:
+    # Optional rolling statistics of the PTO power, relative stroke and distance to the tube ends (--stats-panel, or s
+    # while the window is open), kept by rolling_stats.RollingStats as the run plays. Its prefix integrals and pyramid
+    # are built when the panel is first shown. The window slides every frame but the text is only rebuilt every
+    # label_interval while playing, as rendering it costs more than the stats
+    def __init__(self, window=STATS_WINDOW, label_interval=0.25):
+        self.window = window
+        self.label_interval = label_interval
+        self.enabled = False
+        self.stats = None
+        self.sim_time = None
+        self.lines = ()
+        self.last_label = 0
+
+    def toggle(self):
+        if sim_data.source.streaming:
+            return  # a live feed has no prefix integrals to look up
+        if self.stats is None:
+            from rolling_stats import RollingStats
+            self.stats = RollingStats(sim_data.source, self.window)
+        self.enabled = not self.enabled
+        self.sim_time = None
+        self.lines = ()
+
+    def overlay(self, sim_time):
+        if not self.enabled:
+            return ()
+        stats = self.stats
+        if sim_time != self.sim_time:
+            stats.update(sim_time)
+            self.sim_time = sim_time
+
+        now = time.perf_counter()
+        playing = run_data.playing and not run_data.paused
+        if not self.lines or not playing or now - self.last_label > self.label_interval:
+            self.last_label = now
+            self.lines = ('Power {:s}, {:g} s mean {:s}, rms {:s}'.format(power_text(stats.power), self.window,
+                                                                          power_text(stats.power_mean), power_text(stats.power_rms)),
+                          'Power range {:s} to {:s}'.format(power_text(stats.power_min), power_text(stats.power_max)),
+                          'Stroke {:+.2f} m, rms {:.2f} m, max {:.2f} m'.format(stats.stroke, stats.stroke_rms, stats.stroke_max),
+                          'Tube end margin {:+.2f} m, least {:+.2f} m'.format(stats.clearance, stats.clearance_min))
+        return self.lines
+
+
+def timeline_reach(overview, start, end, columns, half_tube):
+    # Largest relative stroke in each pixel column of the timeline, as a fraction of half the tube length, from the
+    # decimation.Pyramid of the run so long runs aren't read whole
+    t, low, high = overview.query(start, end, columns)
+    reach = np.maximum(high[3], -low[3]) / half_tube
+    if len(t) != columns:
+        # Runs with fewer samples than columns come back as the samples themselves
+        reach = np.interp(start + (np.arange(columns) + 0.5) * (end - start) / columns, t, reach)
+    return reach
+
+
+def power_text(watts):
+    if abs(watts) >= 1e6:
+        return '{:.2f} MW'.format(watts / 1e6)
+    return '{:.1f} kW'.format(watts / 1e3)
+
+
+class Renderer:
+    # Layered renderer. The sky and the sea (each with the water and equilibrium lines drawn on) and the overlay of
+    # buttons and speed/scale text are cached surfaces, rebuilt only on resize or when a button or the text changes.
+    # Each frame only the areas the bodies, the sea surface and the time text moved through are redrawn from those
+    # layers, and only those rectangles are pushed to the display.
+    def __init__(self, show_controls=True):
+        self.show_controls = show_controls
+        self.sky = None
+        self.sea = None
+        self.overlay = None
+        self.overlay_key = None
+        self.overlay_rects = []
+        self.text_key = None
+        self.text_surfs = []
+        self.text_rects = []
+        self.body_rect = None
+        self.cursor_rect = None
+        self.sea_top = None
+        self.full_redraw = True
+        self.timer = FrameTimer()
+
+    def invalidate(self):
+        self.full_redraw = True
+
+    def build_layers(self):
+        size = (settings.screen_width, settings.screen_height)
+        components.water_line.end_point[0] = settings.screen_width
+        components.equilibrium_line.end_point[0] = settings.screen_width
+
+        self.sky = pygame.Surface(size).convert()
+        self.sky.fill(colours.background)
+        self.sea = pygame.Surface(size).convert()
+        self.sea.fill(components.water.colour)
+        for layer in [self.sky, self.sea]:
+            components.water_line.display(layer)
+            components.equilibrium_line.display(layer)
+
+    def build_overlay(self, key):
+        self.overlay_key = key
+        self.overlay = pygame.Surface((settings.screen_width, settings.screen_height), pygame.SRCALPHA)
+        self.overlay_rects = []
+
+        if not self.show_controls:
+            return
+
+        for button in components.buttons.values():
+            button.display(self.overlay)
+            self.overlay_rects.append(button.get_rect())
+
+        speed_text = settings.font['ui'].render('Speed: {:g}'.format(run_data.speed), True, (0, 0, 0))
+        scale_text = settings.font['ui'].render('Scale: {:g}'.format(run_data.scale_factor), True, (0, 0, 0))
+        speed_rect = speed_text.get_rect()
+        scale_rect = scale_text.get_rect()
+        speed_rect.topleft = (settings.screen_width - speed_rect.width-settings.edge_border, settings.edge_border)
+        scale_rect.topleft = (settings.screen_width - scale_rect.width-settings.edge_border, speed_rect.height/2 + scale_rect.height/2 + 15)
+
+        self.overlay.blit(speed_text, speed_rect)
+        self.overlay.blit(scale_text, scale_rect)
+        self.overlay_rects += [speed_rect, scale_rect]
+
+        # Timeline along the bottom edge, darker where the piston comes nearer the tube ends, with a tick at the start
+        # of each event
+        timeline = self.timeline_rect()
+        self.overlay.fill((150, 150, 150), timeline)
+        if run_data.overview is not None:
+            reach = timeline_reach(run_data.overview, run_data.playback.start_time, run_data.playback.end_time,
+                                   timeline.width, sim_data.tube_length / 2)
+            shade = (150 - 120 * np.clip(reach, 0, 1)).astype(np.uint8)
+            strip = pygame.Surface(timeline.size)
+            pygame.surfarray.blit_array(strip, np.repeat(np.repeat(shade[:, None, None], timeline.height, 1), 3, 2))
+            self.overlay.blit(strip, timeline)
+        if run_data.events is not None and len(run_data.events):
+            span = max(run_data.playback.end_time - run_data.playback.start_time, 1e-9)
+            x = timeline.left + (run_data.events.starts - run_data.playback.start_time) / span * timeline.width
+            # One tick per pixel column is enough, however many events fall in it
+            columns, first = np.unique(x.astype(int), return_index=True)
+            for column, kind in zip(columns.tolist(), run_data.events.kinds[first].tolist()):
+                self.overlay.fill(EVENT_COLOURS[kind], (column, timeline.top - 3, 1, timeline.height + 3))
+        self.overlay_rects.append(timeline.inflate(0, 6))
+
+    def timeline_rect(self):
+        return pygame.Rect(settings.edge_border, settings.screen_height - 7, settings.screen_width - 2 * settings.edge_border, 4)
+
+    def find_cursor_rect(self):
+        if not self.show_controls:
+            return None
+        timeline = self.timeline_rect()
+        span = run_data.playback.end_time - run_data.playback.start_time
+        fraction = (run_data.now_time - run_data.playback.start_time) / span if span > 0 else 0
+        rect = pygame.Rect(0, 0, 3, 9)
+        rect.center = (timeline.left + min(max(fraction, 0), 1) * timeline.width, timeline.centery)
+        return rect
+
+    def timeline_time(self, position):
+        # Simulation time under a point on the timeline (within a few pixels of it), or None
+        timeline = self.timeline_rect()
+        if not self.show_controls or not timeline.inflate(0, 12).collidepoint(position):
+            return None
+        fraction = min(max((position[0] - timeline.left) / timeline.width, 0), 1)
+        return run_data.playback.start_time + fraction * (run_data.playback.end_time - run_data.playback.start_time)
+
+    def build_text(self, key):
+        # Time and frame time change while playing, so they are kept out of the cached overlay
+        self.text_key = key
+        self.text_surfs = [settings.font['ui'].render(text, True, (0, 0, 0)) for text in key if text]
+        self.text_rects = []
+        y = 10
+        for surf in self.text_surfs:
+            rect = surf.get_rect(topleft=(10, y))
+            self.text_rects.append(rect)
+            y += rect.height
+
+    def find_body_rect(self):
+        floater = components.buoy_assembly.floater
+        tube = components.buoy_assembly.tube
+        piston = components.piston
+        centre = settings.screen_width / 2
+
+        if isinstance(floater, Circle):
+            rect = pygame.Rect(centre - floater.radius, floater.y - floater.radius, floater.radius * 2, floater.radius * 2)
+        else:
+            rect = pygame.Rect(centre - floater.width / 2, floater.y - floater.height / 2, floater.width, floater.height)
+
+        tube_half_width = tube.radius + tube.thickness
+        rect.union_ip(pygame.Rect(centre - tube_half_width, tube.y - tube.length / 2, tube_half_width * 2, tube.length))
+        rect.union_ip(pygame.Rect(centre - piston.radius, piston.y - piston.length - piston.plunger.thickness,
+                                  piston.radius * 2, piston.length + piston.plunger.thickness * 2))
+        return rect.inflate(4, 4)
+
+    def draw_area(self, rect):
+        screen = run_data.screen
+        screen.set_clip(rect)
+
+        sky_area = rect.clip(pygame.Rect(0, 0, settings.screen_width, self.sea_top))
+        sea_area = rect.clip(pygame.Rect(0, self.sea_top, settings.screen_width, settings.screen_height - self.sea_top))
+        if sky_area.size != (0, 0):
+            screen.blit(self.sky, sky_area.topleft, sky_area)
+        if sea_area.size != (0, 0):
+            screen.blit(self.sea, sea_area.topleft, sea_area)
+
+        components.buoy_assembly.display()
+        components.piston.display()
+
+        screen.blit(self.overlay, rect.topleft, rect)
+        for surf, text_rect in zip(self.text_surfs, self.text_rects):
+            if text_rect.colliderect(rect):
+                screen.blit(surf, text_rect)
+        if self.cursor_rect is not None and self.cursor_rect.colliderect(rect):
+            screen.fill((0, 0, 0), self.cursor_rect)
+
+        screen.set_clip(None)
+
+    def render(self):
+        frame_start = time.perf_counter()
+        profile = run_data.profile
+        place_bodies()
+
+        overlay_key = (run_data.speed, run_data.scale_factor, tuple(button.update_state() for button in components.buttons.values()))
+        event_text = ''
+        if run_data.events is not None:
+            event_text = ', '.join(run_data.events.kinds_at(run_data.now_time)).capitalize()
+        text_key = ('{:.2f}/{:.2f}'.format(run_data.now_time, run_data.end_time), self.timer.label if self.show_controls else '',
+                    event_text) + run_data.stats_panel.overlay(run_data.now_time) + profile.overlay()
+        body_rect = self.find_body_rect()
+        cursor_rect = self.find_cursor_rect()
+        sea_top = int(components.water.y_top)
+
+        text_start = time.perf_counter()
+        if self.full_redraw:
+            self.build_layers()
+            self.build_overlay(overlay_key)
+            self.build_text(text_key)
+            rects = [run_data.screen.get_rect()]
+        else:
+            rects = []
+            if overlay_key != self.overlay_key:
+                rects += self.overlay_rects
+                self.build_overlay(overlay_key)
+                rects += self.overlay_rects
+            if text_key != self.text_key:
+                rects += self.text_rects
+                self.build_text(text_key)
+                rects += self.text_rects
+            if body_rect != self.body_rect:
+                rects.append(body_rect.union(self.body_rect))
+            if cursor_rect != self.cursor_rect:
+                rects.append(cursor_rect.union(self.cursor_rect))
+            if sea_top != self.sea_top:
+                rects.append(pygame.Rect(0, min(sea_top, self.sea_top) - 1, settings.screen_width, abs(sea_top - self.sea_top) + 2))
+        profile.add('text', text_start)
+
+        self.body_rect = body_rect
+        self.cursor_rect = cursor_rect
+        self.sea_top = sea_top
+
+        draw_start = time.perf_counter()
+        for rect in rects:
+            self.draw_area(rect)
+        profile.add('draw', draw_start)
+
+        display_start = time.perf_counter()
+        if self.full_redraw:
+            pygame.display.update()
+            self.full_redraw = False
+        elif rects:
+            pygame.display.update(rects)
+        profile.add('display', display_start)
+
+        self.timer.add(time.perf_counter() - frame_start)
+
+
 class Sea:
     def __init__(self, y_top, colour=(0, 0, 0)):
         self.y_top = y_top
         self.colour = colour
         self.rect = (0, self.y_top, settings.screen_width, settings.screen_height - self.y_top+1)
 
-    def display(self):
+    def display(self, surface=None):
+        surface = run_data.screen if surface is None else surface
         self.rect = (0, self.y_top, settings.screen_width, settings.screen_height - self.y_top+1)
-        pygame.draw.rect(run_data.screen, self.colour, self.rect, 0)
+        pygame.draw.rect(surface, self.colour, self.rect, 0)
 
 
 def start_animation():
@@ -227,9 +862,11 @@ def stop_animation():
     run_data.playing = False
     run_data.paused = False
 
-    run_data.current_pos.update_base(sim_data.buoy_motion[0], sim_data.piston_motion[0], sim_data.wave_motion[0])
+    run_data.playback.seek(run_data.playback.start_time)
+    run_data.seeks += 1
+    run_data.current_pos.update_base(*run_data.playback.positions(run_data.playback.start_time))
     run_data.current_pos.update_scaled()
-    run_data.now_time = 0
+    run_data.now_time = run_data.playback.start_time
     update_screen()
 
 
@@ -237,20 +874,86 @@ def pause_animation():
     run_data.paused = True
 
 
-def speed_up():
-    if run_data.speed >= 1:
-        run_data.speed += 1
+def seek_animation(sim_time):
+    # Jumps to any time. The sample is found by binary search, so this costs the same anywhere in the run, and playing
+    # carries on from there
+    playback = run_data.playback
+    playback.seek(sim_time)
+    run_data.seeks += 1
+    run_data.now_time = playback.sim_time
+    run_data.current_pos.update_base(*playback.positions(run_data.now_time))
+    run_data.current_pos.update_scaled()
+    run_data.redraw = True
+
+
+def sample_time(index):
+    return float(run_data.playback.source.window(index, index + 1)[0][0])
+
+
+def step_samples(count):
+    # Moves count samples forward (or back), from the sample at or before the current time
+    source = run_data.playback.source
+    index = source.search(run_data.now_time)
+    if count < 0 and sample_time(index) < run_data.now_time:
+        count += 1  # between samples, one step back is the sample before
+    seek_animation(sample_time(min(max(index + count, 0), len(source) - 1)))
+
+
+def jump_to_event(forward):
+    if run_data.events is None:
+        return
+    if forward:
+        event = run_data.events.next_event(run_data.now_time)
     else:
-        run_data.speed *= 2
+        event = run_data.events.previous_event(run_data.now_time)
+    if event is not None:
+        seek_animation(float(run_data.events.starts[event]))
+
+
+def key_pressed(event):
+    # Left and right step a sample (SHIFT_STEP seconds with shift), n and p jump to the next and previous event, s shows
+    # the stats panel
+    shift = event.mod & pygame.KMOD_SHIFT
+    if event.key == pygame.K_F3:
+        run_data.profile.toggle()
+    elif event.key == pygame.K_s:
+        run_data.stats_panel.toggle()
+    elif event.key == pygame.K_SPACE:
+        if run_data.playing and not run_data.paused:
+            pause_animation()
+        else:
+            start_animation()
+    elif event.key == pygame.K_RIGHT:
+        seek_animation(run_data.now_time + SHIFT_STEP) if shift else step_samples(1)
+    elif event.key == pygame.K_LEFT:
+        seek_animation(run_data.now_time - SHIFT_STEP) if shift else step_samples(-1)
+    elif event.key == pygame.K_HOME:
+        seek_animation(run_data.playback.start_time)
+    elif event.key == pygame.K_END:
+        seek_animation(run_data.playback.end_time)
+    elif event.key == pygame.K_n:
+        jump_to_event(True)
+    elif event.key == pygame.K_p:
+        jump_to_event(False)
+
+
+def faster(speed):
+    # Speeds step by 1 above 1, and halve or double below it
+    return speed + 1 if speed >= 1 else speed * 2
+
+
+def slower(speed):
+    if speed <= 0.125:
+        return speed
+    return speed - 1 if speed > 1 else speed / 2
+
+
+def speed_up():
+    run_data.speed = faster(run_data.speed)
 
 
 def slow_down():
-    if run_data.speed <= 0.125:
-        pass
-    elif run_data.speed > 1:
-        run_data.speed -= 1
-    else:
-        run_data.speed /= 2
+    run_data.speed = slower(run_data.speed)
 
 
 def scale_up():
@@ -294,27 +997,12 @@ def resize():
     components.piston.plunger.thickness = int(sim_data.tube_radius * run_data.scale_factor * 0.3)
     components.buoy_assembly.tube.thickness = int(sim_data.tube_radius * run_data.scale_factor * 0.2)
 
+    components.renderer.invalidate()
     update_screen()
 
 
-def update_screen():
-
-    components.water_line.end_point[0] = settings.screen_width
-    components.equilibrium_line.end_point[0] = settings.screen_width
-
-    run_data.screen.fill(colours.background)
-    time_text = settings.font['ui'].render('{:.2f}/{:.2f}'.format(run_data.now_time, run_data.end_time), True, (0, 0, 0))
-    speed_text = settings.font['ui'].render('Speed: {:g}'.format(run_data.speed), True, (0, 0, 0))
-    scale_text = settings.font['ui'].render('Scale: {:g}'.format(run_data.scale_factor), True, (0, 0, 0))
-
-    speed_rect = speed_text.get_rect()
-    scale_rect = scale_text.get_rect()
-
+def place_bodies():
     components.water.y_top = sim_data.water_datum + run_data.current_pos.wave_y_scaled
-    components.water.display()
-    components.water_line.display()
-    components.equilibrium_line.display()
-
     components.piston.y = sim_data.piston_datum + run_data.current_pos.piston_y_scaled
 
     if sim_data.buoy_shape == 'sphere':
@@ -323,16 +1011,10 @@ def update_screen():
         components.buoy_assembly.floater.y = sim_data.water_datum - (components.buoy_assembly.floater.height/2) + sim_data.buoy_equilibrium * run_data.scale_factor + run_data.current_pos.buoy_y_scaled
 
     components.buoy_assembly.tube.y = sim_data.piston_datum + run_data.current_pos.buoy_y_scaled
-    components.buoy_assembly.display()
-    components.piston.display()
-    for button in components.buttons.values():
-        button.display()
 
-    run_data.screen.blit(speed_text, (settings.screen_width - speed_rect.width-settings.edge_border, settings.edge_border))
-    run_data.screen.blit(scale_text, (settings.screen_width - scale_rect.width-settings.edge_border, speed_rect.height/2 + scale_rect.height/2 + 15))
-    run_data.screen.blit(time_text, (10, 10))
 
-    pygame.display.update()
+def update_screen():
+    components.renderer.render()
 
 
 def set_buttons():
@@ -433,6 +1115,7 @@ def resize_window():
 
     components.buoy_assembly.floater.x = width/2
 
+    components.renderer.invalidate()
     update_screen()
 
 
@@ -448,20 +1131,20 @@ def check_buttons(val):
 
 
 def print_sim_data(print_data, file):
-    period = float(print_data['T'][0])
-    frequency = float(print_data['F'][0])
-    significant_height = float(print_data['Hs'][0])
-    r_buoy = float(print_data['r_buoy'][0])
-    m1 = float(print_data['m1'][0])
-    m2 = float(print_data['m2'][0])
-    c_wave = float(print_data['C_wave'][0])
-    c_damper = float(print_data['C_damper'][0])
-    k = float(print_data['K'][0, 0])
-    length_buoy = float(print_data['L_buoy'][0])
-    shape_buoy = print_data['shape_buoy'][0]
-    length_tube = float(print_data['tube_length'][0])
-    r_tube = float(print_data['tube_radius'][0])
-    equilibrium = float(print_data['buoy_equilibrium'][0])
+    period = float(print_data['T'])
+    frequency = float(print_data['F'])
+    significant_height = float(print_data['Hs'])
+    r_buoy = float(print_data['r_buoy'])
+    m1 = float(print_data['m1'])
+    m2 = float(print_data['m2'])
+    c_wave = float(print_data['C_wave'])
+    c_damper = float(print_data['C_damper'])
+    k = float(print_data['K'])
+    length_buoy = float(print_data['L_buoy'])
+    shape_buoy = print_data['shape_buoy']
+    length_tube = float(print_data['tube_length'])
+    r_tube = float(print_data['tube_radius'])
+    equilibrium = float(print_data['buoy_equilibrium'])
 
     if shape_buoy != 'cylinder':
         length_buoy = ''
@@ -508,18 +1191,15 @@ Mass Ratio: {m_ratio:g}
 
 
 class SimData:
-    def __init__(self, simulation):
-        self.buoy_equilibrium = float(simulation['buoy_equilibrium'])
-        self.buoy_motion = simulation['buoy_motion'][0]
-        self.piston_motion = simulation['piston_motion'][0]
-        self.wave_motion = simulation['wave_motion'][0]
-        self.buoy_radius = float(simulation['buoy_radius'])
-        self.buoy_length = float(simulation['buoy_length'])
-        self.buoy_shape = str(simulation['buoy_shape'][0])
-        self.t = simulation['time'][0]
-        self.tube_radius = float(simulation['tube_radius'])
-        self.tube_length = float(simulation['tube_length'])
-        self.diff = self.buoy_motion - self.wave_motion
+    def __init__(self, source):
+        parameters = source.parameters
+        self.source = source
+        self.buoy_equilibrium = float(parameters['buoy_equilibrium'])
+        self.buoy_radius = float(parameters['buoy_radius'])
+        self.buoy_length = float(parameters['buoy_length'])
+        self.buoy_shape = str(parameters['buoy_shape'])
+        self.tube_radius = float(parameters['tube_radius'])
+        self.tube_length = float(parameters['tube_length'])
         self.water_datum = None
         self.piston_datum = None
         self.piston_offset = None
@@ -533,9 +1213,18 @@ class RunData:
         self.end_time = None
         self.screen = None
         self.current_pos = None
+        self.playback = None
         self.running = None
         self.playing = None
         self.paused = None
+        self.redraw = True  # something shown has changed since the last frame was drawn
+        self.scrubbing = False  # the timeline is being dragged
+        self.events = None  # events.EventIndex of the run, for the timeline
+        self.overview = None  # decimation.Pyramid of the run, for the timeline
+        self.seeks = 0  # counts jumps in the simulation time, so frames being prefetched for the old time are dropped
+        self.prefetcher = None  # FramePrefetcher, for runs that aren't streaming
+        self.profile = FrameProfile()
+        self.stats_panel = StatsPanel()
 
 
 class Colours:
@@ -544,6 +1233,7 @@ class Colours:
         self.buoyyellow = (219, 181, 12)
         self.green = (0, 154, 23)
         self.red = (255, 0, 0)
+        self.equilibrium = (200, 0, 0)
         self.background = (255, 255, 255)
 
 
@@ -561,6 +1251,7 @@ class Settings:
         self.button_padding = 0.2
         self.edge_border = 10
         self.button_spacing = 5
+        self.fps = 60
 
 
 class Components:
@@ -571,12 +1262,10 @@ class Components:
         self.buoy_assembly = None
         self.buttons = None
         self.piston = None
+        self.renderer = None
 
 
-def main():
-
-    if max([sim_data.buoy_radius, sim_data.tube_radius])*8 > settings.MIN_WIDTH:
-        settings.screen_width = max([sim_data.buoy_radius, sim_data.tube_radius])*8
+def build_components(show_controls=True):
 
     run_data.screen = pygame.display.set_mode((settings.screen_width, settings.screen_height), pygame.RESIZABLE)
 
@@ -589,7 +1278,7 @@ def main():
     # defining shapes
     components.water = Sea(sim_data.water_datum, colours.seablue)
     components.water_line = Line([0, sim_data.water_datum], [settings.screen_width, sim_data.water_datum], thickness=round(sim_data.buoy_radius*0.2))
-    components.equilibrium_line = Line([0, sim_data.piston_datum], [settings.screen_width, sim_data.piston_datum], thickness=2, colour=(200, 0, 0))
+    components.equilibrium_line = Line([0, sim_data.piston_datum], [settings.screen_width, sim_data.piston_datum], thickness=2, colour=colours.equilibrium)
 
     if sim_data.buoy_shape == 'cylinder':
         buoy = Rectangle((sim_data.buoy_radius*run_data.scale_factor*2, sim_data.buoy_length*run_data.scale_factor),
@@ -620,110 +1309,555 @@ def main():
     components.buttons = {'btn_start': btn_start, 'btn_pause': btn_pause, 'btn_stop': btn_stop,
                           'btn_faster': btn_faster, 'btn_slower': btn_slower,
                           'btn_bigger': btn_bigger, 'btn_smaller': btn_smaller}
+    components.renderer = Renderer(show_controls)
 
-    run_data.current_pos = CurrentPositions(sim_data.buoy_motion[0], sim_data.piston_motion[0], sim_data.wave_motion[0])
+    run_data.playback = Playback(sim_data.source)
+    run_data.now_time = run_data.playback.start_time
+    run_data.current_pos = CurrentPositions(*run_data.playback.positions(run_data.playback.start_time))
     run_data.current_pos.update_scaled()
 
     resize_window()
+
+
+def main(started=None):
+
+    if max([sim_data.buoy_radius, sim_data.tube_radius])*8 > settings.MIN_WIDTH:
+        settings.screen_width = max([sim_data.buoy_radius, sim_data.tube_radius])*8
+
+    if not sim_data.source.streaming:
+        from events import source_events
+        run_data.events = source_events(sim_data.source)
+
+    build_components()
     run_data.running = True
-    run_data.playing = False
+    run_data.playing = sim_data.source.streaming  # live feeds play as they arrive
     run_data.paused = False
 
-    def event_handling():
-        for event in pygame.event.get():
+    def event_handling(events):
+        for event in events:
             if event.type == pygame.QUIT:
                 run_data.running = False
                 break
             if event.type == pygame.MOUSEBUTTONUP:
+                run_data.scrubbing = False
                 check_buttons(1)
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     check_buttons(3)
+                    target = components.renderer.timeline_time(event.pos)
+                    if target is not None:
+                        run_data.scrubbing = True
+                        seek_animation(target)
             if event.type == pygame.MOUSEMOTION:
                 check_buttons(2)
+                if run_data.scrubbing:
+                    seek_animation(components.renderer.timeline_time((event.pos[0], components.renderer.timeline_rect().centery)))
             if event.type == pygame.WINDOWRESIZED:
                 resize_window()
+            if event.type == pygame.KEYDOWN:
+                key_pressed(event)
+        if events:
+            # Hovers, clicks and window events (e.g. the window being uncovered) can all change what is shown
+            run_data.redraw = True
+
+    clock = pygame.time.Clock()
+    frame_period = 1 / settings.fps
+    profile = run_data.profile
+    # Frames of files are made ahead on a background thread. Live feeds can't be read ahead, so they are advanced here
+    prefetcher = None if sim_data.source.streaming else FramePrefetcher(sim_data.source, settings.fps)
+    run_data.prefetcher = prefetcher
+    timeline = None
 
-    while run_data.running:
-        event_handling()
-        update_screen()
-        if run_data.playing:
+    update_screen()
+    if started is not None:
+        print('First frame {:.3f} s after start'.format(time.time() - started))
 
-            for i, (t_i, y_buoy, y_piston, y_wave) in enumerate(zip(sim_data.t, sim_data.buoy_motion, sim_data.piston_motion, sim_data.wave_motion)):
-                run_data.now_time = t_i
-                t0 = time.time_ns() / (10 ** 9)
-                event_handling()
-
-                if run_data.paused:
-                    while run_data.paused:
-                        event_handling()
-                        update_screen()
-                        if not run_data.running:
-                            break
-
-                if not run_data.running or not run_data.playing:
-                    break
-
-                run_data.current_pos.buoy_y = y_buoy
-                run_data.current_pos.piston_y = y_piston
-                run_data.current_pos.wave_y = y_wave
+    # Frames are only drawn while playing, or when an event may have changed the window. Otherwise nothing can change
+    # until the next event, so the loop sleeps in pygame.event.wait rather than redrawing an unchanged window
+    while run_data.running:
+        frame_start = time.perf_counter()
+        profile.start_frame()
+        animating = run_data.playing and not run_data.paused
+        if animating or run_data.redraw:
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait()]
+            profile.mark('idle')
+            events += pygame.event.get()
+        event_handling(events)
+        profile.mark('events')
+
+        animating = run_data.playing and not run_data.paused
+        if prefetcher is not None:
+            # Playing, pausing, seeking and speed changes restart the frames being prefetched
+            if (animating, run_data.speed, run_data.seeks) != timeline:
+                timeline = (animating, run_data.speed, run_data.seeks)
+                if animating:
+                    prefetcher.restart(run_data.now_time, run_data.speed)
+                else:
+                    prefetcher.halt()
+                    run_data.playback.hold()
+            frame = prefetcher.next_frame() if animating else None
+            profile.mark('advance')
+            if frame is not None:
+                deadline, run_data.now_time, positions = frame
+                run_data.playback.sync(deadline, run_data.now_time)
+                run_data.end_time = run_data.playback.end_time
+                run_data.current_pos.update_base(*positions)
                 run_data.current_pos.update_scaled()
+                run_data.redraw = True
+            if animating:
+                # Sleeps until this frame is due, or if none was ready (the last one stays on screen) until the next
+                # one is, rather than for a period after the last frame
+                deadline = frame[0] if frame is not None else prefetcher.next_deadline()
+                sleep_requested = max(deadline - time.perf_counter(), 0)
+                if sleep_requested > 0:
+                    time.sleep(sleep_requested)
+                profile.mark('sleep', sleep_requested)
+        elif animating:
+            # Frames are not tied to samples: at high speed, samples between two frames are simply skipped
+            run_data.now_time = run_data.playback.advance(run_data.speed)
+            run_data.end_time = run_data.playback.end_time
+            run_data.current_pos.update_base(*run_data.playback.positions(run_data.now_time))
+            run_data.current_pos.update_scaled()
+            run_data.redraw = True
+            profile.mark('advance')
+        else:
+            run_data.playback.hold()
+            profile.mark('advance')
 
-                update_screen()
+        if run_data.redraw:
+            update_screen()
+            run_data.redraw = False
+        profile.mark('render')
 
-                t_i /= run_data.speed
-                t1 = time.time_ns() / (10 ** 9)
-                t_diff = t1 - t0
+        if prefetcher is None and animating:
+            # Caps the frame rate while playing
+            sleep_requested = max(frame_period - (time.perf_counter() - frame_start), 0)
+            clock.tick(settings.fps)
+            profile.mark('sleep', sleep_requested)
 
-                if i < len(sim_data.t)-1:
-                    t_to_next = sim_data.t[i+1]/run_data.speed - t_i
-                else:
-                    t_to_next = t_i - sim_data.t[i-1]/run_data.speed
+    if prefetcher is not None:
+        prefetcher.close()
 
-                if t_diff < t_to_next:
-                    time.sleep(t_to_next - t_diff)
 
+class FrameEncoder:
+    # Streams raw RGB frames into ffmpeg through a pipe, so no more than one frame is held in memory
+    def __init__(self, output, size, fps, codec_args):
+        if shutil.which('ffmpeg') is None:
+            raise FileNotFoundError('ffmpeg is needed to export video, export a .png sequence instead')
 
-def check_arguments():
-    arguments = sys.argv
-    if len(arguments) == 1:
-        file = 'demo_file.mat'
-    elif len(arguments) == 2:
-        file = arguments[1]
-    else:
-        raise KeyError('Too many arguments')
+        command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '{:d}x{:d}'.format(*size), '-r', '{:g}'.format(fps), '-i', '-'] + codec_args + [output]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
 
-    if file.lower() not in [x.lower() for x in os.listdir('.')]:
-        raise ValueError('File not in directory')
+    def write(self, surface):
+        self.process.stdin.write(pygame.image.tostring(surface, 'RGB'))
 
-    return file
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg exited with code {:d}'.format(self.process.returncode))
 
 
-if __name__ == '__main__':
-    # Getting and checking filename passed with run command. If none given, it returns the default "demo_file.mat"
-    filename = check_arguments()
+class ImageSequence:
+    # Writes each frame to its own numbered image, e.g. frames/frame_%05d.png
+    def __init__(self, pattern, first_frame):
+        self.pattern = pattern
+        self.frame = first_frame
+
+    def write(self, surface):
+        pygame.image.save(surface, self.pattern % self.frame)
+        self.frame += 1
+
+    def close(self):
+        pass
+
+
+# Segments in these containers can be joined without re-encoding, anything else is rendered in lossless segments
+COPY_CONCAT_FORMATS = ['.mp4', '.mkv', '.mov']
+
+
+def codec_arguments(output):
+    extension = os.path.splitext(output)[1].lower()
+    if extension in COPY_CONCAT_FORMATS:
+        return ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+    return []
+
+
+def sequence_pattern(output):
+    if '%' in output:
+        return output
+    root, extension = os.path.splitext(output)
+    return root + '_%05d' + extension
+
+
+def export_frames(filename, target, fps, size, first_frame, last_frame, is_sequence):
+    # Renders frames [first_frame, last_frame) of the animation to a video file or image sequence. Run in a worker
+    # process when exporting in parallel, so it sets up its own headless pygame and data
+    initialise(filename, headless=True)
+    # The minimum window size only exists to fit the buttons, exported frames are exactly the requested size
+    settings.screen_width, settings.screen_height = size
+    settings.MIN_WIDTH, settings.MIN_HEIGHT = size
+    build_components(show_controls=False)
+
+    if is_sequence:
+        writer = ImageSequence(target, first_frame)
+    elif os.path.splitext(target)[1].lower() == '.part':
+        writer = FrameEncoder(target, size, fps, ['-f', 'matroska', '-c:v', 'ffv1'])
+    else:
+        writer = FrameEncoder(target, size, fps, codec_arguments(target))
+
+    # Positions are interpolated for a block of frames at a time, so memory doesn't grow with the frame count
+    block = 1024
+    try:
+        for block_start in range(first_frame, last_frame, block):
+            frames = np.arange(block_start, min(block_start + block, last_frame))
+            times = run_data.playback.start_time + frames * run_data.speed / fps
+            positions = run_data.playback.positions(times)
+
+            for i, t_i in enumerate(times):
+                run_data.now_time = t_i
+                run_data.current_pos.update_base(*positions[:, i])
+                run_data.current_pos.update_scaled()
+                update_screen()
+                writer.write(run_data.screen)
+    finally:
+        writer.close()
+        pygame.quit()
+
+    return target
+
+
+def export_animation(filename, output, fps, size, workers):
+    # Frame size is kept even, as the common video pixel formats need it
+    size = (int(size[0]) // 2 * 2, int(size[1]) // 2 * 2)
+
+    source = open_source(filename)
+    try:
+        print_sim_data(source.simulation_data, filename)  # Printing data
+        speed = float(source.speed)
+        frame_count = int(np.floor((source.end_time - source.start_time) * fps / speed)) + 1
+    finally:
+        source.close()
+
+    is_sequence = '%' in output or os.path.splitext(output)[1].lower() == '.png'
+    workers = max(1, min(workers, frame_count))
+    bounds = np.linspace(0, frame_count, workers + 1).astype(int)
+
+    if is_sequence:
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        targets = [sequence_pattern(output)] * workers
+    elif workers == 1:
+        targets = [output]
+    elif os.path.splitext(output)[1].lower() in COPY_CONCAT_FORMATS:
+        targets = ['{:s}.{:03d}{:s}'.format(os.path.splitext(output)[0], i, os.path.splitext(output)[1]) for i in range(workers)]
+    else:
+        targets = ['{:s}.{:03d}.part'.format(os.path.splitext(output)[0], i) for i in range(workers)]
 
-    # Moved pygame and scipy imports here so arguments can be checked faster
+    print('Exporting {:d} frames at {:g} fps to {:s} using {:d} worker(s)'.format(frame_count, fps, output, workers))
+
+    if workers == 1:
+        export_frames(filename, targets[0], fps, size, 0, frame_count, is_sequence)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(export_frames, filename, targets[i], fps, size, bounds[i], bounds[i + 1], is_sequence)
+                       for i in range(workers)]
+            segments = [future.result() for future in futures]
+
+        if not is_sequence:
+            stitch_segments(segments, output)
+
+
+def stitch_segments(segments, output):
+    # Joins the rendered segments in order with ffmpeg's concat demuxer, then removes them
+    list_file = os.path.splitext(output)[0] + '.segments.txt'
+    with open(list_file, 'w') as file:
+        for segment in segments:
+            file.write("file '{:s}'\n".format(os.path.abspath(segment).replace("'", "'\\''")))
+
+    codec_args = ['-c', 'copy'] if os.path.splitext(output)[1].lower() in COPY_CONCAT_FORMATS else []
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file] + codec_args + [output]
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_file)
+        for segment in segments:
+            os.remove(segment)
+
+
+def import_modules():
+    # pygame and scipy are imported here rather than at the top so arguments can be checked faster
+    global pygame, np, open_source
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
     import pygame
-    from scipy.io import loadmat
+    import numpy as np
+    from data_source import open_source
+
 
-    pygame.init()  # Initialising pygame
+def initialise(filename, headless=False, source=None):
+    # Loads the data file and creates the holder variables used throughout the module
+    global settings, sim_data, run_data, colours, components
 
-    data = loadmat(filename, chars_as_strings=1)  # loading data
+    if headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
-    print_sim_data(data['simulation_data'][0, 0], filename)  # Printing data
+    import_modules()
+    # Only the display (which also delivers the events) and fonts are used, so the audio and joystick subsystems that
+    # pygame.init() would start are left alone
+    pygame.display.init()
+    pygame.font.init()
+
+    if source is None:
+        source = open_source(filename)  # opening data, the series are only read as they are played
 
     # Initialising holder variables
     settings = Settings()
-    sim_data = SimData(data['simulation'][0, 0])
+    sim_data = SimData(source)
     run_data = RunData()
     colours = Colours()
     components = Components()
 
     # Adding some necessary values to the run_data variable
-    run_data.speed = float(data['speed'])
-    run_data.scale_factor = float(data['scale'])
-    run_data.end_time = max(sim_data.t)
+    run_data.speed = float(source.speed)
+    run_data.scale_factor = float(source.scale)
+    run_data.end_time = source.end_time
+
+    return source
+
+
+def animate(filename, started=None, source=None, trace=None, stats_file=None, stats_window=None):
+    # trace starts the window with frame profiling on, writing to that file. stats_file runs the window under cProfile
+    # and saves the stats there (read them with pstats or snakeviz). stats_window starts it with the stats panel shown,
+    # over windows of that many seconds
+    source = initialise(filename, source=source)
+
+    print_sim_data(source.simulation_data, filename)  # Printing data
+
+    if not source.streaming:
+        from decimation import open_pyramid
+        run_data.overview = open_pyramid(filename, source)
+
+    if trace is not None:
+        run_data.profile.trace_file = trace
+        run_data.profile.toggle()
+    if stats_window is not None:
+        run_data.stats_panel.window = stats_window
+        run_data.stats_panel.toggle()
 
     # Main loop
-    main()
+    if stats_file is None:
+        main(started)
+    else:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.runcall(main, started)
+        profiler.dump_stats(stats_file)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+    if run_data.profile.frames:
+        run_data.profile.write_trace()
+    pygame.display.quit()
+    source.close()
+
+
+def send_to_server(filename, port, started=None):
+    # Hands the file to a running animator server, returns False if there isn't one
+    import socket
+
+    request = json.dumps({'file': os.path.abspath(filename), 'started': started}) + '\n'
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=2) as connection:
+            connection.sendall(request.encode('utf-8'))
+            reply = connection.makefile().readline().strip()
+    except OSError:
+        return False
+
+    if reply != 'ok':
+        raise ValueError('Animator server: {:s}'.format(reply))
+    return True
+
+
+def animator_process(requests):
+    # Runs in a child of the server: imports everything up front, then shows the one file it is sent. The server keeps
+    # one of these waiting, so a window opens without the import time
+    import_modules()
+    import scipy.io
+    try:
+        request = requests.recv()
+    except EOFError:
+        return  # the server closed
+    animate(request['file'], request.get('started'))
+
+
+def serve():
+    # "serve" sub-command: a long-lived animator that opens a window for each file sent with "make_animation.py FILE
+    # --server". Requests are taken by a listener thread and each window gets its own child process. Children are
+    # spawned rather than forked (forking a process with threads running isn't safe), and the next one is started as
+    # soon as the last is handed a file, so it has pygame, numpy and scipy imported by the time it is needed
+    import socket
+
+    parser = argparse.ArgumentParser(prog='make_animation.py serve',
+                                     description='Keep an animator running and open a window for each file sent to it')
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help='local port to listen on (default: {:d})'.format(SERVER_PORT))
+    arguments = parser.parse_args(sys.argv[2:])
+
+    requests = queue.Queue()
+    listener = socket.create_server(('127.0.0.1', arguments.port))
+
+    def listen():
+        while True:
+            connection, _ = listener.accept()
+            with connection:
+                # A client that connects and sends nothing would otherwise hold up every later request
+                connection.settimeout(SERVER_READ_TIMEOUT)
+                try:
+                    request = json.loads(connection.makefile().readline())
+                    if not os.path.isfile(request['file']):
+                        raise ValueError('File not found: {:s}'.format(request['file']))
+                    connection.sendall(b'ok\n')
+                except (ValueError, KeyError, TypeError, OSError) as error:
+                    try:
+                        connection.sendall('{}\n'.format(error).encode('utf-8'))
+                    except OSError:
+                        pass
+                    continue
+            requests.put(request)
+
+    threading.Thread(target=listen, daemon=True).start()
+    print('Animator server listening on port {:d}'.format(arguments.port))
+
+    context = multiprocessing.get_context('spawn')
+
+    def start_child():
+        receiver, sender = context.Pipe(duplex=False)
+        context.Process(target=animator_process, args=(receiver,)).start()
+        receiver.close()
+        return sender
+
+    waiting = start_child()
+    try:
+        while True:
+            request = requests.get()
+            try:
+                waiting.send(request)
+            except OSError as error:
+                print('Could not animate {:s}: {}'.format(request['file'], error))
+            waiting.close()
+            waiting = start_child()
+            context.active_children()  # reaps the windows that have closed
+    finally:
+        # Lets the waiting child exit, the open windows carry on
+        waiting.close()
+
+
+def convert_files():
+    # "convert" sub-command: writes .mat files as trajectory files, which the animator opens without parsing
+    parser = argparse.ArgumentParser(prog='make_animation.py convert',
+                                     description='Convert simulation .mat files to the .traj trajectory format')
+    parser.add_argument('files', nargs='+', help='.mat files to convert, each written next to it as .traj')
+    parser.add_argument('--output', help='output file name, when converting a single file')
+    parser.add_argument('--float32', action='store_true',
+                        help='store the motion series as float32, halving the file (time is always float64)')
+    parser.add_argument('--pyramid', action='store_true',
+                        help='store the decimation levels in the file too, rather than caching them next to it')
+    arguments = parser.parse_args(sys.argv[2:])
+
+    if arguments.output and len(arguments.files) > 1:
+        parser.error('--output can only be used with a single file')
+
+    import numpy as np
+    import data_source
+
+    for filename in arguments.files:
+        start = time.perf_counter()
+        output = data_source.convert(filename, arguments.output, np.float32 if arguments.float32 else np.float64,
+                                     arguments.pyramid)
+        print('{:s} -> {:s} ({:.2f} s)'.format(filename, output, time.perf_counter() - start))
+
+
+def check_arguments():
+    parser = argparse.ArgumentParser(description='Animate an IPS buoy simulation saved from IPS_buoy_simulation.m',
+                                     epilog='"make_animation.py convert FILE..." converts .mat files to the faster .traj format, '
+                                            '"make_animation.py serve" starts an animator server')
+    parser.add_argument('files', nargs='*', default=['demo_file.mat'], metavar='file',
+                        help='.mat or .traj file to animate (default: demo_file.mat). Two or more files are compared '
+                             'side by side on one clock')
+    parser.add_argument('--layout', choices=['grid', 'overlay'], default='grid',
+                        help='comparison layout: one device per cell, or all drawn over each other (default: grid)')
+    parser.add_argument('--export', metavar='OUT',
+                        help='render without a window to a video (e.g. out.mp4, out.gif) or a numbered .png sequence '
+                             '(e.g. frames/frame.png or frames/frame_%%05d.png)')
+    parser.add_argument('--fps', type=float, default=30, help='frame rate of the exported animation (default: 30)')
+    parser.add_argument('--size', default='1280x720', help='frame size of the exported animation (default: 1280x720)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes rendering frame ranges in parallel, 0 for one per core (default: 1)')
+    parser.add_argument('--server', action='store_true',
+                        help='open the window in a running animator server ("make_animation.py serve") if there is '
+                             'one, which starts faster as nothing is imported')
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help='port of the animator server (default: {:d})'.format(SERVER_PORT))
+    parser.add_argument('--timing', action='store_true', help='print the time from start to the first frame')
+    parser.add_argument('--profile', nargs='?', const=TRACE_FILE, metavar='TRACE',
+                        help='show per-phase frame timings in the window (F3 toggles them at any time) and write them '
+                             'as a Chrome trace on exit (default: {:s})'.format(TRACE_FILE))
+    parser.add_argument('--cprofile', metavar='STATS', help='run the animator under cProfile and save the stats to STATS')
+    parser.add_argument('--stats-panel', nargs='?', type=float, const=STATS_WINDOW, metavar='SECONDS',
+                        help='show rolling stats of the power, stroke and tube-end distance over the last SECONDS of '
+                             'the run (s toggles them at any time, default: {:g})'.format(STATS_WINDOW))
+    parser.add_argument('--live', nargs='?', type=int, const=LIVE_PORT, metavar='PORT',
+                        help='animate a simulation as it runs, from a feed sent to this port (default: {:d}) with '
+                             'data_source.LiveFeed'.format(LIVE_PORT))
+    arguments = parser.parse_args()
+    arguments.file = arguments.files[0]
+
+    if len(arguments.files) > 1 and (arguments.export or arguments.live is not None):
+        parser.error('--export and --live take a single file')
+    if arguments.live is not None:
+        return arguments
+    for filename in arguments.files:
+        if filename.lower() not in [x.lower() for x in os.listdir('.')]:
+            raise ValueError('File not in directory')
+
+    return arguments
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # lets the executables start the server's and exporter's worker processes
+    if sys.argv[1:2] == ['convert']:
+        convert_files()
+        sys.exit()
+    if sys.argv[1:2] == ['serve']:
+        serve()
+        sys.exit()
+
+    # Getting and checking filename passed with run command. If none given, it returns the default "demo_file.mat"
+    arguments = check_arguments()
+    filename = arguments.file
+
+    if arguments.live is not None:
+        import_modules()
+        from data_source import open_live
+
+        print('Waiting for a live feed on port {:d}'.format(arguments.live))
+        animate('live feed on port {:d}'.format(arguments.live), STARTED if arguments.timing else None, open_live(arguments.live),
+                arguments.profile, arguments.cprofile, arguments.stats_panel)
+    elif len(arguments.files) > 1:
+        import_modules()
+        from comparison import compare
+
+        compare(arguments.files, arguments.layout)
+    elif arguments.export:
+        import_modules()
+        export_size = [int(x) for x in arguments.size.lower().split('x')]
+        export_animation(filename, arguments.export, arguments.fps, export_size, arguments.workers or os.cpu_count())
+    elif arguments.profile or arguments.cprofile or arguments.stats_panel is not None or \
+            not (arguments.server and send_to_server(filename, arguments.port, STARTED if arguments.timing else None)):
+        # Profiled windows are always opened here, as the server doesn't take the options
+        animate(filename, STARTED if arguments.timing else None, trace=arguments.profile, stats_file=arguments.cprofile,
+                stats_window=arguments.stats_panel)
@@ -0,0 +1,309 @@
+import sys
+import time
+
+import numpy as np
+
+
+# Port of process_data and add_stats from IPS_buoy_simulation.m. The nested dictionaries follow the MATLAB structs,
+# e.g. processed['data']['power']['total']['mean']. The stats of every series are found together by batch_stats, which
+# works on arrays of series (..., samples), e.g. the twelve series of a run or of a whole batch of runs at once.
+
+STAT_NAMES = ['min', 'max', 'mean', 'rms', 'trimmed_min', 'trimmed_mean', 'trimmed_max', 'trimmed_rms',
+              'mean_peak', 'mean_min_peak']
+SERIES = [('displacement', ['buoy', 'piston', 'relative']),
+          ('velocity', ['buoy', 'piston', 'relative']),
+          ('force', ['damper', 'spring', 'total']),
+          ('power', ['damper', 'spring', 'total'])]
+
+# Scaled median absolute deviation factor, -1/(sqrt(2)*erfcinv(3/2)), as used by rmoutliers
+MAD_SCALE = 1.482602218505602
+
+
+def rmoutliers(data):
+    # MATLAB's default: drops elements more than three scaled MADs from the median
+    median = np.median(data)
+    mad = MAD_SCALE * np.median(np.abs(data - median))
+    return data[np.abs(data - median) <= 3 * mad]
+
+
+def findchangepts(data):
+    # Index (0-based) where the most significant change in mean starts, as findchangepts(data) with its defaults, or
+    # None if splitting doesn't reduce the residual. The residual of every split is found from cumulative sums
+    n = len(data)
+    if n < 2:
+        return None
+    cumulative = np.cumsum(data - np.mean(data))
+    k = np.arange(1, n)
+    left = cumulative[:-1]
+    # Residual reduction of splitting at k, for data of zero mean: S_k^2/k + S_k^2/(n-k)
+    gain = left ** 2 / k + left ** 2 / (n - k)
+    best = int(np.argmax(gain))
+    if gain[best] <= 0:
+        return None
+    return best + 1
+
+
+def findpeaks(data):
+    # Values of local maxima, taking the left edge of flat peaks, as findpeaks(data)
+    change = np.diff(data)
+    moving = np.flatnonzero(change)
+    direction = np.sign(change[moving])
+    # A rise followed (after any flat run) by a fall; the peak starts one sample after the rise
+    return data[moving[:-1][(direction[:-1] > 0) & (direction[1:] < 0)] + 1]
+
+
+def transient_end(data):
+    # Start of the trimmed data: the last change point, ignored if it is more than a third of the way in
+    change_pnt = findchangepts(data)
+    if change_pnt is None or change_pnt + 1 > len(data) * 0.3:
+        return 0
+    return change_pnt
+
+
+def add_stats(data):
+    # Stats of a single series. Kept as the direct port of add_stats, batch_stats gives the same values for many series
+    data = np.asarray(data, dtype=float)
+    cleaned = rmoutliers(data)
+    trimmed = data[transient_end(data):]
+
+    out = {'data': data,
+           'min': np.min(cleaned),
+           'max': np.max(cleaned),
+           'mean': np.mean(cleaned),
+           'rms': np.sqrt(np.mean(cleaned ** 2)),
+           'trimmed_min': np.min(trimmed),
+           'trimmed_mean': np.mean(trimmed),
+           'trimmed_max': np.max(trimmed),
+           'trimmed_rms': np.sqrt(np.mean(trimmed ** 2))}
+
+    pk_max = findpeaks(cleaned)
+    pk_min = findpeaks(-cleaned)
+    pk_max = pk_max[pk_max > 0]
+    pk_min = pk_min[pk_min > 0]
+    out['mean_peak'] = np.mean(pk_max) if len(pk_max) else np.nan
+    out['mean_min_peak'] = -np.mean(pk_min) if len(pk_min) else np.nan
+    return out
+
+
+def segment_stats(values, starts, count):
+    # min, max, mean and rms of the segments of values beginning at starts, each running to the next start
+    return (np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts) / count, np.sqrt(np.add.reduceat(values ** 2, starts) / count))
+
+
+def transient_ends(data):
+    # transient_end of every row, with the change points of all rows found from one cumulative sum
+    n = data.shape[1]
+    if n < 2:
+        return np.zeros(len(data), dtype=int)
+    left = np.cumsum(data - data.mean(axis=1, keepdims=True), axis=1)[:, :-1]
+    k = np.arange(1, n)
+    # S_k^2/k + S_k^2/(n-k) as S_k^2 * n/(k(n-k))
+    gain = left ** 2 * (n / (k * (n - k)))
+    best = np.argmax(gain, axis=1)
+    change_pnt = best + 1
+    ignored = (gain[np.arange(len(data)), best] <= 0) | (change_pnt + 1 > n * 0.3)
+    return np.where(ignored, 0, change_pnt)
+
+
+def ragged_peaks(values, rows, row_count):
+    # Sum and count of the positive maxima and negative minima of each row of ragged data, given as the values of all
+    # rows one after another and the row of each value. Peaks are found as by findpeaks, within each row only, so flat
+    # runs are skipped over
+    change = np.diff(values)
+    moving = np.flatnonzero((change != 0) & (rows[1:] == rows[:-1]))
+    rising = change[moving] > 0
+    # Consecutive changes in the same row: a rise then a fall is a peak, a fall then a rise a trough
+    same_row = rows[moving[:-1]] == rows[moving[1:]]
+    turn = values[moving[:-1] + 1]
+    turn_rows = rows[moving[:-1]]
+    peaks = same_row & rising[:-1] & ~rising[1:] & (turn > 0)
+    troughs = same_row & ~rising[:-1] & rising[1:] & (turn < 0)
+    return [(np.bincount(turn_rows[selected], weights=turn[selected], minlength=row_count),
+             np.bincount(turn_rows[selected], minlength=row_count)) for selected in [peaks, troughs]]
+
+
+def mean_peaks(values, count):
+    # Mean of the positive maxima and of the negative minima of each row of ragged data, given as the values of all
+    # rows one after another and the length of each row. In rows without flat runs every peak is a rise followed
+    # directly by a fall, which is found for all of them at once; the few rows with flat runs go through ragged_peaks
+    rows = len(count)
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    change = np.diff(values)
+    rising = change > 0
+    falling = change < 0
+
+    # Triples of samples (i, i + 1, i + 2) turning at i + 1, other than those spanning two rows
+    crossing = np.concatenate((starts[1:] - 2, starts[1:] - 1))
+    crossing = crossing[crossing >= 0]
+    centre = values[1:-1]
+    out = []
+    for turned, sign in [(rising[:-1] & falling[1:], 1), (falling[:-1] & rising[1:], -1)]:
+        turned[crossing] = False
+        turned &= sign * centre > 0
+        # Sums per row, with each turn counted in the row of its centre sample
+        padded = np.zeros(len(values))
+        padded[1:-1] = np.where(turned, centre, 0)
+        found = np.zeros(len(values))
+        found[1:-1] = turned
+        out.append((np.add.reduceat(padded, starts), np.add.reduceat(found, starts)))
+
+    # Changes of zero within a row mark the rows with flat runs
+    flat = np.zeros(len(values), dtype=bool)
+    flat[1:] = change == 0
+    flat[starts] = False
+    flat_rows = np.logical_or.reduceat(flat, starts)
+    if flat_rows.any():
+        selected = np.repeat(flat_rows, count)
+        ragged = ragged_peaks(values[selected], np.repeat(np.arange(rows)[flat_rows], count[flat_rows]), rows)
+        for (total, found), (flat_total, flat_found) in zip(out, ragged):
+            total[flat_rows] = flat_total[flat_rows]
+            found[flat_rows] = flat_found[flat_rows]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return [np.where(found > 0, total / found, np.nan) for total, found in out]
+
+
+def block_stats(data):
+    # batch_stats of a 2-D block of series
+    rows, n = data.shape
+
+    # rmoutliers: within three scaled MADs of the median. The kept samples of every row are gathered one row after
+    # another, and their stats taken per row segment
+    median = np.median(data, axis=1, keepdims=True)
+    deviation = np.abs(data - median)
+    mad = MAD_SCALE * np.median(deviation, axis=1, keepdims=True)
+    kept = deviation <= 3 * mad
+    cleaned = data[kept]
+    count = kept.sum(axis=1)
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    out = dict(zip(['min', 'max', 'mean', 'rms'], segment_stats(cleaned, starts, count)))
+
+    # Trimmed: from the end of the transient to the end of each row. Segments are read from the flattened block, with
+    # the discarded heads as segments of their own in between
+    start = transient_ends(data)
+    bounds = np.stack((np.arange(rows) * n + start, np.arange(1, rows + 1) * n), axis=1).ravel()[:-1]
+    stats = segment_stats(data.ravel(), bounds, np.repeat(n - start, 2)[:-1])
+    out.update(zip(['trimmed_min', 'trimmed_max', 'trimmed_mean', 'trimmed_rms'], (value[::2] for value in stats)))
+
+    out['mean_peak'], out['mean_min_peak'] = mean_peaks(cleaned, count)
+    return out
+
+
+def batch_stats(data, block_size=1 << 14):
+    # add_stats of every series in data (..., samples) in one pass: outliers are found once per series, the change
+    # points from cumulative sums and the peaks from the differences of all series together. Returns
+    # {stat: array (...)} for every name in STAT_NAMES. Series are taken about block_size samples at a time, as the
+    # many passes over the data are faster while it stays in the cache
+    data = np.asarray(data, dtype=float)
+    shape = data.shape[:-1]
+    data = data.reshape(-1, data.shape[-1])
+    rows = max(1, block_size // max(data.shape[1], 1))
+
+    out = {name: np.empty(len(data)) for name in STAT_NAMES}
+    for start in range(0, len(data), rows):
+        for name, values in block_stats(data[start:start + rows]).items():
+            out[name][start:start + rows] = values
+
+    return {name: out[name].reshape(shape) for name in STAT_NAMES}
+
+
+def stack_series(motion, C_damper, K):
+    # The twelve series of process_data, in SERIES order, from motion (..., samples, 4) of [y1, y1', y2, y2']. C_damper
+    # and K broadcast against the leading dimensions, e.g. one value per member of a batch. Returns (..., 12, samples)
+    motion = np.asarray(motion, dtype=float)
+    y1_d, y1_v, y2_d, y2_v = np.moveaxis(motion, -1, 0)
+    C_damper = np.asarray(C_damper, dtype=float)[..., None]
+    K = np.asarray(K, dtype=float)[..., None]
+
+    d_relative = y2_d - y1_d
+    v_relative = y2_v - y1_v
+    force_damper = C_damper * v_relative
+    force_spring = K * d_relative
+    power_damper = force_damper * v_relative
+    power_spring = force_spring * v_relative
+
+    return np.stack([y1_d, y2_d, d_relative, y1_v, y2_v, v_relative,
+                     force_damper, force_spring, force_damper + force_spring,
+                     power_damper, power_spring, power_damper + power_spring], axis=-2)
+
+
+def process_data(simulation, metadata):
+    # Displacement, velocity, force and power series of a run from buoy_simulation.run_simulation, each with its stats
+    simulation = dict(simulation)
+    sim_data = simulation['data']
+    series = stack_series(sim_data['motion'], simulation['C_damper'], simulation['K'])
+    stats = batch_stats(series)
+
+    data = {'time': sim_data['time'], 'motion': {}}
+    row = 0
+    for group, sources in SERIES:
+        branch = data['motion'].setdefault(group, {}) if group in ['displacement', 'velocity'] else data.setdefault(group, {})
+        for source in sources:
+            branch[source] = dict({'data': series[row]}, **{name: stats[name][row] for name in STAT_NAMES})
+            row += 1
+    data['wave_profile'] = np.interp(sim_data['time'], metadata['xt'], metadata['x'])
+
+    simulation['data'] = data
+    return simulation
+
+
+def summary(processed):
+    # Flat {'power_total_mean': ..., 'displacement_relative_mean_peak': ...} of every stat, without the time series
+    data = processed['data']
+    out = {}
+    for group, sources in SERIES:
+        branch = data['motion'][group] if group in ['displacement', 'velocity'] else data[group]
+        for source in sources:
+            for stat in STAT_NAMES:
+                out['{:s}_{:s}_{:s}'.format(group, source, stat)] = float(branch[source][stat])
+    return out
+
+
+def summary_fields():
+    return ['{:s}_{:s}_{:s}'.format(group, source, stat) for group, sources in SERIES for source in sources for stat in STAT_NAMES]
+
+
+def batch_summary(motion, C_damper, K):
+    # summary() of every run in a batch, e.g. from batch_simulation.integrate: motion (runs, samples, 4) and C_damper
+    # and K per run. Returns {field: array (runs,)}
+    stats = batch_stats(stack_series(motion, C_damper, K))
+    out = {}
+    row = 0
+    for group, sources in SERIES:
+        for source in sources:
+            for stat in STAT_NAMES:
+                out['{:s}_{:s}_{:s}'.format(group, source, stat)] = stats[stat][..., row]
+            row += 1
+    return out
+
+
+if __name__ == '__main__':
+    # Checks batch_stats against add_stats on a batch of runs and compares their times
+    import batch_simulation
+    import buoy_simulation
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    base = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(base['T'], base['Hs'])
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, count), K=np.linspace(0, 2e6, count))
+    t, motion = batch_simulation.run_batch(batch, metadata)
+    series = stack_series(motion, batch['C_damper'], batch['K'])
+
+    start = time.perf_counter()
+    stats = batch_stats(series)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    largest = 0
+    for run in range(count):
+        for row in range(len(series[run])):
+            single = add_stats(series[run, row])
+            for name in STAT_NAMES:
+                a, b = single[name], stats[name][run, row]
+                if not (np.isnan(a) and np.isnan(b)):
+                    largest = max(largest, abs(a - b) / max(abs(a), 1e-12))
+    single_time = time.perf_counter() - start
+
+    print('{:d} runs x 12 series: batch_stats {:.3f} s, add_stats {:.3f} s, largest relative difference {:.3g}'.format(
+        count, batch_time, single_time, largest))
@@ -0,0 +1,169 @@
+import sys
+import time
+
+import numpy as np
+
+import data_source
+import decimation
+
+
+# Rolling-window statistics of a run as it plays: the PTO power ((C_damper v + K d) v, as process_data computes it, with
+# the relative velocity v taken by differences of the relative stroke d = piston - buoy), the stroke and the distance
+# from the piston to the nearer tube end. Means and RMS are time-weighted and come from prefix integrals built once
+# over the whole run, so any window is two lookups. Minima and maxima come from a min/max pyramid of the power and
+# stroke, so any window, after a seek or not, is a few blocks per level.
+
+PREFIX_SERIES = ['power', 'power_squared', 'stroke', 'stroke_squared']
+
+
+def sample_values(source, start, stop, C_damper, K):
+    # Times, power and stroke of samples [start, stop). Velocities are central differences (one-sided at the ends of
+    # the run), so the neighbouring samples are read too and every sample gets the same value whichever chunk it is in
+    low = max(start - 1, 0)
+    high = min(stop + 1, len(source))
+    t, buoy, piston, _ = source.window(low, high)
+    stroke = piston - buoy
+    velocity = np.gradient(stroke, t) if len(t) > 1 else np.zeros_like(t)
+    power = (C_damper * velocity + K * stroke) * velocity
+    keep = slice(start - low, stop - low)
+    return t[keep], power[keep], stroke[keep]
+
+
+def prefix_integrals(source, C_damper, K, chunk_size=1 << 20):
+    # Sample times and (4, samples) running trapezoid integrals of PREFIX_SERIES from the start of the run, a chunk at
+    # a time so lazily loaded runs are never read whole
+    times = []
+    prefixes = []
+    total = np.zeros(4)
+    previous = None
+    for start in range(0, len(source), chunk_size):
+        t, power, stroke = sample_values(source, start, min(start + chunk_size, len(source)), C_damper, K)
+        values = np.vstack((power, power ** 2, stroke, stroke ** 2))
+        # Each chunk starts from the last sample of the one before, so the interval between them is counted
+        joined_t = t if previous is None else np.concatenate(([previous[0]], t))
+        joined = values if previous is None else np.hstack((previous[1][:, None], values))
+        prefix = total[:, None] + np.cumsum((joined[:, 1:] + joined[:, :-1]) / 2 * np.diff(joined_t), axis=1)
+        if previous is None:
+            prefix = np.hstack((np.zeros((4, 1)), prefix))
+        total = prefix[:, -1]
+        previous = (t[-1], values[:, -1])
+        times.append(t)
+        prefixes.append(prefix)
+    return np.concatenate(times), np.hstack(prefixes)
+
+
+class RollingStats:
+    # Statistics of the window seconds of the run up to the time given to update. Attributes after an update:
+    # power, power_mean, power_rms, power_min, power_max; stroke, stroke_mean, stroke_rms, stroke_max (largest
+    # magnitude); clearance and clearance_min, the distance from the piston to the nearer tube end
+    def __init__(self, source, window=30, chunk_size=1 << 20):
+        self.source = source
+        self.window = float(window)
+        self.C_damper = float(source.simulation_data['C_damper'])
+        self.K = float(source.simulation_data['K'])
+        self.half_tube = float(source.parameters['tube_length']) / 2
+        self.t, self.prefix = prefix_integrals(source, self.C_damper, self.K, chunk_size)
+        self.extrema = decimation.build_pyramid(source, chunk_size=chunk_size, read=self.extreme_series)
+
+        self.time = None
+        self.head = 0  # one past the last sample at or before the current time
+        self.tail = 0  # last sample at or before the start of the window
+
+        self.power = self.power_mean = self.power_rms = self.power_min = self.power_max = np.nan
+        self.stroke = self.stroke_mean = self.stroke_rms = self.stroke_max = np.nan
+        self.clearance = self.clearance_min = np.nan
+
+    def extreme_series(self, source, start, stop):
+        # Power and stroke size of samples [start, stop), the series the window minima and maxima are taken from
+        t, power, stroke = sample_values(source, start, stop, self.C_damper, self.K)
+        return t, np.vstack((power, np.abs(stroke)))
+
+    def last_at(self, sim_time, index):
+        # Index of the last sample at or before sim_time, stepping forward from index
+        t = self.t
+        while index + 1 < len(t) and t[index + 1] <= sim_time:
+            index += 1
+        return index
+
+    def integral(self, sim_time, index):
+        # Prefix integrals at sim_time, between samples index and index + 1
+        if index + 1 >= len(self.t):
+            return self.prefix[:, -1]
+        t0 = self.t[index]
+        fraction = min(max((sim_time - t0) / (self.t[index + 1] - t0), 0), 1) if self.t[index + 1] > t0 else 0
+        return self.prefix[:, index] + (self.prefix[:, index + 1] - self.prefix[:, index]) * fraction
+
+    def reset(self, sim_time):
+        # Window found by bisection, e.g. after a seek
+        self.head = max(int(np.searchsorted(self.t, sim_time, side='right')), 1)
+        self.tail = max(int(np.searchsorted(self.t, sim_time - self.window, side='right')) - 1, 0)
+
+    def update(self, sim_time):
+        sim_time = min(max(sim_time, self.t[0]), self.t[-1])
+        if self.time is None or sim_time < self.time or sim_time - self.time > self.window:
+            self.reset(sim_time)
+        else:
+            self.head = self.last_at(sim_time, self.head - 1) + 1
+        self.time = sim_time
+
+        start = max(sim_time - self.window, self.t[0])
+        self.tail = self.last_at(start, self.tail)
+
+        # Instantaneous values, interpolated between the samples either side
+        index = self.head - 1
+        t, power, stroke = sample_values(self.source, index, min(index + 2, len(self.t)), self.C_damper, self.K)
+        fraction = min(max((sim_time - t[0]) / (t[1] - t[0]), 0), 1) if len(t) > 1 and t[1] > t[0] else 0
+        self.power = power[0] + (power[-1] - power[0]) * fraction
+        self.stroke = stroke[0] + (stroke[-1] - stroke[0]) * fraction
+
+        span = sim_time - start
+        if span > 0:
+            power_mean, power_squared, stroke_mean, stroke_squared = (self.integral(sim_time, index) - self.integral(start, self.tail)) / span
+        else:
+            power_mean, power_squared, stroke_mean, stroke_squared = self.power, self.power ** 2, self.stroke, self.stroke ** 2
+        self.power_mean = power_mean
+        self.power_rms = np.sqrt(max(power_squared, 0))
+        self.stroke_mean = stroke_mean
+        self.stroke_rms = np.sqrt(max(stroke_squared, 0))
+        # Extremes of the samples in the window, or at least the last one played, and of the instantaneous values,
+        # which may lie between samples
+        first = min(self.tail + int(self.t[self.tail] < start), index)
+        (power_low, _), (power_high, stroke_high) = self.extrema.sample_extremes(first, self.head)
+        self.power_min = min(power_low, self.power)
+        self.power_max = max(power_high, self.power)
+        self.stroke_max = max(stroke_high, abs(self.stroke))
+        self.clearance = self.half_tube - abs(self.stroke)
+        self.clearance_min = self.half_tube - self.stroke_max
+
+
+if __name__ == '__main__':
+    # Plays through a file checking the rolling stats against a direct calculation, and times updates while playing
+    # and after seeks for a short and a long window
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'demo_file.mat'
+    source = data_source.open_source(filename)
+
+    start = time.perf_counter()
+    stats = RollingStats(source, 30)
+    print('{:d} samples, prefix integrals in {:.3f} s'.format(len(source), time.perf_counter() - start))
+
+    t, power, stroke = sample_values(source, 0, len(source), stats.C_damper, stats.K)
+    largest = 0
+    for now in np.linspace(source.start_time, source.end_time, 200)[1:]:
+        stats.update(now)
+        inside = (t > now - stats.window) & (t <= now)
+        largest = max(largest, abs(stats.power_max - max(power[inside].max(), stats.power)) / power.max(),
+                      abs(stats.stroke_max - max(np.abs(stroke[inside]).max(), abs(stats.stroke))) / np.abs(stroke).max())
+    print('Largest relative difference of the window maxima from a direct calculation: {:.2g}'.format(largest))
+
+    for window in [30, (source.end_time - source.start_time) / 2]:
+        stats = RollingStats(source, window)
+        frames = np.linspace(source.start_time, source.end_time, 2000)
+        start = time.perf_counter()
+        for now in frames.tolist():
+            stats.update(now)
+        playing = (time.perf_counter() - start) / len(frames)
+        start = time.perf_counter()
+        for now in frames[::-1][::10].tolist():
+            stats.update(now)
+        seeking = (time.perf_counter() - start) / len(frames[::10])
+        print('{:g} s window: {:.3f} ms per frame playing, {:.3f} ms per seek'.format(window, playing * 1000, seeking * 1000))
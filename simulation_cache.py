@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+import buoy_simulation
+import data_source
+import processing
+
+
+# Content-addressed cache of simulation results. A run is keyed by the SHA-256 of its canonicalised parameters, wave
+# and solver settings, so the same run asked for by a notebook, a sweep or another worker process is only integrated
+# once. Each result (the trajectory and its process_data summary) is a file in the trajectory layout of data_source,
+# stored as <directory>/<key[:2]>/<key>.traj. Files are written under a unique temporary name and renamed into place,
+# so readers only ever see complete files and processes writing the same run at once can't corrupt it (the last
+# rename wins, with identical contents). The most recently used results are also kept in memory, up to max_bytes.
+
+# Part of every key, so results are recomputed if the solver or the stored layout changes
+CACHE_VERSION = 1
+DEFAULT_DIRECTORY = os.environ.get('IPS_SIMULATION_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ips_buoy_simulation'))
+
+
+def canonical(value):
+    # JSON-serialisable form of parameters in which equal values compare equal however they were given: numbers of
+    # any type as the repr of a float (so K=0 and K=0.0 are the same run), dictionaries with sorted keys, arrays as a
+    # digest of their float64 contents and objects, e.g. waves.py forcings, as their class name and attributes
+    if isinstance(value, dict):
+        return {str(name): canonical(value[name]) for name in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        array = np.ascontiguousarray(value, dtype=np.float64)
+        return {'shape': list(array.shape), 'sha256': hashlib.sha256(array.tobytes()).hexdigest()}
+    if isinstance(value, np.ndarray):
+        return canonical(value.tolist())
+    if isinstance(value, (bool, np.bool_)) or value is None:
+        return value if value is None else bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(float(value))
+    if isinstance(value, (str, np.str_)):
+        return str(value)
+    if hasattr(value, '__dict__'):
+        return {'class': type(value).__name__, 'fields': canonical(vars(value))}
+    raise TypeError('Cannot key a simulation on a {:s}'.format(type(value).__name__))
+
+
+def simulation_key(simulation, metadata, t_range=None, rtol=1e-3, atol=1e-6, events=False):
+    # Hex digest identifying a run of buoy_simulation.run_simulation
+    parameters = {name: value for name, value in simulation.items() if name != 'data'}
+    t_range = metadata['t_range'] if t_range is None else t_range
+    description = {'version': CACHE_VERSION, 'solver': 'ode45', 'rtol': rtol, 'atol': atol, 't_range': t_range,
+                   'parameters': parameters, 'metadata': metadata}
+    # Only added when set, so runs cached before events existed keep their keys
+    if events:
+        description['events'] = True
+    encoded = json.dumps(canonical(description), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def frozen(array):
+    # Read-only copy, so a caller changing a result in place can't change what later hits are given
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
+
+
+class SimulationCache:
+    # hits and misses count the lookups answered from memory or disk, and the runs that had to be integrated. Results
+    # are held and returned as read-only arrays
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.traj')
+
+    def remember(self, key, entry):
+        # Adds an entry to the in-memory LRU, evicting the least recently used until the total fits. Entries larger than
+        # the whole budget are only kept on disk
+        size = entry[0].nbytes + entry[1].nbytes
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if size > self.max_bytes:
+            return
+        self.memory[key] = entry
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_bytes:
+            _, (t, motion, _) = self.memory.popitem(last=False)
+            self.memory_bytes -= t.nbytes + motion.nbytes
+
+    def get(self, key):
+        # (time, motion, summary) of a stored run, or None
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            return entry
+        try:
+            header, arrays = data_source.read_arrays(self.path(key))
+        except (OSError, ValueError, KeyError):
+            return None
+        if header.get('kind') != 'simulation' or header.get('key') != key:
+            return None
+        # Copied out of the file, so it isn't held open (which would stop it being replaced on Windows)
+        entry = (frozen(arrays['time']), frozen(arrays['motion']), header['summary'])
+        self.remember(key, entry)
+        return entry
+
+    def put(self, key, t, motion, summary):
+        # Stores a result, returning the entry that is kept for it
+        filename = self.path(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Unique per writer: write_arrays builds the file at part + '.part' and renames it to part when it's complete
+        part = '{:s}.{:d}.{:s}'.format(filename, os.getpid(), uuid.uuid4().hex)
+        try:
+            data_source.write_arrays(part, {'kind': 'simulation', 'key': key, 'summary': summary}, {'time': t, 'motion': motion})
+            os.replace(part, filename)
+        except OSError:
+            # A read-only or full cache directory still leaves the result in memory
+            for name in [part, part + '.part']:
+                if os.path.isfile(name):
+                    os.remove(name)
+        entry = (frozen(t), frozen(motion), summary)
+        self.remember(key, entry)
+        return entry
+
+    def run(self, simulation, metadata, t_range=None, rtol=1e-3, atol=1e-6, events=False):
+        # Same as buoy_simulation.run_simulation, plus the processing.summary of the run. Returns (simulation, summary).
+        # With events the summary also has the buoy_simulation.event_counts of the run (the event log isn't stored)
+        key = simulation_key(simulation, metadata, t_range, rtol, atol, events)
+        entry = self.get(key)
+        if entry is None:
+            self.misses += 1
+            solved = buoy_simulation.run_simulation(simulation, metadata, t_range, rtol=rtol, atol=atol, events=events)
+            summary = processing.summary(processing.process_data(solved, metadata))
+            if events:
+                summary.update(buoy_simulation.event_counts(solved['data']['events']))
+            entry = self.put(key, solved['data']['time'], solved['data']['motion'], summary)
+        else:
+            self.hits += 1
+        t, motion, summary = entry
+        return dict(simulation, data={'motion': motion, 'time': t}), dict(summary)
+
+    def clear_memory(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+
+
+def cached_simulation(simulation, metadata, t_range=None, rtol=1e-3, atol=1e-6, cache=None, events=False):
+    # run_simulation through a cache, by default one in DEFAULT_DIRECTORY shared by every call in the process
+    global default_cache
+    if cache is None:
+        if default_cache is None:
+            default_cache = SimulationCache()
+        cache = default_cache
+    return cache.run(simulation, metadata, t_range, rtol, atol, events)
+
+
+default_cache = None
+
+
+if __name__ == '__main__':
+    # Times a run of the default buoy when integrated, when read back from disk and when found in memory
+    directory = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DIRECTORY
+    parameters = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(parameters['T'], parameters['Hs'])
+    key = simulation_key(parameters, metadata)
+    cache = SimulationCache(directory)
+    if os.path.isfile(cache.path(key)):
+        os.remove(cache.path(key))
+
+    for label in ['integrated', 'from disk', 'from memory']:
+        if label == 'from disk':
+            cache.clear_memory()
+        start = time.perf_counter()
+        simulation, summary = cache.run(parameters, metadata)
+        print('{:s}: {:.2f} ms, mean power {:.4g} W'.format(label, (time.perf_counter() - start) * 1000, summary['power_total_mean']))
+    print('key {:s}, {:d} hits, {:d} misses'.format(key, cache.hits, cache.misses))
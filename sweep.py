@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import buoy_simulation
+import processing
+import simulation_cache
+
+
+# Parameter sweeps over a grid of simulations, e.g. T x Hs x C_damper x K x shape_buoy. Grid points are shared out to a
+# process pool and the summary stats of each finished point are appended to an on-disk store as they arrive, so a
+# killed sweep picks up where it stopped and the results can be read without any of the time series.
+
+
+def expand_values(values):
+    # Grid values are given as a list, or as {"linspace": [start, stop, n]} / {"logspace": [start, stop, n]}
+    if isinstance(values, dict):
+        (kind, arguments), = values.items()
+        if kind not in ['linspace', 'logspace']:
+            raise ValueError('grid values must be a list, or a linspace or logspace')
+        return getattr(np, kind)(arguments[0], arguments[1], int(arguments[2])).tolist()
+    return list(values)
+
+
+def grid_shape(grid):
+    return tuple(len(values) for values in grid.values())
+
+
+def grid_point(grid, index):
+    position = np.unravel_index(index, grid_shape(grid))
+    return {name: values[i] for (name, values), i in zip(grid.items(), position)}
+
+
+def is_numeric(values):
+    return all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+
+
+def record_dtype(grid, events=False):
+    # Flat grid index, the swept parameters (non-numeric ones by their position in the value list) and every stat,
+    # plus the buoy_simulation.EVENT_COUNTS of sweeps run with events (floats, so failed points can be NaN)
+    fields = [('index', 'i8')]
+    for name, values in grid.items():
+        fields.append((name, 'f8') if is_numeric(values) else (name + '_index', 'i8'))
+    fields += [(name, 'f8') for name in processing.summary_fields()]
+    if events:
+        fields += [(name, 'f8') for name in buoy_simulation.EVENT_COUNTS]
+    return np.dtype(fields)
+
+
+class SweepStore:
+    # Append-only store of finished grid points. spec.json describes the grid and record layout, results.bin holds one
+    # fixed-size record per finished point in the order they finished, so it can be memory mapped for reading
+    def __init__(self, directory, grid=None, fixed=None, periods=None, events=False):
+        self.directory = directory
+        self.spec_file = os.path.join(directory, 'spec.json')
+        self.results_file = os.path.join(directory, 'results.bin')
+
+        if os.path.isfile(self.spec_file):
+            with open(self.spec_file) as file:
+                self.spec = json.load(file)
+            # Stores from before events were added have no 'events' entry
+            if grid is not None and (self.spec['grid'], self.spec['fixed'], self.spec['periods'], self.spec.get('events', False)) != (grid, fixed or {}, periods, events):
+                raise ValueError('{:s} holds a different sweep, use a new directory'.format(directory))
+        elif grid is None:
+            raise FileNotFoundError('No sweep in {:s}'.format(directory))
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.spec = {'grid': grid, 'fixed': fixed or {}, 'periods': periods, 'events': events}
+            with open(self.spec_file, 'w') as file:
+                json.dump(self.spec, file, indent=2)
+
+        self.grid = self.spec['grid']
+        self.dtype = record_dtype(self.grid, self.spec.get('events', False))
+        self.drop_partial_record()
+
+    def drop_partial_record(self):
+        # A sweep killed mid-write can leave part of a record at the end of the file
+        if os.path.isfile(self.results_file):
+            size = os.path.getsize(self.results_file)
+            if size % self.dtype.itemsize:
+                with open(self.results_file, 'r+b') as file:
+                    file.truncate(size - size % self.dtype.itemsize)
+
+    def completed(self):
+        if not os.path.isfile(self.results_file) or os.path.getsize(self.results_file) == 0:
+            return set()
+        return set(self.load()['index'].tolist())
+
+    def append(self, records):
+        with open(self.results_file, 'ab') as file:
+            file.write(records.astype(self.dtype).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def load(self):
+        if not os.path.isfile(self.results_file) or os.path.getsize(self.results_file) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.results_file, dtype=self.dtype, mode='r')
+
+    def to_grid(self, field):
+        # Values of one field laid out on the sweep grid, NaN where a point hasn't finished
+        results = self.load()
+        out = np.full(grid_shape(self.grid), np.nan)
+        out.flat[results['index']] = results[field]
+        return out
+
+
+def worker_cache(directory):
+    # One SimulationCache per directory for the life of a worker process, so its in-memory results carry over from one
+    # chunk of points to the next
+    if directory not in worker_caches:
+        worker_caches[directory] = simulation_cache.SimulationCache(directory)
+    return worker_caches[directory]
+
+
+worker_caches = {}
+
+
+def run_points(grid, fixed, periods, indices, cache_directory=None, events=False):
+    # Runs in a worker: simulates and summarises a list of grid points, returning their records. With a cache
+    # directory, points already simulated by any sweep (or other use of the cache) are read back instead. With events,
+    # the integrator restarts at the buoyancy discontinuities and the event counts are stored with the stats
+    dtype = record_dtype(grid, events)
+    records = np.zeros(len(indices), dtype=dtype)
+    cache = None if cache_directory is None else worker_cache(cache_directory)
+
+    for record, index in zip(records, indices):
+        point = grid_point(grid, index)
+        record['index'] = index
+        for name, values in grid.items():
+            if is_numeric(values):
+                record[name] = point[name]
+            else:
+                record[name + '_index'] = values.index(point[name])
+
+        parameters = buoy_simulation.base_variables(**dict(fixed, **point))
+        metadata = buoy_simulation.wave_metadata(parameters['T'], parameters['Hs'], (0, parameters['T'] * periods))
+        try:
+            if cache is None:
+                simulation = buoy_simulation.run_simulation(parameters, metadata, events=events)
+                summary = processing.summary(processing.process_data(simulation, metadata))
+                if events:
+                    summary.update(buoy_simulation.event_counts(simulation['data']['events']))
+            else:
+                _, summary = cache.run(parameters, metadata, events=events)
+        except (ArithmeticError, ValueError, RuntimeError) as error:
+            # Numerical failures (overflow, NaN states, ode45's step size underflow) are stored as NaN so they aren't
+            # retried on every resume, and so one point can't take the rest of its chunk down with it. Anything else
+            # is a bug and stops the sweep
+            print('Point {:d} ({}) failed: {!r}'.format(int(index), point, error))
+            for name in processing.summary_fields() + (buoy_simulation.EVENT_COUNTS if events else []):
+                record[name] = np.nan
+            continue
+
+        for name, value in summary.items():
+            record[name] = value
+
+    return records
+
+
+def run_sweep(directory, grid, fixed=None, periods=20, workers=None, chunk_size=8, cache_directory=None, events=False):
+    # Simulates every grid point not already in the store. grid maps base_variables arguments to lists of values.
+    # cache_directory shares simulation results with other sweeps through a simulation_cache.SimulationCache, and
+    # events runs with buoy_simulation's event detection and adds the event counts to the records
+    grid = {name: expand_values(values) for name, values in grid.items()}
+    fixed = fixed or {}
+    store = SweepStore(directory, grid, fixed, periods, events)
+
+    total = int(np.prod(grid_shape(grid)))
+    done = store.completed()
+    remaining = [index for index in range(total) if index not in done]
+    print('{:d} of {:d} points already done, running {:d}'.format(len(done), total, len(remaining)))
+
+    start = time.perf_counter()
+    finished = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_points, grid, fixed, periods, remaining[i:i + chunk_size], cache_directory, events)
+                   for i in range(0, len(remaining), chunk_size)]
+        for future in as_completed(futures):
+            records = future.result()
+            store.append(records)
+            finished += len(records)
+            elapsed = time.perf_counter() - start
+            print('{:d}/{:d} points, {:.1f} points/s'.format(finished, len(remaining), finished / elapsed))
+
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a resumable parameter sweep of the buoy simulation')
+    parser.add_argument('spec', help='JSON file with "grid" (parameter: values) and optionally "fixed", "periods" and "events"')
+    parser.add_argument('directory', help='directory of the result store, rerun with the same one to resume')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, default=8, help='grid points per task sent to a worker (default: 8)')
+    parser.add_argument('--cache', nargs='?', const=simulation_cache.DEFAULT_DIRECTORY, default=None, metavar='DIRECTORY',
+                        help='reuse simulation results cached by earlier runs, and cache new ones (default directory: '
+                             '$IPS_SIMULATION_CACHE or ~/.cache/ips_buoy_simulation)')
+    arguments = parser.parse_args()
+
+    with open(arguments.spec) as file:
+        spec = json.load(file)
+
+    run_sweep(arguments.directory, spec['grid'], spec.get('fixed'), spec.get('periods', 20), arguments.workers, arguments.chunk_size,
+              arguments.cache, spec.get('events', False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import numpy as np
+
+import batch_simulation
+import buoy_simulation
+
+
+def test_matches_ode45():
+    # Fixed-step RK4 at dt 0.02 against tight ode45 runs, measured 4e-4 m at most
+    base = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(base['T'], base['Hs'])
+    batch = batch_simulation.batch_variables(C_damper=np.array([1e5, 3e6, 1e7]), K=np.array([0, 1e6, 2e6]))
+    t, motion = batch_simulation.run_batch(batch, metadata)
+    for i in range(batch_simulation.member_count(batch)):
+        single = dict(base, C_damper=batch['C_damper'][i], K=batch['K'][i])
+        single = buoy_simulation.run_simulation(single, metadata, rtol=1e-8, atol=1e-10)['data']
+        assert np.max(np.abs(np.interp(t, single['time'], single['motion'][:, 0]) - motion[i, :, 0])) < 1e-3
+
+
+def test_chunks_give_the_same_result():
+    base = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(base['T'], base['Hs'])
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, 5)[:, None], K=np.linspace(0, 2e6, 2)[None, :])
+    _, whole = batch_simulation.run_batch(batch, metadata)
+    _, chunked = batch_simulation.run_batch(batch, metadata, chunk_size=3)
+    assert np.array_equal(whole, chunked)
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+import buoy_simulation
+import waves
+
+DEMO_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_file.mat')
+
+
+def demo_run():
+    # The parameters, metadata (with the MATLAB script's x_p = x) and stored results of demo_file.mat
+    data = loadmat(DEMO_FILE, chars_as_strings=1)
+    stored = data['simulation'][0, 0]
+    parameters = data['simulation_data'][0, 0]
+    simulation = {name: parameters[name].item() if parameters[name].dtype.kind != 'U' else str(parameters[name][0])
+                  for name in parameters.dtype.names}
+    metadata = buoy_simulation.wave_metadata(simulation['T'], simulation['Hs'])
+    metadata['x_p'] = metadata['x']
+    return simulation, metadata, stored
+
+
+def buoy_error(data, reference):
+    return np.max(np.abs(np.interp(reference['time'], data['time'], data['motion'][:, 0]) - reference['motion'][:, 0]))
+
+
+def test_matches_demo_file():
+    # Measured: buoy 0.0525 m, piston 0.0505 m over the whole run
+    buoy, piston = buoy_simulation.check_against(DEMO_FILE)
+    assert buoy < 0.06
+    assert piston < 0.06
+
+
+def test_output_times_follow_matlab_steps():
+    # The step sequence is MATLAB's until output index 172 (about step 43), where the two part
+    simulation, metadata, stored = demo_run()
+    animation = buoy_simulation.get_animation_data(buoy_simulation.run_simulation(simulation, metadata), metadata)
+    assert np.max(np.abs(animation['time'][:172] - stored['time'][0][:172])) < 1e-9
+
+
+def test_events_keep_demo_file_agreement():
+    # The demo run goes fully under 19 times. Events move it towards the converged solution, which the MATLAB run is
+    # itself 0.05 m from, so the agreement with MATLAB stays within the same bound rather than improving
+    simulation, metadata, stored = demo_run()
+    solved = buoy_simulation.run_simulation(simulation, metadata, events=True)
+    assert buoy_simulation.event_counts(solved['data']['events'])['submerged'] == 19
+    animation = buoy_simulation.get_animation_data(solved, metadata)
+    time = stored['time'][0]
+    assert np.max(np.abs(np.interp(time, animation['time'], animation['buoy_motion']) - stored['buoy_motion'][0])) < 0.06
+    assert np.max(np.abs(np.interp(time, animation['time'], animation['piston_motion']) - stored['piston_motion'][0])) < 0.06
+
+
+@pytest.mark.parametrize('shape, Hs, largest', [('sphere', 6.0, 0.013), ('cylinder', 5.0, 0.015)])
+def test_events_move_results_towards_converged_solution(shape, Hs, largest):
+    # Against an rtol 1e-10 run: sphere 0.015 m without events and 0.012 m with, cylinder 0.10 m and 0.012 m
+    simulation = buoy_simulation.base_variables(shape_buoy=shape, Hs=Hs)
+    metadata = waves.forcing_metadata(waves.RegularWave(Hs, simulation['T']), (0, 40 * simulation['T']))
+    reference = buoy_simulation.run_simulation(simulation, metadata, rtol=1e-10, atol=1e-12, events=True)['data']
+    plain = buoy_simulation.run_simulation(simulation, metadata)['data']
+    with_events = buoy_simulation.run_simulation(simulation, metadata, events=True)['data']
+    assert buoy_error(with_events, reference) < buoy_error(plain, reference)
+    assert buoy_error(with_events, reference) < largest
+
+
+@pytest.mark.parametrize('rtol', [1e-3, 1e-6])
+def test_events_alternate(rtol):
+    # Leaving and re-entering the water, and going under and coming back up, take turns, and the same count is found at
+    # any tolerance
+    simulation = buoy_simulation.base_variables(shape_buoy='cylinder', Hs=5.0)
+    metadata = waves.forcing_metadata(waves.RegularWave(5.0, simulation['T']), (0, 40 * simulation['T']))
+    events = buoy_simulation.run_simulation(simulation, metadata, rtol=rtol, atol=rtol * 1e-3, events=True)['data']['events']
+    assert buoy_simulation.event_counts(events) == {'water_exit': 1, 'water_entry': 1, 'submerged': 40, 'tube_end': 0}
+    assert np.all(np.diff(events['time']) >= 0)
+    for kind in [0, 1]:
+        rising = events['rising'][events['kind'] == kind]
+        assert np.all(rising[1:] != rising[:-1])
+
+
+def test_events_off_leaves_output_unchanged():
+    # Without events ode45 returns (t, y) and steps exactly as before they were added
+    fun = lambda t, y: [y[1], -y[0]]
+    t, y = buoy_simulation.ode45(fun, (0, 10), [1, 0])
+    t_events, y_events, te, ye, ie = buoy_simulation.ode45(fun, (0, 10), [1, 0], events=(lambda t, y: [1.0], [True]))
+    assert np.array_equal(t, t_events)
+    assert np.array_equal(y, y_events)
+    assert len(te) == 0
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import comparison
+import data_source
+import make_animation
+
+
+@pytest.fixture(autouse=True)
+def modules():
+    # make_animation imports pygame and numpy when it starts rather than at the top
+    make_animation.import_modules()
+
+
+def sine_source(end_time, period):
+    t = np.linspace(0, end_time, int(end_time * 20) + 1)
+    buoy = np.sin(2 * np.pi * t / period)
+    series = {'time': t, 'buoy_motion': buoy, 'piston_motion': buoy / 2, 'wave_motion': np.zeros_like(t)}
+    return data_source.DataSource(series, {}, {}, 1, 1)
+
+
+def test_batch_playback_matches_playback():
+    # Each device is where the animator's playback of its run alone puts it, and holds its last sample once it ends
+    sources = [sine_source(100, 7.3), sine_source(60, 11.1)]
+    batch = comparison.BatchPlayback(sources, window_span=10)
+    for sim_time in [0.0, 3.21, 45.5, 59.99, 80.0]:
+        positions = batch.positions(sim_time)
+        for k, source in enumerate(sources):
+            expected = make_animation.Playback(source).positions(min(sim_time, source.end_time))
+            assert np.allclose(positions[:, k], expected)
+
+
+def test_batch_playback_shares_the_animator_clock():
+    # Loops over the longest run like the animator does, rather than snapping back to the start
+    batch = comparison.BatchPlayback([sine_source(100, 7.3), sine_source(60, 11.1)], window_span=10)
+    assert batch.end_time == 100
+    assert batch.time_at(10.0, 2, 0.0, 95.0) == pytest.approx(15.0)
+    batch.seek(150)
+    assert batch.sim_time == 100
+
+
+def test_speed_steps():
+    speeds = [1.0]
+    for _ in range(3):
+        speeds.append(make_animation.faster(speeds[-1]))
+    assert speeds == [1, 2, 3, 4]
+    for _ in range(8):
+        speeds.append(make_animation.slower(speeds[-1]))
+    assert speeds[4:] == [3, 2, 1, 0.5, 0.25, 0.125, 0.125, 0.125]
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+import data_source
+import decimation
+
+
+def write_run(filename, samples=100000):
+    t = np.linspace(0, 1000, samples)
+    rng = np.random.default_rng(0)
+    series = {'time': t, 'buoy_motion': rng.normal(size=samples), 'piston_motion': rng.normal(size=samples),
+              'wave_motion': np.sin(t)}
+    data_source.write_trajectory(filename, data_source.DataSource(series, {'tube_length': 14}, {}, 5, 1))
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_converted_pyramid_is_read_from_the_file(tmp_path, dtype):
+    # The levels written by convert are the ones the file's own samples give, so extremes are exact at either precision
+    original = str(tmp_path / 'run.traj')
+    converted = str(tmp_path / 'converted.traj')
+    write_run(original)
+    data_source.convert(original, converted, dtype, pyramid=True)
+
+    source = data_source.open_source(converted)
+    pyramid = decimation.open_pyramid(converted, source)
+    assert not os.path.exists(decimation.cache_name(converted))
+    assert isinstance(pyramid.levels[0][1], np.memmap)
+    t, values = decimation.read_series(source, 0, len(source))
+    for t0, t1 in [(0, 1000), (3.3, 871.2), (500, 500.5)]:
+        inside = (t >= t0) & (t <= t1)
+        low, high = pyramid.extremes(t0, t1)
+        assert np.array_equal(low, values[:, inside].min(axis=1))
+        assert np.array_equal(high, values[:, inside].max(axis=1))
+
+
+def test_unconverted_pyramid_is_cached(tmp_path):
+    filename = str(tmp_path / 'run.traj')
+    write_run(filename)
+    built = decimation.open_pyramid(filename)
+    assert os.path.isfile(decimation.cache_name(filename))
+    cached = decimation.open_pyramid(filename)
+    for (t, low, high), (cached_t, cached_low, cached_high) in zip(built.levels, cached.levels):
+        assert np.array_equal(t, cached_t) and np.array_equal(low, cached_low) and np.array_equal(high, cached_high)
@@ -0,0 +1,28 @@
+import numpy as np
+
+import ensemble
+
+
+def test_running_stats_match_numpy():
+    values = np.random.default_rng(0).normal(size=(20, 3))
+    stats = ensemble.RunningStats(3)
+    for row in values:
+        stats.add(row)
+    np.testing.assert_allclose(stats.mean, values.mean(axis=0))
+    np.testing.assert_allclose(stats.variance, values.var(axis=0, ddof=1))
+
+
+def test_failed_realisations_are_counted_not_averaged():
+    stats = ensemble.RunningStats(2)
+    stats.add(np.array([1.0, 2.0]))
+    stats.add(np.full(2, np.nan))
+    stats.add(np.array([3.0, 4.0]))
+    assert (stats.count, stats.failures) == (2, 1)
+    np.testing.assert_allclose(stats.mean, [2, 3])
+    assert np.all(np.isfinite(stats.half_width()))
+
+
+def test_realisation_seeds_are_independent_and_repeat():
+    first = ensemble.realisation_seed(0, (1, 2), 3).generate_state(2)
+    assert np.array_equal(first, ensemble.realisation_seed(0, (1, 2), 3).generate_state(2))
+    assert not np.array_equal(first, ensemble.realisation_seed(0, (1, 2), 4).generate_state(2))
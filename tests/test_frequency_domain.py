@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import batch_simulation
+import buoy_simulation
+import frequency_domain
+import processing
+import waves
+
+
+@pytest.mark.parametrize('C_damper, K', [(3e5, 0), (3e6, 1e6)])
+def test_linear_cylinder_matches_ode45(C_damper, K):
+    # A cylinder's buoyancy is exactly linear while it is partly submerged, so in a small wave the steady ode45 run
+    # is the frequency-domain response. Measured: power within 1e-4, stroke within 1e-5 (relative)
+    base = buoy_simulation.base_variables(shape_buoy='cylinder', Hs=0.5, C_damper=C_damper, K=K)
+    forcing = waves.RegularWave(base['Hs'], base['T'])
+    periods = 30
+    metadata = waves.forcing_metadata(forcing, (0, periods * base['T']))
+
+    linear = frequency_domain.solve(batch_simulation.batch_variables(T=base['T'], Hs=base['Hs'], shape_buoy='cylinder',
+                                                                     C_damper=C_damper, K=K), forcing)
+    data = buoy_simulation.run_simulation(base, metadata, rtol=1e-8, atol=1e-10)['data']
+    steady = data['time'] >= (periods - 10) * base['T']
+    t = data['time'][steady]
+    series = processing.stack_series(data['motion'][steady], C_damper, K)
+    power = np.trapz(series[-3], t) / (t[-1] - t[0])
+
+    assert bool(linear['linear'])
+    assert float(linear['power_mean']) == pytest.approx(power, rel=1e-3)
+    assert float(linear['stroke_amplitude']) == pytest.approx(np.abs(series[2]).max(), rel=1e-4)
+
+
+def test_flags_steep_waves():
+    # The default sphere in a 6 m wave leaves the water
+    result = frequency_domain.solve(batch_simulation.batch_variables(Hs=6.0))
+    assert not bool(result['linear'])
+
+
+def test_results_have_the_grid_shape():
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, 3)[:, None], K=np.linspace(0, 2e6, 4)[None, :])
+    result = frequency_domain.solve(batch)
+    assert all(value.shape == (3, 4) for value in result.values())
@@ -0,0 +1,111 @@
+import time
+
+import numpy as np
+import pytest
+
+import data_source
+import decimation
+import make_animation
+
+
+@pytest.fixture(autouse=True)
+def modules():
+    # make_animation imports pygame and numpy when it starts rather than at the top
+    make_animation.import_modules()
+
+
+def long_source(samples=200000):
+    t = np.linspace(0, 2000, samples)
+    buoy = np.sin(2 * np.pi * t / 7.8)
+    piston = buoy + 6 * np.sin(2 * np.pi * t / 600) * np.sin(2 * np.pi * t / 9.1)
+    series = {'time': t, 'buoy_motion': buoy, 'piston_motion': piston, 'wave_motion': np.zeros_like(t)}
+    return data_source.DataSource(series, {'tube_length': 14}, {}, 5, 1)
+
+
+def test_timeline_reach_matches_samples():
+    # Each column holds the largest stroke of the samples under it, and may take in up to one pyramid block (less than
+    # a column) either side
+    source = long_source()
+    t, _, piston, _ = source.window(0, len(source))
+    stroke = np.abs(piston - source.series['buoy_motion']) / 7
+    columns = 380
+    reach = make_animation.timeline_reach(decimation.build_pyramid(source), 0, 2000, columns, 7)
+
+    edges = np.linspace(0, 2000, columns + 1)
+    width = edges[1] - edges[0]
+    for column in range(columns):
+        inner = stroke[(t >= edges[column]) & (t <= edges[column + 1])].max()
+        outer = stroke[(t >= edges[column] - width) & (t <= edges[column + 1] + width)].max()
+        assert inner <= reach[column] <= outer
+
+
+def test_timeline_reach_of_a_short_run():
+    # Fewer samples than columns are spread over the columns rather than binned
+    source = long_source(100)
+    reach = make_animation.timeline_reach(decimation.build_pyramid(source), 0, 2000, 380, 7)
+    assert reach.shape == (380,)
+    assert np.all(np.isfinite(reach))
+
+
+@pytest.fixture
+def prefetcher():
+    frames = make_animation.FramePrefetcher(long_source(), fps=50)
+    yield frames
+    frames.close()
+
+
+def wait_for_frame(prefetcher, timeout=2):
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        frame = prefetcher.next_frame()
+        if frame is not None:
+            return frame
+        time.sleep(0.001)
+    raise AssertionError('no frame was made')
+
+
+def test_prefetched_frames_follow_the_clock(prefetcher):
+    # Frames are a period apart, at the simulation times Playback.time_at gives for their deadlines, with the positions
+    # Playback interpolates there
+    wall_start = time.perf_counter()
+    prefetcher.restart(100.0, 5)
+    playback = make_animation.Playback(prefetcher.playback.source)
+    frames = [wait_for_frame(prefetcher) for _ in range(5)]
+    deadlines = np.array([deadline for deadline, _, _ in frames])
+    steps = np.diff(deadlines) / prefetcher.period
+    assert np.allclose(steps, np.round(steps)) and np.all(np.round(steps) >= 1)
+    for deadline, sim_time, positions in frames:
+        _, wall, sim_start, speed = prefetcher.timeline
+        assert abs(wall - wall_start) < 0.5
+        assert sim_time == playback.time_at(deadline, speed, wall, sim_start)
+        assert np.array_equal(positions, playback.positions(sim_time))
+
+
+def test_restart_drops_frames_of_older_generations(prefetcher):
+    prefetcher.restart(100.0, 5)
+    wait_for_frame(prefetcher)
+    time.sleep(0.1)  # the queue fills up with frames near 100 s
+    prefetcher.restart(1500.0, 5)
+    _, sim_time, _ = wait_for_frame(prefetcher)
+    assert 1500 <= sim_time < 1510
+
+
+def test_overdue_frames_are_dropped(prefetcher):
+    # Frames more than a period late are dropped rather than shown, and next_frame never waits
+    prefetcher.restart(100.0, 5)
+    wait_for_frame(prefetcher)
+    time.sleep(0.2)
+    start = time.perf_counter()
+    deadline, _, _ = wait_for_frame(prefetcher)
+    assert prefetcher.dropped > 0
+    assert deadline >= start - prefetcher.period
+    prefetcher.halt()
+    start = time.perf_counter()
+    assert prefetcher.next_frame() is None
+    assert time.perf_counter() - start < prefetcher.period / 2
+
+
+def test_playback_loops_back_to_the_start():
+    playback = make_animation.Playback(long_source())
+    assert playback.time_at(10.0, 5, 0.0, 1990.0) == pytest.approx(40.0)
+    assert playback.time_at(1.0, 5, 0.0, 100.0) == 105.0
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import batch_simulation
+import buoy_simulation
+import processing
+
+
+# Expected values are what the MATLAB functions give by their documented definitions: rmoutliers drops values more
+# than three scaled MADs from the median, findchangepts returns the 1-based index where the mean changes (the Python
+# port is 0-based), findpeaks takes strict local maxima (the left edge of a flat top, never an end sample), and
+# mean([]) is NaN
+
+
+def test_rmoutliers():
+    # median 3, MAD 1, so the limit is 3 * 1.4826 from the median
+    assert np.array_equal(processing.rmoutliers(np.array([1.0, 2, 3, 4, 100])), [1, 2, 3, 4])
+    assert np.array_equal(processing.rmoutliers(np.array([1.0, 2, 3, 4, 7])), [1, 2, 3, 4, 7])
+
+
+def test_findchangepts():
+    assert processing.findchangepts(np.array([0.0, 0, 0, 0, 5, 5, 5, 5, 5, 5])) == 4
+    assert processing.findchangepts(np.ones(10)) is None
+
+
+def test_findpeaks():
+    assert np.array_equal(processing.findpeaks(np.array([0.0, 2, 1, 3, 3, 1, 4])), [2, 3])
+    assert np.array_equal(processing.findpeaks(np.array([3.0, 2, 1])), [])
+
+
+def test_add_stats_matches_matlab():
+    # The change point is at MATLAB index 3, within the first third, so the trimmed stats start there. Nothing is an
+    # outlier (median 1, MAD 1), the maxima are the 1s and every minimum is 0, which isn't a positive peak
+    data = np.array([5.0, 5, 0, 1, 0, 1, 0, 1, 0, 1])
+    stats = processing.add_stats(data)
+    assert stats['min'] == 0
+    assert stats['max'] == 5
+    assert stats['mean'] == pytest.approx(1.4)
+    assert stats['rms'] == pytest.approx(np.sqrt(5.4))
+    assert stats['trimmed_min'] == 0
+    assert stats['trimmed_max'] == 1
+    assert stats['trimmed_mean'] == pytest.approx(0.5)
+    assert stats['trimmed_rms'] == pytest.approx(np.sqrt(0.5))
+    assert stats['mean_peak'] == 1
+    assert np.isnan(stats['mean_min_peak'])
+
+
+def test_add_stats_ignores_late_transient():
+    # A change past the first third is ignored, so the trimmed stats cover the whole series
+    data = np.concatenate((np.zeros(6), np.ones(4)))
+    stats = processing.add_stats(data)
+    assert stats['trimmed_mean'] == pytest.approx(0.4)
+
+
+def test_batch_stats_matches_add_stats():
+    base = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(base['T'], base['Hs'])
+    batch = batch_simulation.batch_variables(C_damper=np.logspace(5, 7, 4), K=np.linspace(0, 2e6, 4))
+    _, motion = batch_simulation.run_batch(batch, metadata)
+    series = processing.stack_series(motion, batch['C_damper'], batch['K'])
+    stats = processing.batch_stats(series)
+    for run in range(series.shape[0]):
+        for row in range(series.shape[1]):
+            single = processing.add_stats(series[run, row])
+            for name in processing.STAT_NAMES:
+                np.testing.assert_allclose(stats[name][run, row], single[name], rtol=1e-9, atol=1e-9)
@@ -0,0 +1,30 @@
+import numpy as np
+
+import data_source
+import rolling_stats
+
+
+def make_source(samples=50000):
+    t = np.cumsum(np.random.default_rng(0).uniform(0.01, 0.03, samples))
+    buoy = np.sin(t / 1.3)
+    piston = buoy + 3 * np.sin(t / 7.1) * np.sin(t / 90)
+    series = {'time': t, 'buoy_motion': buoy, 'piston_motion': piston, 'wave_motion': np.zeros_like(t)}
+    return data_source.DataSource(series, {'tube_length': 14}, {'C_damper': 3e6, 'K': 1e5}, 5, 1)
+
+
+def test_seeks_match_brute_force():
+    # Jumps back and forth, some further than the window, then plays on from the last, and every window's extremes are
+    # those of its samples and the instantaneous values
+    source = make_source()
+    stats = rolling_stats.RollingStats(source, window=60, chunk_size=4096)
+    t, power, stroke = rolling_stats.sample_values(source, 0, len(source), stats.C_damper, stats.K)
+    rng = np.random.default_rng(1)
+    times = np.concatenate((rng.uniform(t[0], t[-1], 40), t[-1] - 500 + np.arange(200) * 0.37, [t[0], t[-1]]))
+    for now in times.tolist():
+        stats.update(now)
+        inside = (t >= now - stats.window) & (t <= now)
+        inside[max(np.searchsorted(t, now, side='right') - 1, 0)] = True
+        assert stats.power_min == min(power[inside].min(), stats.power)
+        assert stats.power_max == max(power[inside].max(), stats.power)
+        assert stats.stroke_max == max(np.abs(stroke[inside]).max(), abs(stats.stroke))
+        assert stats.clearance_min == 7 - stats.stroke_max
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+import buoy_simulation
+import simulation_cache
+
+
+@pytest.fixture
+def run():
+    parameters = buoy_simulation.base_variables()
+    metadata = buoy_simulation.wave_metadata(parameters['T'], parameters['Hs'], (0, 5 * parameters['T']))
+    return parameters, metadata
+
+
+def test_hits_and_misses(tmp_path, run):
+    cache = simulation_cache.SimulationCache(str(tmp_path))
+    first, first_summary = cache.run(*run)
+    second, second_summary = cache.run(*run)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.array_equal(first['data']['motion'], second['data']['motion'])
+    np.testing.assert_equal(first_summary, second_summary)
+
+
+def test_round_trip_through_disk(tmp_path, run):
+    cache = simulation_cache.SimulationCache(str(tmp_path))
+    solved, summary = cache.run(*run)
+    key = simulation_cache.simulation_key(*run)
+    assert os.path.isfile(cache.path(key))
+
+    # A fresh cache, e.g. another process, reads the file back
+    other = simulation_cache.SimulationCache(str(tmp_path))
+    read, read_summary = other.run(*run)
+    assert (other.hits, other.misses) == (1, 0)
+    assert np.array_equal(read['data']['time'], solved['data']['time'])
+    assert np.array_equal(read['data']['motion'], solved['data']['motion'])
+    np.testing.assert_equal(read_summary, summary)  # NaN stats compare equal
+    # Same as integrating without the cache
+    direct = buoy_simulation.run_simulation(*run)['data']
+    assert np.array_equal(read['data']['motion'], direct['motion'])
+
+
+def test_results_are_read_only(tmp_path, run):
+    cache = simulation_cache.SimulationCache(str(tmp_path))
+    for _ in range(2):
+        solved, _ = cache.run(*run)
+        with pytest.raises(ValueError):
+            solved['data']['motion'][0, 0] = 0
+
+
+def test_keys(run):
+    parameters, metadata = run
+    key = simulation_cache.simulation_key(parameters, metadata)
+    assert simulation_cache.simulation_key(dict(parameters, K=0.0), metadata) == simulation_cache.simulation_key(dict(parameters, K=0), metadata)
+    assert simulation_cache.simulation_key(dict(parameters, C_damper=parameters['C_damper'] * 2), metadata) != key
+    assert simulation_cache.simulation_key(parameters, metadata, rtol=1e-6) != key
+    assert simulation_cache.simulation_key(parameters, metadata, events=False) == key
+    assert simulation_cache.simulation_key(parameters, metadata, events=True) != key
+
+
+def test_memory_is_bounded(tmp_path, run):
+    parameters, metadata = run
+    cache = simulation_cache.SimulationCache(str(tmp_path), max_bytes=1)
+    cache.run(parameters, metadata)
+    assert cache.memory_bytes == 0
+    # Still answered from disk
+    cache.run(parameters, metadata)
+    assert (cache.hits, cache.misses) == (1, 1)
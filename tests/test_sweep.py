@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+import sweep
+
+GRID = {'C_damper': [1e6, 3e6], 'shape_buoy': ['sphere', 'cylinder']}
+FIXED = {'T': 7.8, 'Hs': 2.4}
+PERIODS = 3
+
+
+def test_expand_values():
+    assert sweep.expand_values({'linspace': [0, 1, 3]}) == [0, 0.5, 1]
+    assert sweep.expand_values([1, 2]) == [1, 2]
+
+
+def test_resume_drops_partial_record(tmp_path):
+    directory = str(tmp_path / 'sweep')
+    store = sweep.SweepStore(directory, GRID, FIXED, PERIODS)
+    store.append(sweep.run_points(GRID, FIXED, PERIODS, [0, 3]))
+
+    # A sweep killed part way through writing a record
+    with open(store.results_file, 'ab') as file:
+        file.write(b'\0' * (store.dtype.itemsize // 2))
+
+    reopened = sweep.SweepStore(directory, GRID, FIXED, PERIODS)
+    assert os.path.getsize(reopened.results_file) == 2 * reopened.dtype.itemsize
+    assert reopened.completed() == {0, 3}
+
+    sweep.run_sweep(directory, GRID, FIXED, PERIODS, workers=1)
+    results = sweep.SweepStore(directory).load()
+    assert sorted(results['index'].tolist()) == [0, 1, 2, 3]
+    assert np.all(np.isfinite(sweep.SweepStore(directory).to_grid('power_total_mean')))
+
+
+def test_store_refuses_a_different_sweep(tmp_path):
+    directory = str(tmp_path / 'sweep')
+    sweep.SweepStore(directory, GRID, FIXED, PERIODS)
+    try:
+        sweep.SweepStore(directory, GRID, FIXED, PERIODS + 1)
+    except ValueError:
+        return
+    raise AssertionError('a store with a different spec was reused')
+
+
+def test_failed_points_are_stored_as_nan(monkeypatch, capsys):
+    import buoy_simulation
+
+    run_simulation = buoy_simulation.run_simulation
+
+    def failing(parameters, metadata, **options):
+        if parameters['C_damper'] == 3e6:
+            raise FloatingPointError('overflow')
+        return run_simulation(parameters, metadata, **options)
+
+    monkeypatch.setattr(buoy_simulation, 'run_simulation', failing)
+    records = sweep.run_points(GRID, FIXED, PERIODS, [0, 2])
+    assert np.isfinite(records['power_total_mean'][0])
+    assert np.isnan(records['power_total_mean'][1])
+    assert "Point 2 ({'C_damper': 3000000.0, 'shape_buoy': 'sphere'}) failed: FloatingPointError('overflow')" in \
+        capsys.readouterr().out
+
+
+def test_event_counts_are_stored(tmp_path):
+    records = sweep.run_points({'Hs': [6.0]}, {'T': 7.8}, PERIODS, [0], events=True)
+    assert records['submerged'][0] > 0
+
+
+def test_cache_carries_over_between_chunks(tmp_path):
+    directory = str(tmp_path / 'cache')
+    sweep.run_points(GRID, FIXED, PERIODS, [0], cache_directory=directory)
+    sweep.run_points(GRID, FIXED, PERIODS, [0], cache_directory=directory)
+    cache = sweep.worker_cache(directory)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.memory_bytes > 0
+
+
+def test_other_errors_are_raised(monkeypatch):
+    import buoy_simulation
+
+    def failing(parameters, metadata, **options):
+        raise KeyError('T')
+
+    monkeypatch.setattr(buoy_simulation, 'run_simulation', failing)
+    with pytest.raises(KeyError):
+        sweep.run_points(GRID, FIXED, PERIODS, [0])
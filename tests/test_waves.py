@@ -0,0 +1,46 @@
+import numpy as np
+
+import buoy_simulation
+import waves
+
+
+def test_tabulated_sea_matches_direct_sum():
+    # Measured: 8e-8 m and 2e-7 m/s
+    sea = waves.jonswap(2.4, 7.8, components=300, seed=0)
+    table = sea.prepare((0, 600))
+    times = np.random.default_rng(1).uniform(0, 600, 5000)
+    exact = sea.evaluate(times)
+    tabulated = table.evaluate(times)
+    assert np.max(np.abs(exact[0] - tabulated[0])) < 1e-6
+    assert np.max(np.abs(exact[1] - tabulated[1])) < 1e-6
+
+
+def test_jonswap_has_its_significant_height():
+    # 4 sqrt(m0) of the components falls a little short of Hs, as the spectrum is cut at f_range
+    sea = waves.jonswap(2.4, 7.8, components=300, seed=0)
+    assert abs(4 * np.sqrt(np.sum(sea.amplitudes ** 2) / 2) - 2.4) < 0.02 * 2.4
+
+
+def test_seeded_seas_repeat():
+    first = waves.jonswap(2.4, 7.8, components=50, seed=3).evaluate(np.linspace(0, 100, 50))
+    second = waves.jonswap(2.4, 7.8, components=50, seed=3).evaluate(np.linspace(0, 100, 50))
+    assert np.array_equal(first, second)
+
+
+def test_scalar_functions_match_evaluate():
+    times = np.linspace(0, 60, 37)
+    metadata = buoy_simulation.wave_metadata(7.8, 2.4)
+    for forcing in [waves.RegularWave(2.4, 7.8, 0.3), waves.metadata_forcing(metadata),
+                    waves.jonswap(2.4, 7.8, components=40, seed=0).prepare((0, 60))]:
+        function = forcing.scalar_function()
+        scalar = np.array([function(t) for t in times.tolist()]).T
+        np.testing.assert_allclose(scalar, forcing.evaluate(times), rtol=1e-9, atol=1e-9)
+
+
+def test_sampled_wave_matches_metadata():
+    # A SampledWave made from wave_metadata is what run_simulation integrates with, at the samples themselves
+    metadata = buoy_simulation.wave_metadata(7.8, 2.4)
+    forcing = waves.metadata_forcing(metadata)
+    x, x_p = forcing.evaluate(np.asarray(metadata['xt'], dtype=float))
+    assert np.allclose(x, metadata['x'])
+    assert np.allclose(x_p, metadata['x_p'])
@@ -0,0 +1,260 @@
+import math
+import bisect
+import sys
+import time
+
+import numpy as np
+
+
+# Wave forcings for the solvers, giving elevation x and velocity x_p for an array of times or a single time
+
+
+class RegularWave:
+    # x = amplitude * sin(2 pi t / T + phase), the regular wave of the MATLAB script (which uses Hs as the amplitude),
+    # with its exact velocity. wave_metadata instead samples the wave and takes x_p as the difference between samples,
+    # which is what the MATLAB model was run with; use SampledWave.from_metadata to reproduce that
+    def __init__(self, amplitude, T, phase=0.0):
+        self.amplitude = float(amplitude)
+        self.T = float(T)
+        self.phase = float(phase)
+        self.omega = 2 * math.pi / self.T
+
+    def prepare(self, t_range):
+        return self
+
+    def evaluate(self, t):
+        angle = self.omega * np.asarray(t, dtype=float) + self.phase
+        return self.amplitude * np.sin(angle), self.amplitude * self.omega * np.cos(angle)
+
+    def scalar_function(self):
+        amplitude = self.amplitude
+        omega = self.omega
+        phase = self.phase
+        amplitude_omega = amplitude * omega
+        sin = math.sin
+        cos = math.cos
+
+        def forcing(t):
+            angle = omega * t + phase
+            return amplitude * sin(angle), amplitude_omega * cos(angle)
+
+        return forcing
+
+
+class SampledWave:
+    # Elevation and velocity sampled at times t, held constant outside them. On a uniform grid the sample is found by
+    # index arithmetic, anything else is bisected. Given the slopes of both series (e.g. a tabulated spectral wave,
+    # whose velocity and acceleration are known exactly), uniform grids are interpolated with cubic Hermite
+    # polynomials, otherwise linearly, as interp1 does
+    def __init__(self, t, x, x_p, x_slope=None, x_p_slope=None):
+        self.t = np.asarray(t, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        self.x_p = np.asarray(x_p, dtype=float)
+        self.t0 = float(self.t[0])
+        self.step = float(self.t[-1] - self.t[0]) / (len(self.t) - 1)
+        self.uniform = self.step > 0 and bool(np.all(np.abs(self.t - (self.t0 + np.arange(len(self.t)) * self.step))
+                                                     <= 1e-9 * max(1.0, abs(float(self.t[-1])))))
+        self.slopes = None
+        if x_slope is not None and x_p_slope is not None and self.uniform:
+            self.slopes = (np.asarray(x_slope, dtype=float), np.asarray(x_p_slope, dtype=float))
+
+    @staticmethod
+    def from_metadata(metadata):
+        # The wave of a wave_metadata dictionary, as the MATLAB model's interp1 calls read it
+        return SampledWave(metadata['xt'], metadata['x'], metadata['x_p'])
+
+    def prepare(self, t_range):
+        return self
+
+    def evaluate(self, t):
+        t = np.asarray(t, dtype=float)
+        if self.slopes is None:
+            return np.interp(t, self.t, self.x), np.interp(t, self.t, self.x_p)
+
+        s = np.clip((t - self.t0) / self.step, 0, len(self.t) - 1)
+        i = np.minimum(s.astype(int), len(self.t) - 2)
+        u = s - i
+        h00 = (1 + 2 * u) * (1 - u) ** 2
+        h10 = u * (1 - u) ** 2 * self.step
+        h01 = u ** 2 * (3 - 2 * u)
+        h11 = u ** 2 * (u - 1) * self.step
+        return tuple(h00 * values[i] + h10 * slopes[i] + h01 * values[i + 1] + h11 * slopes[i + 1]
+                     for values, slopes in zip((self.x, self.x_p), self.slopes))
+
+    def scalar_function(self):
+        # Python lists index faster than arrays for single values
+        t = self.t.tolist()
+        x = self.x.tolist()
+        x_p = self.x_p.tolist()
+        last = len(t) - 2
+        t0 = self.t0
+
+        if self.uniform and self.slopes is not None:
+            step = self.step
+            inv_step = 1 / step
+            x_slope, x_p_slope = (slopes.tolist() for slopes in self.slopes)
+            end = float(last + 1)
+
+            def forcing(s):
+                s = (s - t0) * inv_step
+                if s < 0:
+                    s = 0.0
+                elif s > end:
+                    s = end
+                i = int(s)
+                if i > last:
+                    i = last
+                u = s - i
+                v = 1 - u
+                h00 = (1 + 2 * u) * v * v
+                h10 = u * v * v * step
+                h01 = u * u * (3 - 2 * u)
+                h11 = -u * u * v * step
+                return (h00 * x[i] + h10 * x_slope[i] + h01 * x[i + 1] + h11 * x_slope[i + 1],
+                        h00 * x_p[i] + h10 * x_p_slope[i] + h01 * x_p[i + 1] + h11 * x_p_slope[i + 1])
+
+        elif self.uniform:
+            inv_step = 1 / self.step
+
+            def forcing(s):
+                s = (s - t0) * inv_step
+                if s < 0:
+                    s = 0.0
+                i = int(s)
+                if i > last:
+                    i = last
+                    if s > last + 1:
+                        s = last + 1.0
+                u = s - i
+                return x[i] + (x[i + 1] - x[i]) * u, x_p[i] + (x_p[i + 1] - x_p[i]) * u
+
+        else:
+            def forcing(s):
+                i = bisect.bisect_right(t, s) - 1
+                if i < 0:
+                    i = 0
+                elif i > last:
+                    i = last
+                u = min(max((s - t[i]) / (t[i + 1] - t[i]), 0.0), 1.0)
+                return x[i] + (x[i + 1] - x[i]) * u, x_p[i] + (x_p[i + 1] - x_p[i]) * u
+
+        return forcing
+
+
+class SpectralWave:
+    # Irregular sea as a sum of regular components, x = sum(a sin(omega t + phase)). Evaluating the sum costs one term
+    # per component, so prepare tabulates the run once on a uniform grid (dt well below the shortest period) with the
+    # exact velocity and acceleration as slopes, and the solver looks the table up instead
+    def __init__(self, amplitudes, omegas, phases, dt=0.05):
+        self.amplitudes = np.asarray(amplitudes, dtype=float)
+        self.omegas = np.asarray(omegas, dtype=float)
+        self.phases = np.asarray(phases, dtype=float)
+        self.dt = dt
+
+    def components(self, t, chunk_size=4096):
+        # Elevation, velocity and acceleration, summed over the components a chunk of times at a time
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.empty((3, len(t)))
+        a_omega = self.amplitudes * self.omegas
+        a_omega_2 = a_omega * self.omegas
+        for start in range(0, len(t), chunk_size):
+            angle = np.outer(t[start:start + chunk_size], self.omegas) + self.phases
+            sin = np.sin(angle)
+            cos = np.cos(angle)
+            out[0, start:start + chunk_size] = sin @ self.amplitudes
+            out[1, start:start + chunk_size] = cos @ a_omega
+            out[2, start:start + chunk_size] = -(sin @ a_omega_2)
+        return out
+
+    def evaluate(self, t):
+        shape = np.shape(t)
+        x, x_p, _ = self.components(t)
+        return x.reshape(shape), x_p.reshape(shape)
+
+    def prepare(self, t_range):
+        steps = max(1, int(math.ceil((t_range[1] - t_range[0]) / self.dt)))
+        t = np.linspace(t_range[0], t_range[1], steps + 1)
+        x, x_p, x_pp = self.components(t)
+        return SampledWave(t, x, x_p, x_slope=x_p, x_p_slope=x_pp)
+
+    def scalar_function(self):
+        # Direct sum, for when no time range is known; prepare(t_range).scalar_function() is much faster
+        amplitudes = self.amplitudes
+        omegas = self.omegas
+        phases = self.phases
+        a_omega = amplitudes * omegas
+
+        def forcing(t):
+            angle = omegas * t + phases
+            return float(np.sin(angle) @ amplitudes), float(np.cos(angle) @ a_omega)
+
+        return forcing
+
+
+def jonswap_spectrum(f, Hs, Tp, gamma=3.3):
+    # JONSWAP variance density S(f) in m^2/Hz, scaled so that 4 sqrt(m0) = Hs. gamma = 1 is Pierson-Moskowitz
+    f = np.asarray(f, dtype=float)
+    fp = 1 / Tp
+    sigma = np.where(f <= fp, 0.07, 0.09)
+    shape = f ** -5 * np.exp(-1.25 * (fp / f) ** 4) * gamma ** np.exp(-(f - fp) ** 2 / (2 * sigma ** 2 * fp ** 2))
+    # Normalised on a fine grid covering practically all of the energy
+    grid = np.linspace(0.2 * fp, 6 * fp, 4000)
+    grid_sigma = np.where(grid <= fp, 0.07, 0.09)
+    grid_shape = grid ** -5 * np.exp(-1.25 * (fp / grid) ** 4) * gamma ** np.exp(-(grid - fp) ** 2 / (2 * grid_sigma ** 2 * fp ** 2))
+    m0 = np.sum((grid_shape[1:] + grid_shape[:-1]) / 2 * np.diff(grid))
+    return shape * (Hs / 4) ** 2 / m0
+
+
+def jonswap(Hs, Tp, gamma=3.3, components=200, f_range=(0.5, 3.0), seed=None, dt=0.05):
+    # Random-phase sea state with a JONSWAP spectrum. Component frequencies are spread over f_range times the peak
+    # frequency, each placed at random within its band so the sea doesn't repeat after 1/df
+    rng = np.random.default_rng(seed)
+    fp = 1 / Tp
+    edges = np.linspace(f_range[0] * fp, f_range[1] * fp, components + 1)
+    df = np.diff(edges)
+    f = edges[:-1] + rng.uniform(0, 1, components) * df
+    amplitudes = np.sqrt(2 * jonswap_spectrum(f, Hs, Tp, gamma) * df)
+    return SpectralWave(amplitudes, 2 * np.pi * f, rng.uniform(0, 2 * np.pi, components), dt)
+
+
+def pierson_moskowitz(Hs, Tp, components=200, f_range=(0.5, 3.0), seed=None, dt=0.05):
+    return jonswap(Hs, Tp, 1.0, components, f_range, seed, dt)
+
+
+def forcing_metadata(forcing, t_range, n=None):
+    # wave_metadata-style dictionary for a forcing: the elevation sampled for the outputs that interpolate it (e.g.
+    # the wave in animation files), with the forcing itself under 'forcing' for the solvers. n defaults to 20 samples
+    # a second
+    n = int((t_range[1] - t_range[0]) * 20) + 1 if n is None else n
+    xt = np.linspace(t_range[0], t_range[1], n)
+    x, x_p = forcing.evaluate(xt)
+    return {'t_range': t_range, 'xt': xt, 'x': x, 'x_p': x_p, 'forcing': forcing}
+
+
+def metadata_forcing(metadata, t_range=None):
+    # The forcing a solver should use for metadata: its 'forcing' prepared for the run, or its sampled wave
+    forcing = metadata.get('forcing')
+    if forcing is None:
+        return SampledWave.from_metadata(metadata)
+    return forcing.prepare(metadata['t_range'] if t_range is None else t_range)
+
+
+if __name__ == '__main__':
+    # Times a call of each kind of forcing, and the error of a tabulated sea state against its direct sum
+    components = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    sea = jonswap(2.4, 7.8, components=components, seed=0)
+    table = sea.prepare((0, 3600))
+    times = np.random.default_rng(1).uniform(0, 3600, 20000)
+
+    exact = sea.evaluate(times)
+    tabulated = table.evaluate(times)
+    print('Tabulated {:d} component sea: largest elevation error {:.2g} m, velocity error {:.2g} m/s'.format(
+        components, np.max(np.abs(exact[0] - tabulated[0])), np.max(np.abs(exact[1] - tabulated[1]))))
+
+    for name, forcing in [('regular', RegularWave(2.4, 7.8)), ('sampled', SampledWave(np.linspace(0, 3600, 1000), np.zeros(1000), np.zeros(1000))),
+                          ('spectral, tabulated', table), ('spectral, direct sum', sea)]:
+        function = forcing.scalar_function()
+        start = time.perf_counter()
+        for t in times.tolist():
+            function(t)
+        print('{:s}: {:.2f} us per call'.format(name, (time.perf_counter() - start) / len(times) * 1e6))